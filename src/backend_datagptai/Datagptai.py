@@ -1,21 +1,44 @@
-
 #Datagptai.py backend code  of DataGPT.TSX
 import os
+import time
 import traceback
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import google.generativeai as genai
 from google.cloud import bigquery
-import plotly.express as px
 import pandas as pd
 import logging
+from bq_clients import get_bigquery_client
+from gemini_models import get_gemini_model, gemini_limiter, GeminiOverloadedError
+from metadata_catalog import catalog, schema_pairs, CATALOG_WARM_DATASETS
+from nl2sql import remember_sql, sql_cache_metadata
+from sql_cache import sql_cache, normalize_question
+from result_handoff import load_handoff_job, normalize_sql
+from insights import generate_insights
+from chart_data import build_chart, chart_axes
+from result_profile import result_section
+from streaming import STREAM_FORMATS, stream_analysis_events, sse_event
+from serialization import negotiate_format, serialize_result
+from pagination import read_first_page, read_next_page, run_first_page, clamp_page_size, single_page
+from preview import get_table_preview as read_table_preview, parse_columns, preview_cache, PREVIEW_ROWS
+from sql_validation import validate_sql, SqlValidationError
+from preflight import preflight, execution_config, dry_run_cache, QueryBudgetExceeded
+from query_pipeline import run_sql_pipeline
+from request_budget import (StageTimer, RequestAborted, deadline_from_headers, stage_latency,
+                            GEMINI_STAGES, ANALYSIS_STAGES, REUSED_ANALYSIS_STAGES)
+from value_index import value_index
+from example_store import example_store
+from local_engine import local_engine
+from conversation import conversation
+from single_flight import description_flight, query_flight, flight_key, single_flight_stats
+from analysis_jobs import analysis_jobs, job_status, SUCCEEDED, FAILED, CANCELLED
 
 app = Flask(__name__)
 CORS(app)
 
 # Configure credentials (these should be set as environment variables in production)
-BIGQUERY_CREDENTIALS = "E:\dataplatr_chatbot\src\credentials_resources\datagpt-bigquery.json"
-GEMINI_CREDENTIALS = "E:\dataplatr_chatbot\src\credentials_resources\datagpt-gemini.json"
+BIGQUERY_CREDENTIALS = os.environ.get("BIGQUERY_CREDENTIALS", "E:\dataplatr_chatbot\src\credentials_resources\datagpt-bigquery.json")
+GEMINI_CREDENTIALS = os.environ.get("GEMINI_CREDENTIALS", "E:\dataplatr_chatbot\src\credentials_resources\datagpt-gemini.json")
 
 # Dataset ID
 DATASET_ID = "dataplatr-sandbox.LLM_UseCases"
@@ -23,45 +46,26 @@ DATASET_ID = "dataplatr-sandbox.LLM_UseCases"
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-# Generation configuration for Gemini
-generation_config = {
-    "temperature": 0.4,
-    "top_p": 1,
-    "top_k": 32,
-    "max_output_tokens": 4096,
-}
 # Retrieve dataset schema
 def get_dataset_schema(dataset_id):
     """Fetches schema details for all tables in the specified dataset, including column types."""
     bq_client = initialize_bigquery()
-    tables = bq_client.list_tables(dataset_id)
-    schema = {}
-    for table in tables:
-        table_ref = f"{table.project}.{table.dataset_id}.{table.table_id}"
-        table_info = bq_client.get_table(table_ref)
-        schema[table.table_id] = [(field.name, field.field_type) for field in table_info.schema]
-    return schema
-
-# Gemini Configuration
-def configure_gemini():
+    tables = catalog.get_dataset(bq_client, dataset_id)
+    return {table_id: schema_pairs(entry) for table_id, entry in tables.items()}
+
+# Gemini Configuration (shared model handle per named generation config, see gemini_models.GENERATION_CONFIGS)
+def configure_gemini(config_name="default"):
     try:
-        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = GEMINI_CREDENTIALS
-        genai.configure()
-        
-        return genai.GenerativeModel(
-            model_name="gemini-pro",
-            generation_config=generation_config
-        )
+        return get_gemini_model(GEMINI_CREDENTIALS, config_name)
     except Exception as e:
         logger.error(f"Gemini configuration error: {e}")
         logger.error(traceback.format_exc())
         raise
 
-# BigQuery Initialization
+# BigQuery Initialization (returns the shared pooled client, credentials are loaded explicitly)
 def initialize_bigquery():
     try:
-        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = BIGQUERY_CREDENTIALS
-        return bigquery.Client()
+        return get_bigquery_client(BIGQUERY_CREDENTIALS)
     except Exception as e:
         logger.error(f"BigQuery initialization error: {e}")
         logger.error(traceback.format_exc())
@@ -147,75 +151,94 @@ def gemini_endpoint():
                 'message': 'All connection details and query are required'
             }), 400
 
-        # Retrieve schema for ONLY the selected table
-        bq_client = initialize_bigquery()
+        # Every stage checks the request deadline (X-Request-Deadline / X-Request-Timeout) before it starts
+        timer = StageTimer(deadline_from_headers(request.headers))
         table_ref = f"{project_id}.{dataset_id}.{table_id}"
-        table = bq_client.get_table(table_ref)
-        
-        # Create schema just for the selected table
-        schema = {
-            table_id: [(field.name, field.field_type) for field in table.schema]
-        }
-
-        # Format the schema string specifically for the selected table
-        schema_string = f"Table: {table_name}\nColumns: {', '.join([f'{name} ({dtype})' for name, dtype in schema[table_id]])}"
-
-        model = configure_gemini()
-
-        # Generate SQL query dynamically
-        prompt = f"""
-        Convert the following natural language query into an SQL query. Use ONLY the columns from the selected table: {table_name}
-
-        Dataset schema for selected table:
-        {schema_string}
-
-        User query: {user_query}
-
-         Provide the SQL query that answers the user's question, ensuring the following:
-         1. Use only BigQuery-compatible syntax and functions and do not use functions as 'STRFTIME()' or STRFTIME_UTC which are not supported by BigQuery.
-         2. When applying filters:
-            - Prioritize using teh most relavant column with distinct values that closely match the keywords in the User query.
-            - For example, if the user query mentions "Purchase Invoices" and the dataset schema contains distinct values in multiple columns such as ['Purchase Invoices', 'Sales Orders'] in `JournalCategory` or `TransactionType`, prefer the column that aligns with the user's intent, such as `JournalCategory`.
-         3. If multiple columns have similar values, use the column with the most meaningful relationship to the User query context. For instance, for financial transactions, `JournalCategory` should be prioritized over `TransactionType`.
-
-         4. If no data is retrieved from BigQuery, consider refining the query logic by re-evaluating the column selection or filters.
-        """
-
-        response = model.generate_content([prompt])
-        query = response.text.strip().replace("```sql", "").replace("```", "").strip()
-
-
-        # Validate that the query uses only the selected table
-        if table_id.lower() not in query.lower():
-            logger.error(f"Query does not match the selected table: {table_name}")
-            return jsonify({
-                'error': True,
-                'message': f'Query must be based on selected table: {table_name}. Please select the correct table or rephrase your query.'
-            }), 400
-
-        # Execute query
-        query_job = bq_client.query(query)
-        df = query_job.to_dataframe()
-        datetime_column = [col for col in df.columns if
-    pd.api.types.is_datetime64_any_dtype(df[col])]
-        df=df.dropna(subset=datetime_column)
-        
-        # If no data is returned
-        if df.empty:
-            return jsonify({
-                'error': True,
-                'message': 'No data found matching the query for the selected table.'
-            }), 404
 
-        # Description prompt with table-specific context
+        # Follow-ups that only filter, sort or cut the session's previous result ("only 2024",
+        # "sort by revenue", "top 5") are answered from that result: no SQL generation, no query job
+        session_id = data.get('session_id') or request.headers.get('X-Session-Id')
+        follow_up = None
+        if session_id:
+            with timer.stage('follow_up'):
+                follow_up = conversation.answer(session_id, user_query, table_ref)
+
+        if follow_up is not None:
+            query, df, result_handle, total_rows = follow_up['sql'], follow_up['df'], follow_up['result_handle'], None
+            coalesced = []
+            metadata = {'follow_up': follow_up['plan'], 'engine': follow_up['engine']}
+        else:
+            # Requests that cannot finish in time given recent stage latencies are shed with a 503 up front
+            timer.check(*GEMINI_STAGES)
+
+            # Retrieve schema for ONLY the selected table
+            bq_client = initialize_bigquery()
+            with timer.stage('catalog'):
+                table = catalog.get_table(bq_client, table_ref)
+
+            # Generate SQL (answered from the SQL cache for repeated questions), validate it locally,
+            # dry-run it against the bytes budget and run it, reading only the rows needed for the
+            # emptiness check and description sample. Failed or empty attempts are sent back to
+            # Gemini for a bounded number of repairs. The job is handed to /api/bigquery through
+            # result_handle so the query is not run twice.
+            try:
+                outcome = run_sql_pipeline(
+                    bq_client, configure_gemini, user_query, table_name, table,
+                    user=request.headers.get('X-User-Id'), confirmed=bool(data.get('confirm_cost')),
+                    deadline=timer.deadline, timer=timer
+                )
+            except SqlValidationError as e:
+                logger.error(f"Generated SQL rejected for {table_name}: {e}")
+                return jsonify({
+                    'error': True,
+                    'message': f'{e}. Please select the correct table or rephrase your query.'
+                }), 400
+            query, df, result_handle, total_rows = outcome['sql'], outcome['df'], outcome['result_handle'], outcome['total_rows']
+
+            # If no data is returned
+            if df.empty:
+                return jsonify({
+                    'error': True,
+                    'message': 'No data found matching the query for the selected table.',
+                    'metadata': {'repair': outcome['repair'], 'timings_ms': timer.as_dict()}
+                }), 404
+
+            # The query returned data, so cache it for identical questions
+            remember_sql(query, outcome['sql_info'])
+            if session_id:
+                # The probe rows are the whole result when it is that small; otherwise /api/bigquery attaches it
+                complete = outcome['total_rows'] is not None and outcome['total_rows'] <= len(df)
+                conversation.remember(session_id, user_query, query, table_ref, df if complete else None)
+
+            coalesced = outcome['coalesced']
+            metadata = {
+                'sql_cache': sql_cache_metadata(outcome['sql_info']),
+                'sql_validation': outcome['validation'],
+                'preflight': outcome['preflight'],
+                'repair': outcome['repair'],
+                'value_matches': outcome['value_matches'],
+                'schema': outcome['schema'],
+                'examples': outcome['examples'],
+                'engine': outcome['engine'],
+            }
+
+        # Description prompt with the result's column statistics (see result_profile)
         description_prompt = f"""
         you are an AI assistant that summarizes the results of following query in plain english.
         SQL Query: {query}
-        Query Results (Sample): {df.head(5).to_json()}
+        {result_section(df, total_rows)}
         describe in brief what the data represents , 
         key metrics,and any important insights or patterns seamlessley without any astricks
         """
-        description_response = model.generate_content([description_prompt])
+        # Requests that coalesced on the same query build the same prompt and share one description call
+        with timer.stage('description'):
+            description_response, shared = description_flight.do(
+                flight_key('description', description_prompt),
+                configure_gemini("summary").generate_content, [description_prompt],
+                timeout=timer.time_left()
+            )
+        if shared:
+            coalesced = coalesced + ['description']
         result_description = description_response.text.strip()
 
         logger.info(f"Generated SQL Query: {query}")
@@ -224,9 +247,23 @@ def gemini_endpoint():
             'sql_query': query,
             'original_query': user_query,
             'query_description': result_description,
-            'table_reference': table_name
+            'table_reference': table_name,
+            'result_handle': result_handle,
+            'metadata': {**metadata, 'coalesced': coalesced, 'timings_ms': timer.as_dict()}
         })
     
+    except QueryBudgetExceeded as e:
+        logger.warning(f"Gemini Endpoint - Over budget: {e}")
+        return jsonify(e.to_dict()), 409
+
+    except RequestAborted as e:
+        logger.warning(f"Gemini Endpoint - Aborted: {e}")
+        return jsonify({'error': True, 'message': str(e)}), e.status_code, e.headers
+
+    except GeminiOverloadedError as e:
+        logger.warning(f"Gemini Endpoint - Rejected: {e}")
+        return jsonify({'error': True, 'message': str(e)}), 503, {'Retry-After': '1'}
+
     except Exception as e:
         logger.error(f"Gemini Endpoint Error: {e}")
         logger.error(traceback.format_exc())
@@ -236,22 +273,6 @@ def gemini_endpoint():
             'details': str(e)
         }), 500
 
-def convert_datetime(obj):
-    """
-    Convert datetime objects to ISO format string or None for NaT values.
-    
-    Args:
-        obj: Input value to convert
-    
-    Returns:
-        Converted value (string, None, or original value)
-    """
-    if pd.isna(obj):
-        return None
-    if isinstance(obj, pd.Timestamp):
-        return obj.isoformat()
-    return obj
-
 @app.route('/api/bigquery', methods=['POST'])
 def bigquery_endpoint():
     try:
@@ -260,8 +281,10 @@ def bigquery_endpoint():
         data = request.json
         
         sql_query = data.get('sql_query', '')
-        user_query = data.get('original_query', '')
+        user_query = data.get('original_query') or ''
         query_description = data.get('query_description', '')
+        result_handle = data.get('result_handle')
+        session_id = data.get('session_id') or request.headers.get('X-Session-Id')
 
         if not sql_query:
             return jsonify({
@@ -269,12 +292,57 @@ def bigquery_endpoint():
                 'message': 'No SQL query provided'
             }), 400
 
+        # Output format: records (default), columnar or arrow (body/query "format" or Accept header)
+        try:
+            result_format = negotiate_format(data.get('format') or request.args.get('format'), request.headers.get('Accept'))
+        except ValueError as e:
+            return jsonify({'error': True, 'message': str(e)}), 400
+
+        timer = StageTimer(deadline_from_headers(request.headers))
         bq_client = initialize_bigquery()
         
-        logger.info(f"Executing SQL Query: {sql_query}")
-        query_job = bq_client.query(sql_query)
-        
-        df = query_job.to_dataframe()
+        # Reuse the job already run by /gemini when a result handle is supplied
+        query_job = load_handoff_job(bq_client, result_handle, sql_query) if result_handle else None
+        result_reused = query_job is not None
+        estimate = None
+        coalesced = []
+        # Follow-ups answered by /gemini from the session's previous result are served from that frame
+        local = conversation.load(result_handle, sql_query) if result_handle else None
+        if not result_reused and local is None:
+            validate_sql(sql_query, auto_limit=0)
+            if local_engine.available:
+                # Small or hot tables are answered from their local extract when DuckDB can run the SQL;
+                # results larger than a page go to BigQuery so they can be paged
+                with timer.stage('execute_local'):
+                    local = local_engine.run(bq_client, sql_query, max_rows=clamp_page_size(data.get('page_size')))
+        if local is None:
+            timer.check(*(REUSED_ANALYSIS_STAGES if result_reused else ANALYSIS_STAGES))
+        # Only the first page is materialized (page_size, capped by MAX_ROWS_PER_REQUEST);
+        # later pages are read from the job's destination table through /api/bigquery/page
+        start = time.perf_counter()
+        if local is not None:
+            df, engine = local
+            page = single_page(df)
+        elif result_reused:
+            logger.info(f"Reusing results of job {query_job.job_id} for SQL Query: {sql_query}")
+            with timer.stage('read_results'):
+                df, page = read_first_page(bq_client, query_job, data.get('page_size'), timer.deadline)
+        else:
+            with timer.stage('dry_run'):
+                estimate = preflight(bq_client, sql_query, request.headers.get('X-User-Id'), bool(data.get('confirm_cost')))
+            logger.info(f"Executing SQL Query: {sql_query}")
+            start = time.perf_counter()
+            # Identical SQL already running for another request is waited for, not run again
+            with timer.stage('execute'):
+                (query_job, df, page), shared = query_flight.do(
+                    flight_key('first_page', normalize_sql(sql_query), clamp_page_size(data.get('page_size'))),
+                    run_first_page, bq_client, sql_query, execution_config(), data.get('page_size'), timer,
+                    timeout=timer.time_left()
+                )
+            if shared:
+                coalesced.append('execute')
+        if local is None:
+            engine = {'engine': 'bigquery', 'ms': round((time.perf_counter() - start) * 1000, 1)}
         
         # Handle datetime columns
         datetime_columns = [col for col in df.columns if pd.api.types.is_datetime64_any_dtype(df[col])]
@@ -285,6 +353,10 @@ def bigquery_endpoint():
         
         logger.info(f"Query Results - Rows: {len(df)}, Columns: {list(df.columns)}")
 
+        if session_id and not page['has_more']:
+            # The whole result is in hand, so the session's next follow-up can be answered from it
+            conversation.attach_result(session_id, sql_query, df)
+
         if df.empty:
             return jsonify({
                 'error': True,
@@ -294,80 +366,60 @@ def bigquery_endpoint():
                 'chart_type': None
             }), 200
 
-        model = configure_gemini()
+        # Description, chart type and chart description (one structured LLM call, parallel fallback)
+        with timer.stage('insights'):
+            insights, shared = description_flight.do(
+                flight_key('insights', normalize_sql(sql_query), normalize_question(user_query), len(df), list(df.columns)),
+                generate_insights, configure_gemini, df, user_query, sql_query,
+                timeout=timer.time_left()
+            )
+        if shared:
+            coalesced.append('insights')
 
-        # Safely get sample values
-        def get_sample_values(column):
-            unique_values = column.unique()[:4]
-            return ', '.join(map(lambda x: str(x) if x is not None else 'N/A', unique_values))
-
-        sample_values_col1 = get_sample_values(df[df.columns[0]])
-        sample_values_col2 = get_sample_values(df[df.columns[1]])
-
-        description_prompt = f"""
-        You are an AI assistant that summarizes query results in plain English.
-        The result contains the following columns:{', '.join(df.columns.tolist())}.
-        For the column {df.columns[0]}, here are some sample values: {sample_values_col1}.
-        For the column {df.columns[1]}, here are some sample values: {sample_values_col2}.
-        Question: {user_query}
-        SQL Query: {sql_query}
-        SQL Result: Describe what the result dataframe represents and not the sql query itself, key metrics, and any important aggregations or patterns for eg: "based on the results, category a has more sales than category b".
-        Provide your response in the format:
-        Description: [Summary of what the SQL Result contains including key metrics and patterns]
-        """
-        description_response = model.generate_content([description_prompt])
-        data_preview_description = description_response.text.strip()
-
-        viz_prompt = f"""
-        You are an AI assistant that recommends appropriate data visualizations.
-        Question: {user_query}
-        SQL Query: {sql_query}
-        Result Description: {data_preview_description}
-        Provide your response in the format:
-        Viz: [Chart type or "none"]
-        """
-        viz_response = model.generate_content([viz_prompt])
-
-        chart_type = None
-        if "Viz:" in viz_response.text:
-            chart_type = viz_response.text.split("Viz:")[1].split("\n")[0].strip().lower()
-            
-            valid_chart_types = ["bar", "line", "scatter", "pie"]
-            if chart_type and " " in chart_type:
-                chart_type = chart_type.split()[0]
-            
-            if chart_type not in valid_chart_types:
-                chart_type = None
-
-        chart_description_prompt = f"""
-        You are an AI assistant that describes charts in simple terms.
-        Chart Type: {chart_type}
-        Data Description: {data_preview_description}
-        Describe what the chart illustrates and any key insights.
-        Provide your response in the format:
-        Chart Description: [Explanation of what the chart illustrates]
-        """
-        chart_description_response = model.generate_content([chart_description_prompt])
-        chart_description = chart_description_response.text.strip()
-
-        # Convert dataframe to dict with datetime handling
-        processed_data = df.apply(
-            lambda col: col.map(convert_datetime) if pd.api.types.is_datetime64_any_dtype(col) else col
-        )
+        # Chart-ready points (top-N categories, LTTB-downsampled series) so the browser never plots raw rows
+        with timer.stage('chart'):
+            chart = build_chart(df, insights['chart_type'], *chart_axes(insights))
 
         response_data = {
-            'data': processed_data.to_dict(orient='records'),
-            'columns': df.columns.tolist(),
-            'chart_type': chart_type,
-            'llm_recommendation': viz_response.text,
-            'data_preview_description': data_preview_description,
-            'chart_description': chart_description,
-            'query_description': query_description
+            'chart_type': insights['chart_type'],
+            'llm_recommendation': insights['llm_recommendation'],
+            'data_preview_description': insights['data_preview_description'],
+            'chart_description': insights['chart_description'],
+            'chart': chart,
+            'query_description': query_description,
+            'pagination': page,
+            'metadata': {
+                'result_reused': result_reused,
+                'preflight': estimate,
+                'insight_mode': insights['insight_mode'],
+                'chart_recommendation': insights['chart_recommendation'],
+                'engine': engine,
+                'coalesced': coalesced,
+                'timings_ms': timer.as_dict()
+            }
         }
 
+        # Vectorized datetime/NaN handling, then records/columnar JSON or Arrow IPC
+        body, mimetype = serialize_result(df, response_data, result_format)
+
         logger.info("BigQuery Endpoint - Response Prepared")
-        return jsonify(response_data)
+        return Response(body, mimetype=mimetype)
     
+    except SqlValidationError as e:
+        return jsonify({'error': True, 'message': str(e)}), 400
+
+    except QueryBudgetExceeded as e:
+        logger.warning(f"BigQuery Endpoint - Over budget: {e}")
+        return jsonify(e.to_dict()), 409
+
+    except RequestAborted as e:
+        logger.warning(f"BigQuery Endpoint - Aborted: {e}")
+        return jsonify({'error': True, 'message': str(e)}), e.status_code, e.headers
+
+    except GeminiOverloadedError as e:
+        logger.warning(f"BigQuery Endpoint - Rejected: {e}")
+        return jsonify({'error': True, 'message': str(e)}), 503, {'Retry-After': '1'}
+
     except Exception as e:
         logger.error(f"BigQuery Endpoint Error: {e}")
         logger.error(traceback.format_exc())
@@ -395,27 +447,24 @@ def get_table_preview():
             }), 400
             
         bq_client = initialize_bigquery()
-        
-        # Construct the preview query
-        query = f"""
-        SELECT *
-        FROM `{project_id}.{dataset_id}.{table_id}`
-        LIMIT 15
-        """
-        
-        query_job = bq_client.query(query)
-        df = query_job.to_dataframe()
-        
-        # Convert datetime columns
-        processed_data = df.apply(
-            lambda col: col.map(convert_datetime) if pd.api.types.is_datetime64_any_dtype(col) else col
+
+        # tabledata.list read of the first rows: no query job, nothing billed
+        df, preview_info = read_table_preview(
+            bq_client,
+            f"{project_id}.{dataset_id}.{table_id}",
+            columns=parse_columns(request.args.get('columns')),
+            max_rows=request.args.get('max_rows', PREVIEW_ROWS, type=int)
         )
-        
+
+        body, mimetype = serialize_result(df, {'metadata': {'preview': preview_info}})
+        return Response(body, mimetype=mimetype)
+
+    except ValueError as e:
         return jsonify({
-            'data': processed_data.to_dict(orient='records'),
-            'columns': df.columns.tolist()
-        })
-        
+            'error': True,
+            'message': str(e)
+        }), 400
+
     except Exception as e:
         logger.error(f"Table Preview Error: {e}")
         logger.error(traceback.format_exc())
@@ -425,5 +474,162 @@ def get_table_preview():
             'details': str(e)
         }), 500
 
+@app.route('/api/bigquery/page', methods=['POST'])
+def bigquery_page_endpoint():
+    """Next page of a /api/bigquery result, read with the cursor from the previous response (no new query job)."""
+    try:
+        data = request.json
+        cursor = data.get('cursor')
+        if not cursor:
+            return jsonify({'error': True, 'message': 'A cursor is required'}), 400
+
+        try:
+            result_format = negotiate_format(data.get('format') or request.args.get('format'), request.headers.get('Accept'))
+            bq_client = initialize_bigquery()
+            df, page = read_next_page(bq_client, cursor)
+        except ValueError as e:
+            return jsonify({'error': True, 'message': str(e)}), 400
+
+        body, mimetype = serialize_result(df, {'pagination': page}, result_format)
+        return Response(body, mimetype=mimetype)
+
+    except Exception as e:
+        logger.error(f"BigQuery Page Endpoint Error: {e}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': True, 'message': 'Failed to fetch result page', 'details': str(e)}), 500
+
+@app.route('/api/bigquery/stream', methods=['POST'])
+def bigquery_stream_endpoint():
+    """Streaming variant of /api/bigquery: column metadata, row pages, then Gemini text as it is generated."""
+    try:
+        data = request.json
+        sql_query = data.get('sql_query', '')
+        user_query = data.get('original_query') or ''
+        stream_format = data.get('format') or request.args.get('format', 'ndjson')
+
+        if not sql_query:
+            return jsonify({'error': True, 'message': 'No SQL query provided'}), 400
+        if stream_format not in STREAM_FORMATS:
+            return jsonify({'error': True, 'message': f'Unsupported stream format: {stream_format}'}), 400
+
+        bq_client = initialize_bigquery()
+        result_handle = data.get('result_handle')
+        query_job = load_handoff_job(bq_client, result_handle, sql_query) if result_handle else None
+        if query_job is None:
+            validate_sql(sql_query, auto_limit=0)
+            preflight(bq_client, sql_query, request.headers.get('X-User-Id'), bool(data.get('confirm_cost')))
+            logger.info(f"Streaming SQL Query: {sql_query}")
+            query_job = bq_client.query(sql_query, job_config=execution_config())
+
+        mimetype, encode_event = STREAM_FORMATS[stream_format]
+        events = stream_analysis_events(query_job, configure_gemini, user_query, sql_query)
+        return Response(stream_with_context(encode_event(event) for event in events), mimetype=mimetype)
+
+    except SqlValidationError as e:
+        return jsonify({'error': True, 'message': str(e)}), 400
+
+    except QueryBudgetExceeded as e:
+        return jsonify(e.to_dict()), 409
+
+    except Exception as e:
+        logger.error(f"BigQuery Stream Endpoint Error: {e}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': True, 'message': 'Failed to start result stream', 'details': str(e)}), 500
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_analysis_job():
+    """Asynchronous /api/bigquery: validates and preflight checks the SQL, then returns a job id right away."""
+    try:
+        data = request.json
+        sql_query = data.get('sql_query', '')
+        if not sql_query:
+            return jsonify({'error': True, 'message': 'No SQL query provided'}), 400
+        try:
+            result_format = negotiate_format(data.get('format') or request.args.get('format'), request.headers.get('Accept'))
+        except ValueError as e:
+            return jsonify({'error': True, 'message': str(e)}), 400
+
+        bq_client = initialize_bigquery()
+        validate_sql(sql_query, auto_limit=0)
+        estimate = preflight(bq_client, sql_query, request.headers.get('X-User-Id'), bool(data.get('confirm_cost')))
+        job = analysis_jobs.submit(bq_client, configure_gemini, {
+            'sql_query': sql_query,
+            'original_query': data.get('original_query') or '',
+            'query_description': data.get('query_description', ''),
+            'page_size': data.get('page_size'),
+            'format': result_format,
+            'preflight': estimate,
+        })
+        return jsonify(job), 202
+
+    except SqlValidationError as e:
+        return jsonify({'error': True, 'message': str(e)}), 400
+
+    except QueryBudgetExceeded as e:
+        return jsonify(e.to_dict()), 409
+
+    except Exception as e:
+        logger.error(f"Job Submit Error: {e}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': True, 'message': 'Failed to submit analysis job', 'details': str(e)}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_analysis_job(job_id):
+    job = analysis_jobs.store.get(job_id)
+    if job is None:
+        return jsonify({'error': True, 'message': 'Unknown job'}), 404
+    return jsonify(job_status(job))
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def get_analysis_job_result(job_id):
+    """Finished job: the /api/bigquery response body. Unfinished: 202 with the job status."""
+    job = analysis_jobs.store.get(job_id)
+    if job is None:
+        return jsonify({'error': True, 'message': 'Unknown job'}), 404
+    if job['state'] == SUCCEEDED:
+        return Response(job['result'], mimetype=job['mimetype'])
+    if job['state'] == FAILED:
+        return jsonify({'error': True, 'message': 'Analysis job failed', 'details': job['error']}), 500
+    if job['state'] == CANCELLED:
+        return jsonify({'error': True, 'message': 'Analysis job was cancelled'}), 410
+    return jsonify(job_status(job)), 202
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_analysis_job(job_id):
+    job = analysis_jobs.cancel(initialize_bigquery(), job_id)
+    if job is None:
+        return jsonify({'error': True, 'message': 'Unknown job'}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def analysis_job_events(job_id):
+    """Server-Sent Events with the job's status on every change, until it finishes."""
+    if analysis_jobs.store.get(job_id) is None:
+        return jsonify({'error': True, 'message': 'Unknown job'}), 404
+    events = analysis_jobs.events(job_id)
+    return Response(stream_with_context(sse_event(event) for event in events), mimetype='text/event-stream')
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify({
+        'metadata_catalog': catalog.stats(),
+        'gemini': gemini_limiter.stats(),
+        'sql_cache': sql_cache.stats(),
+        'dry_run_cache': dry_run_cache.stats(),
+        'preview': preview_cache.stats(),
+        'value_index': value_index.stats(),
+        'examples': example_store.stats(),
+        'single_flight': single_flight_stats(),
+        'jobs': analysis_jobs.stats(),
+        'stage_latency': stage_latency.stats(),
+        'local_engine': local_engine.stats(),
+        'conversation': conversation.stats()
+    })
+
+# Warm the metadata catalog in the background (CATALOG_WARM_DATASETS) so first questions skip metadata round trips
+catalog.warm_up_in_background(initialize_bigquery, CATALOG_WARM_DATASETS)
+# Extract the hot tables (LOCAL_ENGINE_HOT_TABLES) for the local engine
+local_engine.warm_up_in_background(initialize_bigquery)
+
 if __name__ == '__main__':
     app.run(debug=True, port=8080)
\ No newline at end of file
@@ -0,0 +1,412 @@
+#analysis_jobs.py asynchronous /api/bigquery analyses: submit returns a job id, results are polled, streamed or cancelled
+import os
+import abc
+import time
+import uuid
+import json
+import sqlite3
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from pagination import read_first_page
+from insights import generate_insights
+from chart_data import build_chart, chart_axes
+from serialization import serialize_result, encode_json
+from preflight import execution_config
+from result_handoff import make_job_handle
+
+logger = logging.getLogger(__name__)
+
+# SQLite file holding job state (empty = in-memory store, state is lost on restart)
+JOB_STORE_DB = os.environ.get("JOB_STORE_DB", "")
+# Analyses running at the same time; further submissions wait in the queue
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "8"))
+# Finished jobs (and their results) are kept this long
+JOB_TTL_SECONDS = int(os.environ.get("JOB_TTL_SECONDS", "3600"))
+# Queued and running jobs are touched this often by the process working on them
+JOB_HEARTBEAT_SECONDS = float(os.environ.get("JOB_HEARTBEAT_SECONDS", "30"))
+# Unfinished jobs with no stage change or heartbeat for this long are failed (their process went away)
+JOB_STALE_SECONDS = float(os.environ.get("JOB_STALE_SECONDS", "300"))
+# How often the events stream checks the job for changes
+JOB_EVENT_POLL_SECONDS = float(os.environ.get("JOB_EVENT_POLL_SECONDS", "1"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = {SUCCEEDED, FAILED, CANCELLED}
+
+JOB_FIELDS = ("job_id", "state", "stage", "created_at", "updated_at", "request", "query_job", "error", "result", "mimetype")
+
+class JobStore(abc.ABC):
+    """
+    Where job state lives. Jobs are plain dicts with JOB_FIELDS; request is
+    the submitted parameters, query_job the BigQuery job handle and result
+    the encoded response body. Implementations must be thread safe.
+    """
+
+    @abc.abstractmethod
+    def create(self, job):
+        """Store a new job."""
+
+    @abc.abstractmethod
+    def get(self, job_id):
+        """The job, or None when it is unknown or expired."""
+
+    @abc.abstractmethod
+    def update(self, job_id, fields, only_if=None):
+        """
+        Update a job's fields.
+
+        Args:
+            job_id: Job to update
+            fields: Field values to set (updated_at is set automatically)
+            only_if: Optional set of states; the update only applies when
+                the job is currently in one of them
+
+        Returns:
+            True when the job was updated
+        """
+
+    @abc.abstractmethod
+    def touch(self, job_ids):
+        """Heartbeat: set updated_at on the given jobs that are still queued or running."""
+
+    @abc.abstractmethod
+    def purge(self, before):
+        """Drop finished jobs last updated before the given time."""
+
+    @abc.abstractmethod
+    def expire(self, before, message):
+        """Fail unfinished jobs not updated (stage change or heartbeat) since the given time."""
+
+    @abc.abstractmethod
+    def counts(self):
+        """Number of jobs per state."""
+
+class InMemoryJobStore(JobStore):
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job):
+        with self._lock:
+            self._jobs[job['job_id']] = dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def update(self, job_id, fields, only_if=None):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or (only_if is not None and job['state'] not in only_if):
+                return False
+            job.update(fields, updated_at=time.time())
+            return True
+
+    def touch(self, job_ids):
+        now = time.time()
+        with self._lock:
+            for job_id in job_ids:
+                job = self._jobs.get(job_id)
+                if job is not None and job['state'] not in FINISHED_STATES:
+                    job['updated_at'] = now
+
+    def purge(self, before):
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._jobs.items()
+                           if job['state'] in FINISHED_STATES and job['updated_at'] < before]:
+                del self._jobs[job_id]
+
+    def expire(self, before, message):
+        with self._lock:
+            for job in self._jobs.values():
+                if job['state'] not in FINISHED_STATES and job['updated_at'] < before:
+                    job.update(state=FAILED, stage=None, error=message, updated_at=time.time())
+
+    def counts(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job['state']] = counts.get(job['state'], 0) + 1
+            return counts
+
+class SQLiteJobStore(JobStore):
+    """Job state in a local SQLite file, so status survives restarts and is shared by workers on one host."""
+
+    def __init__(self, db_path):
+        self._conn = sqlite3.connect(db_path, timeout=5, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS analysis_jobs ("
+                "job_id TEXT PRIMARY KEY, state TEXT, stage TEXT, created_at REAL, updated_at REAL, "
+                "request TEXT, query_job TEXT, error TEXT, result BLOB, mimetype TEXT)"
+            )
+
+    def create(self, job):
+        row = {**job, 'request': json.dumps(job['request'])}
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT INTO analysis_jobs ({', '.join(JOB_FIELDS)}) VALUES ({', '.join('?' for _ in JOB_FIELDS)})",
+                [row.get(field) for field in JOB_FIELDS]
+            )
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(JOB_FIELDS)} FROM analysis_jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(JOB_FIELDS, row))
+        job['request'] = json.loads(job['request'])
+        return job
+
+    def update(self, job_id, fields, only_if=None):
+        fields = {**fields, 'updated_at': time.time()}
+        sql = f"UPDATE analysis_jobs SET {', '.join(f'{field} = ?' for field in fields)} WHERE job_id = ?"
+        params = list(fields.values()) + [job_id]
+        if only_if is not None:
+            sql += f" AND state IN ({', '.join('?' for _ in only_if)})"
+            params += list(only_if)
+        with self._lock, self._conn:
+            return self._conn.execute(sql, params).rowcount > 0
+
+    def touch(self, job_ids):
+        job_ids = list(job_ids)
+        if not job_ids:
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE analysis_jobs SET updated_at = ? WHERE job_id IN ({', '.join('?' for _ in job_ids)}) "
+                "AND state IN (?, ?)",
+                (time.time(), *job_ids, QUEUED, RUNNING)
+            )
+
+    def purge(self, before):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM analysis_jobs WHERE updated_at < ? AND state IN (?, ?, ?)",
+                (before, *FINISHED_STATES)
+            )
+
+    def expire(self, before, message):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE analysis_jobs SET state = ?, stage = NULL, error = ?, updated_at = ? "
+                "WHERE updated_at < ? AND state IN (?, ?)",
+                (FAILED, message, time.time(), before, QUEUED, RUNNING)
+            )
+
+    def counts(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT state, COUNT(*) FROM analysis_jobs GROUP BY state").fetchall())
+
+def make_job_store(db_path=JOB_STORE_DB):
+    return SQLiteJobStore(db_path) if db_path else InMemoryJobStore()
+
+def job_status(job):
+    """Public view of a job (no request parameters or result body)."""
+    return {
+        'job_id': job['job_id'],
+        'state': job['state'],
+        'stage': job['stage'],
+        'created_at': job['created_at'],
+        'updated_at': job['updated_at'],
+        'error': job['error'],
+        'result_ready': job['state'] == SUCCEEDED,
+    }
+
+class AnalysisJobs:
+    """
+    Runs /api/bigquery analyses (query, first page, insights) on a
+    dedicated worker pool so the submitting request returns immediately.
+    """
+
+    def __init__(self, store, workers=JOB_WORKERS, heartbeat_seconds=JOB_HEARTBEAT_SECONDS):
+        self.store = store
+        self.heartbeat_seconds = heartbeat_seconds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analysis-job")
+        self._query_jobs = {}  # job id -> BigQuery job started by this process
+        self._active = set()  # queued or running jobs owned by this process, kept alive by the heartbeat
+        self._heartbeat_thread = None
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.cancelled = 0
+
+    def submit(self, client, model_factory, params):
+        """
+        Queue an analysis.
+
+        Args:
+            client: BigQuery client
+            model_factory: configure_gemini, called with a generation config name
+            params: sql_query, original_query, query_description, page_size
+                and format, already validated and preflight checked
+
+        Returns:
+            The job's public status
+        """
+        now = time.time()
+        self.store.purge(now - JOB_TTL_SECONDS)
+        self.store.expire(now - JOB_STALE_SECONDS, "Job stopped reporting progress")
+        job = {
+            'job_id': uuid.uuid4().hex, 'state': QUEUED, 'stage': None, 'created_at': now, 'updated_at': now,
+            'request': params, 'query_job': None, 'error': None, 'result': None, 'mimetype': None,
+        }
+        self.store.create(job)
+        with self._lock:
+            self.submitted += 1
+            self._active.add(job['job_id'])
+            if self._heartbeat_thread is None:
+                self._heartbeat_thread = threading.Thread(target=self._heartbeat, name="analysis-job-heartbeat", daemon=True)
+                self._heartbeat_thread.start()
+        self._executor.submit(self._run, job['job_id'], client, model_factory, params)
+        logger.info(f"Analysis job {job['job_id']} queued")
+        return job_status(job)
+
+    def _heartbeat(self):
+        """Touch this process's unfinished jobs so a long BigQuery job or queue wait is not expired as stale."""
+        while True:
+            time.sleep(self.heartbeat_seconds)
+            with self._lock:
+                active = list(self._active)
+            if not active:
+                continue
+            try:
+                self.store.touch(active)
+            except Exception as e:
+                logger.warning(f"Analysis jobs - heartbeat failed: {e}")
+
+    def is_cancelled(self, job_id):
+        job = self.store.get(job_id)
+        return job is None or job['state'] == CANCELLED
+
+    def _run(self, job_id, client, model_factory, params):
+        if not self.store.update(job_id, {'state': RUNNING, 'stage': 'execute'}, only_if={QUEUED}):
+            with self._lock:
+                self._active.discard(job_id)
+            return  # Cancelled while queued
+        try:
+            query_job = client.query(params['sql_query'], job_config=execution_config())
+            with self._lock:
+                self._query_jobs[job_id] = query_job
+            self.store.update(job_id, {'query_job': make_job_handle(query_job)})
+            if self.is_cancelled(job_id):
+                query_job.cancel()
+                return
+
+            df, page = read_first_page(client, query_job, params.get('page_size'))
+            datetime_columns = [col for col in df.columns if pd.api.types.is_datetime64_any_dtype(df[col])]
+            if datetime_columns:
+                df = df.dropna(subset=datetime_columns)
+            if self.is_cancelled(job_id):
+                return
+
+            if df.empty:
+                body, mimetype = encode_json({
+                    'error': True, 'message': 'No data found for the query', 'data': [], 'columns': [], 'chart_type': None
+                }), "application/json"
+            else:
+                self.store.update(job_id, {'stage': 'insights'}, only_if={RUNNING})
+                insights = generate_insights(model_factory, df, params.get('original_query') or "", params['sql_query'])
+                body, mimetype = serialize_result(df, {
+                    'chart_type': insights['chart_type'],
+                    'llm_recommendation': insights['llm_recommendation'],
+                    'data_preview_description': insights['data_preview_description'],
+                    'chart_description': insights['chart_description'],
+                    'chart': build_chart(df, insights['chart_type'], *chart_axes(insights)),
+                    'query_description': params.get('query_description'),
+                    'pagination': page,
+                    'metadata': {'job_id': job_id, 'preflight': params.get('preflight'),
+                                 'insight_mode': insights['insight_mode'],
+                                 'chart_recommendation': insights['chart_recommendation']}
+                }, params.get('format') or "records")
+
+            if self.store.update(job_id, {'state': SUCCEEDED, 'stage': None, 'result': body, 'mimetype': mimetype},
+                                 only_if={RUNNING}):
+                logger.info(f"Analysis job {job_id} succeeded")
+        except Exception as e:
+            if self.store.update(job_id, {'state': FAILED, 'stage': None, 'error': str(e)}, only_if={RUNNING}):
+                logger.error(f"Analysis job {job_id} failed: {e}")
+        finally:
+            with self._lock:
+                self._query_jobs.pop(job_id, None)
+                self._active.discard(job_id)
+
+    def cancel(self, client, job_id):
+        """
+        Cancel a queued or running job and its BigQuery job.
+
+        Returns:
+            The job's public status, or None when the job is unknown
+        """
+        if not self.store.update(job_id, {'state': CANCELLED, 'stage': None}, only_if={QUEUED, RUNNING}):
+            job = self.store.get(job_id)
+            return job_status(job) if job is not None else None
+
+        with self._lock:
+            self.cancelled += 1
+            query_job = self._query_jobs.get(job_id)
+        job = self.store.get(job_id)
+        try:
+            if query_job is not None:
+                query_job.cancel()
+            elif job['query_job']:
+                # Started by another worker process sharing the store
+                _, location, bq_job_id = job['query_job'].split(":", 2)
+                client.cancel_job(bq_job_id, location=location)
+        except Exception as e:
+            logger.warning(f"Analysis job {job_id} - BigQuery job cancellation failed: {e}")
+        logger.info(f"Analysis job {job_id} cancelled")
+        return job_status(job)
+
+    def poll_event(self, job_id, last=None):
+        """
+        Check a job once for the events stream.
+
+        Args:
+            job_id: Job to check
+            last: Marker returned by the previous check
+
+        Returns:
+            Tuple of (event or None when nothing changed, marker, finished)
+        """
+        job = self.store.get(job_id)
+        if job is None:
+            return {'type': 'error', 'message': 'Unknown job'}, last, True
+        status = job_status(job)
+        marker = (status['state'], status['stage'])
+        finished = status['state'] in FINISHED_STATES
+        if marker == last:
+            return None, last, finished
+        return {'type': 'status', **status}, marker, finished
+
+    def events(self, job_id, poll_seconds=JOB_EVENT_POLL_SECONDS):
+        """Status events for a job, one per state or stage change, ending with the finished state."""
+        last, finished = None, False
+        while not finished:
+            event, last, finished = self.poll_event(job_id, last)
+            if event is not None:
+                yield event
+            if not finished:
+                time.sleep(poll_seconds)
+
+    def stats(self):
+        with self._lock:
+            running_here = len(self._query_jobs)
+        return {
+            'store': type(self.store).__name__,
+            'states': self.store.counts(),
+            'submitted': self.submitted,
+            'cancelled': self.cancelled,
+            'running_here': running_here,
+        }
+
+analysis_jobs = AnalysisJobs(make_job_store())
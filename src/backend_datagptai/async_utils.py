@@ -0,0 +1,61 @@
+#async_utils.py runs blocking BigQuery/Gemini SDK calls off the FastAPI event loop
+import os
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from request_budget import REQUEST_TIMEOUT_SECONDS, deadline_from_headers, time_left
+
+logger = logging.getLogger(__name__)
+
+# Threads available to blocking SDK calls across all requests
+BLOCKING_POOL_SIZE = int(os.environ.get("BLOCKING_POOL_SIZE", "32"))
+# How often a running request checks whether its client is still connected
+DISCONNECT_POLL_SECONDS = float(os.environ.get("DISCONNECT_POLL_SECONDS", "0.5"))
+blocking_executor = ThreadPoolExecutor(max_workers=BLOCKING_POOL_SIZE, thread_name_prefix="blocking-sdk")
+
+def request_deadline(request):
+    """Monotonic deadline for a request, from X-Request-Deadline, X-Request-Timeout or REQUEST_TIMEOUT_SECONDS."""
+    return deadline_from_headers(request.headers)
+
+async def run_blocking(fn, *args, deadline=None, **kwargs):
+    """
+    Run a blocking callable on the shared thread pool.
+
+    Raises asyncio.TimeoutError when the deadline passes first. The thread
+    itself cannot be interrupted, so callers that start remote work (query
+    jobs) should use run_query_job() to cancel it.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(blocking_executor, functools.partial(fn, *args, **kwargs))
+    if deadline is None:
+        return await future
+    return await asyncio.wait_for(future, time_left(deadline))
+
+async def run_query_job(query_job, fn, *args, deadline=None, **kwargs):
+    """Like run_blocking(), but cancels the BigQuery job on timeout or request cancellation."""
+    try:
+        return await run_blocking(fn, *args, deadline=deadline, **kwargs)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        logger.warning(f"Cancelling BigQuery job {query_job.job_id}")
+        blocking_executor.submit(query_job.cancel)
+        raise
+
+async def cancel_on_disconnect(request, timer, poll_seconds=DISCONNECT_POLL_SECONDS):
+    """
+    Watch a request and abandon its work (StageTimer.cancel) once the
+    client disconnects. Run it as a task next to the handler and cancel
+    the task when the handler returns.
+    """
+    while not await request.is_disconnected():
+        await asyncio.sleep(poll_seconds)
+    timer.cancel("Client disconnected")
+
+async def iterate_blocking(iterator):
+    """Async generator pulling items from a blocking iterator on the shared thread pool."""
+    done = object()
+    while True:
+        item = await run_blocking(next, iterator, done)
+        if item is done:
+            return
+        yield item
@@ -0,0 +1,75 @@
+#bench_bigquery_clients.py compares per-request BigQuery client setup before/after the shared registry
+#
+# Offline (default): generates a throwaway service account key and measures the
+# cost of building a client per request versus looking it up in the registry.
+#   python bench_bigquery_clients.py --requests 200
+#
+# Live: uses real credentials and runs "SELECT 1" per request, so TLS setup and
+# token fetches are included in the numbers.
+#   python bench_bigquery_clients.py --live --credentials path/to/key.json --requests 20
+import os
+import json
+import time
+import argparse
+import tempfile
+import statistics
+from google.cloud import bigquery
+from bq_clients import get_bigquery_client, close_bigquery_clients
+
+def write_fake_service_account(directory):
+    """Write a syntactically valid service account key so credential loading can be measured offline."""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+    path = os.path.join(directory, "bench-service-account.json")
+    with open(path, "w") as f:
+        json.dump({
+            "type": "service_account",
+            "project_id": "bench-project",
+            "private_key_id": "bench",
+            "private_key": pem,
+            "client_email": "bench@bench-project.iam.gserviceaccount.com",
+            "client_id": "0",
+            "token_uri": "https://oauth2.googleapis.com/token",
+        }, f)
+    return path
+
+def per_request_client(credentials_path):
+    """The previous initialize_bigquery(): mutate the env var and build a new client."""
+    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = credentials_path
+    return bigquery.Client()
+
+def run(label, factory, credentials_path, requests, live):
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        client = factory(credentials_path)
+        if live:
+            list(client.query("SELECT 1").result())
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    print(f"{label:<22} mean {statistics.mean(timings):9.3f} ms   "
+          f"p50 {timings[len(timings) // 2]:9.3f} ms   p95 {timings[int(len(timings) * 0.95) - 1]:9.3f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark BigQuery client setup per request")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--live", action="store_true", help="run SELECT 1 per request against BigQuery")
+    parser.add_argument("--credentials", help="service account key for --live runs")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        credentials_path = args.credentials if args.live else write_fake_service_account(directory)
+        print(f"{args.requests} requests per mode ({'live' if args.live else 'offline'})")
+        run("per-request client", per_request_client, credentials_path, args.requests, args.live)
+        run("registry client", get_bigquery_client, credentials_path, args.requests, args.live)
+        close_bigquery_clients()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+#bench_chart_data.py times the chart payload stage and compares its size with the raw rows the browser used to plot
+#   python bench_chart_data.py --rows 10000 200000 2000000
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from chart_data import build_chart, CHART_MAX_POINTS, CHART_TOP_N
+from serialization import encode_json, frame_to_records
+
+def make_frame(rows, chart_type, seed=0):
+    rng = np.random.default_rng(seed)
+    if chart_type in ("line", "scatter"):
+        return pd.DataFrame({
+            'posted_at': pd.to_datetime("2023-01-01") + pd.to_timedelta(np.sort(rng.integers(0, 10**9, rows)), unit="s"),
+            'amount': np.cumsum(rng.normal(0, 25, rows)),
+        })
+    return pd.DataFrame({
+        'customer': rng.choice([f"Customer {i}" for i in range(5000)], rows),
+        'amount': rng.gamma(2.0, 500.0, rows),
+    })
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000, result
+
+def main():
+    parser = argparse.ArgumentParser(description="Chart payload micro-benchmark")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 200000, 2000000])
+    parser.add_argument("--charts", nargs="+", default=["bar", "pie", "line", "scatter"])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"point budget: {CHART_MAX_POINTS}, top categories: {CHART_TOP_N}")
+    print(f"{'rows':>8} {'chart':<8} {'build':>10} {'points':>7} {'chart JSON':>11} {'raw rows JSON':>14}")
+    for rows in args.rows:
+        for chart_type in args.charts:
+            df = make_frame(rows, chart_type)
+            ms, chart = best_of(lambda: build_chart(df, chart_type), args.repeat)
+            raw_size = len(encode_json(frame_to_records(df))) if rows <= 200000 else None
+            raw = f"{raw_size / 1e6:12.2f}MB" if raw_size is not None else f"{'-':>14}"
+            print(f"{rows:>8} {chart_type:<8} {ms:8.1f}ms {len(chart['points']):>7} "
+                  f"{len(encode_json(chart)) / 1e3:9.1f}KB {raw}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#bench_result_profile.py times the result profile behind the summary prompts and compares its size with the old row samples
+#   python bench_result_profile.py --rows 10000 200000 2000000
+import time
+import argparse
+import warnings
+import numpy as np
+import pandas as pd
+from result_profile import profile_frame, render_profile, result_section, PROFILE_TOKEN_BUDGET
+from text_utils import estimate_tokens
+
+def make_frame(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    amount = rng.gamma(2.0, 500.0, rows)
+    amount[rng.random(rows) < 0.02] = np.nan
+    return pd.DataFrame({
+        'posted_date': pd.to_datetime("2022-01-01") + pd.to_timedelta(rng.integers(0, 1000, rows), unit="D"),
+        'region': rng.choice(["North", "South", "East", "West", None], rows, p=[0.4, 0.3, 0.15, 0.1, 0.05]),
+        'customer': rng.choice([f"Customer {i}" for i in range(20000)], rows),
+        'journal_category': rng.choice(["Purchase Invoices", "Sales Invoices", "Payments", "Adjustment"], rows),
+        'quantity': rng.integers(1, 500, rows),
+        'amount': amount,
+        'tax_amount': amount * 0.2,
+        'is_reversed': rng.random(rows) < 0.03,
+    })
+
+def old_gemini_sample(df):
+    """What /gemini used to send: the first five rows as JSON."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # the old call relied on pandas' deprecated epoch date format
+        return f"Query Results (Sample): {df.head(5).to_json()}"
+
+def old_insight_context(df):
+    """What the insight prompts used to send: four unique values of the first two columns."""
+    samples = [', '.join(str(value) for value in df[column].unique()[:4]) for column in df.columns[:2]]
+    return f"""The result contains the following columns:{', '.join(df.columns.tolist())}.
+        For the column {df.columns[0]}, here are some sample values: {samples[0]}.
+        For the column {df.columns[1]}, here are some sample values: {samples[1]}."""
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000, result
+
+def main():
+    parser = argparse.ArgumentParser(description="Result profile micro-benchmark")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 200000, 2000000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--show", action="store_true", help="print the prompt section for the smallest size")
+    args = parser.parse_args()
+
+    print(f"token budget: {PROFILE_TOKEN_BUDGET}")
+    print(f"{'rows':>8} {'profile':>10} {'render':>9} {'ns/cell':>8} {'tokens':>7} {'old /gemini':>12} {'old insights':>13}")
+    for rows in args.rows:
+        df = make_frame(rows)
+        profile_ms, profile = best_of(lambda: profile_frame(df), args.repeat)
+        render_ms, (section, tokens) = best_of(lambda: render_profile(profile), args.repeat)
+        per_cell = profile_ms * 1e6 / (rows * len(df.columns))
+        print(f"{rows:>8} {profile_ms:8.1f}ms {render_ms:7.2f}ms {per_cell:8.1f} {tokens:>7} "
+              f"{estimate_tokens(old_gemini_sample(df)):>12} {estimate_tokens(old_insight_context(df)):>13}")
+
+    if args.show:
+        print()
+        print(result_section(make_frame(min(args.rows))))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#bench_schema_pruning.py compares SQL prompts with the full schema and the pruned schema on a fixed question set
+#
+# Offline (default): builds a wide synthetic ERP table and reports estimated prompt
+# tokens, pruning time and whether the columns each question needs were kept.
+#   python bench_schema_pruning.py --columns 400
+#
+# Live: also sends both prompts to Gemini and reports counted tokens and generation latency.
+#   python bench_schema_pruning.py --live --credentials path/to/key.json
+import time
+import random
+import argparse
+import statistics
+from nl2sql import build_schema_string, build_sql_prompt
+from schema_pruning import prune_columns
+from text_utils import estimate_tokens
+
+TABLE_NAME = "bench-project.erp.gl_journal_lines"
+
+CORE_COLUMNS = [
+    ("JournalId", "STRING"), ("JournalLineNumber", "INTEGER"), ("JournalCategory", "STRING"),
+    ("TransactionType", "STRING"), ("PostedDate", "DATE"), ("CreatedAt", "TIMESTAMP"),
+    ("AccountedAmount", "FLOAT"), ("EnteredAmount", "FLOAT"), ("CurrencyCode", "STRING"),
+    ("VendorName", "STRING"), ("CustomerName", "STRING"), ("CostCenter", "STRING"),
+    ("DepartmentName", "STRING"), ("Region", "STRING"), ("FiscalPeriod", "STRING"),
+    ("FiscalYear", "INTEGER"), ("InvoiceNumber", "STRING"), ("Quantity", "FLOAT"), ("Status", "STRING"),
+]
+FILLER_WORDS = [
+    "attribute", "segment", "flex", "context", "global", "legacy", "interface", "batch", "request",
+    "ledger", "reference", "source", "program", "approval", "tax", "line", "header", "distribution",
+    "project", "task", "award", "asset", "book", "bank", "statement", "receipt", "payment", "term",
+]
+
+# (question, columns an answer needs)
+QUESTIONS = [
+    ("total purchase invoice amount by vendor", ["AccountedAmount", "VendorName", "JournalCategory"]),
+    ("monthly revenue trend for last year", ["AccountedAmount", "PostedDate"]),
+    ("top 10 customers by sales", ["CustomerName", "AccountedAmount"]),
+    ("spend per department this quarter", ["DepartmentName", "AccountedAmount", "PostedDate"]),
+    ("how many journals were posted per fiscal period", ["JournalId", "FiscalPeriod"]),
+    ("amounts by currency and region", ["CurrencyCode", "Region", "AccountedAmount"]),
+    ("quantity by cost center", ["Quantity", "CostCenter"]),
+    ("count of open invoices by status", ["InvoiceNumber", "Status"]),
+]
+
+def make_columns(width, seed=0):
+    rng = random.Random(seed)
+    columns = [{'name': name, 'type': field_type, 'mode': "NULLABLE", 'description': None}
+               for name, field_type in CORE_COLUMNS]
+    while len(columns) < width:
+        words = rng.sample(FILLER_WORDS, 2)
+        name = "".join(word.capitalize() for word in words) + str(len(columns))
+        columns.append({'name': name, 'type': rng.choice(["STRING", "STRING", "FLOAT", "INTEGER"]),
+                        'mode': "NULLABLE", 'description': None})
+    rng.shuffle(columns)
+    return columns
+
+def prompts(columns, question):
+    full = build_sql_prompt(TABLE_NAME, build_schema_string(TABLE_NAME, columns), question)
+    start = time.perf_counter()
+    kept, _ = prune_columns(TABLE_NAME, columns, question)
+    prune_ms = (time.perf_counter() - start) * 1000
+    pruned = build_sql_prompt(TABLE_NAME, build_schema_string(TABLE_NAME, kept), question)
+    return full, pruned, kept, prune_ms
+
+def timed_generation(model, prompt):
+    start = time.perf_counter()
+    model.generate_content([prompt])
+    return (time.perf_counter() - start) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Schema pruning prompt-size benchmark")
+    parser.add_argument("--columns", type=int, default=400)
+    parser.add_argument("--live", action="store_true", help="send both prompts to Gemini")
+    parser.add_argument("--credentials", help="service account key for --live runs")
+    args = parser.parse_args()
+
+    model = None
+    if args.live:
+        from gemini_models import get_gemini_model
+        model = get_gemini_model(args.credentials, "sql")
+
+    columns = make_columns(args.columns)
+    print(f"{args.columns} columns, {len(QUESTIONS)} questions ({'live' if args.live else 'offline'})")
+    header = f"{'question':<48} {'full tok':>8} {'pruned tok':>10} {'kept':>5} {'recall':>6} {'prune ms':>8}"
+    print(header + (f" {'full ms':>8} {'pruned ms':>9}" if model else ""))
+
+    totals = {'full': [], 'pruned': [], 'recall': [], 'full_ms': [], 'pruned_ms': []}
+    for question, needed in QUESTIONS:
+        full, pruned, kept, prune_ms = prompts(columns, question)
+        kept_names = {column['name'] for column in kept}
+        recall = sum(name in kept_names for name in needed) / len(needed)
+        row = (f"{question[:48]:<48} {estimate_tokens(full):>8} {estimate_tokens(pruned):>10} "
+               f"{len(kept):>5} {recall:>6.0%} {prune_ms:>8.2f}")
+        totals['full'].append(estimate_tokens(full))
+        totals['pruned'].append(estimate_tokens(pruned))
+        totals['recall'].append(recall)
+        if model:
+            full_ms, pruned_ms = timed_generation(model, full), timed_generation(model, pruned)
+            totals['full_ms'].append(full_ms)
+            totals['pruned_ms'].append(pruned_ms)
+            row += f" {full_ms:>8.0f} {pruned_ms:>9.0f}"
+        print(row)
+
+    print(f"mean prompt tokens: {statistics.mean(totals['full']):.0f} -> {statistics.mean(totals['pruned']):.0f}, "
+          f"mean recall of needed columns: {statistics.mean(totals['recall']):.0%}")
+    if model:
+        print(f"median generation latency: {statistics.median(totals['full_ms']):.0f} ms -> "
+              f"{statistics.median(totals['pruned_ms']):.0f} ms")
+
+if __name__ == "__main__":
+    main()
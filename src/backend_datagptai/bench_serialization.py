@@ -0,0 +1,69 @@
+#bench_serialization.py compares the old per-cell result serialization with the vectorized formats
+#   python bench_serialization.py --rows 1000 10000 200000
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from serialization import serialize_result, RESULT_FORMATS, orjson, pa
+
+def legacy_convert_datetime(obj):
+    """The per-cell converter the endpoints used before."""
+    if pd.isna(obj):
+        return None
+    if isinstance(obj, pd.Timestamp):
+        return obj.isoformat()
+    return obj
+
+def legacy_serialize(df, payload):
+    processed_data = df.apply(
+        lambda col: col.map(legacy_convert_datetime) if pd.api.types.is_datetime64_any_dtype(col) else col
+    )
+    return json.dumps({**payload, 'data': processed_data.to_dict(orient='records'), 'columns': df.columns.tolist()},
+                      default=str).encode()
+
+def make_frame(rows, mix, seed=0):
+    rng = np.random.default_rng(seed)
+    data = {
+        'amount': rng.normal(1000, 250, rows),
+        'quantity': rng.integers(0, 500, rows),
+    }
+    if mix in ("mixed", "datetime"):
+        timestamps = pd.Series(pd.to_datetime("2023-01-01", utc=True) + pd.to_timedelta(rng.integers(0, 10**9, rows), unit="s"))
+        timestamps[rng.random(rows) < 0.02] = pd.NaT
+        data['posted_at'] = timestamps
+        data['period'] = pd.to_datetime("2023-01-01") + pd.to_timedelta(rng.integers(0, 730, rows), unit="D")
+    if mix == "mixed":
+        data['region'] = rng.choice(["North", "South", "East", "West"], rows)
+        data['category'] = rng.choice(["Purchase Invoices", "Sales Orders", "Journals", None], rows)
+        data['amount'][rng.random(rows) < 0.05] = np.nan
+    return pd.DataFrame(data)
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000, len(body)
+
+def main():
+    parser = argparse.ArgumentParser(description="Result serialization micro-benchmark")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 200000])
+    parser.add_argument("--mixes", nargs="+", default=["numeric", "datetime", "mixed"])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    formats = [f for f in RESULT_FORMATS if f != "arrow" or pa is not None]
+    print(f"orjson: {'yes' if orjson else 'no'}, pyarrow: {'yes' if pa else 'no'}")
+    print(f"{'rows':>8} {'mix':<9} {'legacy':>16} " + " ".join(f"{name:>16}" for name in formats))
+    for rows in args.rows:
+        for mix in args.mixes:
+            df = make_frame(rows, mix)
+            payload = {'chart_type': 'bar'}
+            cells = [best_of(lambda: legacy_serialize(df, payload), args.repeat)]
+            cells += [best_of(lambda: serialize_result(df, payload, name)[0], args.repeat) for name in formats]
+            print(f"{rows:>8} {mix:<9} " + " ".join(f"{ms:8.1f}ms {size / 1e6:5.1f}MB" for ms, size in cells))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#bq_clients.py shared BigQuery client registry used by Datagptai.py and cloudfastapi.py
+import os
+import threading
+import logging
+import requests
+import google.auth
+from google.auth.transport.requests import AuthorizedSession
+from google.oauth2 import service_account
+from google.cloud import bigquery
+
+logger = logging.getLogger(__name__)
+
+BIGQUERY_SCOPES = [
+    "https://www.googleapis.com/auth/bigquery",
+    "https://www.googleapis.com/auth/cloud-platform",
+]
+
+# HTTP connection pool settings for every pooled client (override through environment variables)
+BQ_HTTP_POOL_CONNECTIONS = int(os.environ.get("BQ_HTTP_POOL_CONNECTIONS", "10"))
+BQ_HTTP_POOL_MAXSIZE = int(os.environ.get("BQ_HTTP_POOL_MAXSIZE", "32"))
+
+# Long-lived clients keyed by (credentials path, project)
+_clients = {}
+_clients_lock = threading.Lock()
+
+def load_credentials(credentials_path, scopes=None):
+    """
+    Load credentials explicitly instead of through GOOGLE_APPLICATION_CREDENTIALS.
+
+    Args:
+        credentials_path: Path to a service account JSON file, or None
+        scopes: OAuth scopes to request (defaults to the BigQuery scopes)
+
+    Returns:
+        Tuple of (credentials, project_id). Falls back to application default
+        credentials when the file does not exist (e.g. on Cloud Functions).
+    """
+    scopes = scopes or BIGQUERY_SCOPES
+    if credentials_path and os.path.exists(credentials_path):
+        credentials = service_account.Credentials.from_service_account_file(credentials_path, scopes=scopes)
+        return credentials, credentials.project_id
+
+    logger.warning(f"Credentials file {credentials_path} not found, using application default credentials")
+    return google.auth.default(scopes=scopes)
+
+def build_http_session(credentials, pool_connections=None, pool_maxsize=None):
+    """Build an authorized requests session backed by a sized urllib3 connection pool."""
+    session = AuthorizedSession(credentials)
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_connections or BQ_HTTP_POOL_CONNECTIONS,
+        pool_maxsize=pool_maxsize or BQ_HTTP_POOL_MAXSIZE,
+    )
+    session.mount("https://", adapter)
+    return session
+
+def get_bigquery_client(credentials_path, project=None):
+    """
+    Return the process-wide BigQuery client for a credential/project pair.
+
+    The first call loads the credentials and builds the client; every later
+    call reuses it, together with its authorized HTTP session and open
+    connections. Safe to call from many threads at once.
+    """
+    key = (credentials_path, project)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            credentials, default_project = load_credentials(credentials_path)
+            client = bigquery.Client(
+                project=project or default_project,
+                credentials=credentials,
+                _http=build_http_session(credentials),
+            )
+            _clients[key] = client
+            logger.info(f"Created pooled BigQuery client for project {client.project}")
+    return client
+
+def close_bigquery_clients():
+    """Close and forget every registered client (used on shutdown and in benchmarks)."""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
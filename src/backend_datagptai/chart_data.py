@@ -0,0 +1,173 @@
+#chart_data.py chart-ready series built server side: top-N categories for bar/pie, LTTB downsampling for line/scatter
+import os
+import decimal
+import datetime
+import logging
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Categories shown by bar and pie charts; the rest are summed into CHART_OTHER_LABEL
+CHART_TOP_N = int(os.environ.get("CHART_TOP_N", "12"))
+CHART_OTHER_LABEL = os.environ.get("CHART_OTHER_LABEL", "Other")
+# Points sent for line and scatter charts; longer series are downsampled with LTTB
+CHART_MAX_POINTS = int(os.environ.get("CHART_MAX_POINTS", "1000"))
+
+CATEGORY_CHARTS = ("bar", "pie")
+SERIES_CHARTS = ("line", "scatter")
+
+def is_datetime_column(series):
+    if pd.api.types.is_datetime64_any_dtype(series) or str(series.dtype) == 'dbdate':
+        return True
+    # DATE columns read without db-dtypes arrive as datetime.date objects
+    first = series.first_valid_index() if pd.api.types.is_object_dtype(series) else None
+    return first is not None and isinstance(series[first], datetime.date)
+
+def is_measure_column(series):
+    if pd.api.types.is_numeric_dtype(series):
+        return not pd.api.types.is_bool_dtype(series)
+    # NUMERIC / BIGNUMERIC columns arrive as decimal.Decimal objects
+    first = series.first_valid_index() if pd.api.types.is_object_dtype(series) else None
+    return first is not None and isinstance(series[first], decimal.Decimal)
+
+def chart_columns(df):
+    """
+    Columns plotted on each axis.
+
+    Returns:
+        Tuple of (x column, y column or None): x is the first date/time
+        column, else the first non-numeric column, else the first column;
+        y is the first numeric column other than x (None = count rows)
+    """
+    columns = list(df.columns)
+    x = next((column for column in columns if is_datetime_column(df[column])), None)
+    if x is None:
+        x = next((column for column in columns if not is_measure_column(df[column])), columns[0])
+    y = next((column for column in columns if column != x and is_measure_column(df[column])), None)
+    return x, y
+
+def chart_axes(insights):
+    """(x, y) columns recommended alongside the chart type (see insights.generate_insights)."""
+    recommendation = insights.get('chart_recommendation') or {}
+    return recommendation.get('x'), recommendation.get('y')
+
+def epoch_ms(series):
+    """Dates and timestamps as milliseconds since the epoch (UTC), the x values chart libraries expect."""
+    if not pd.api.types.is_datetime64_any_dtype(series):
+        series = pd.to_datetime(series)  # BigQuery DATE columns (dbdate or datetime.date objects)
+    if series.dt.tz is not None:
+        series = series.dt.tz_convert("UTC").dt.tz_localize(None)
+    return series.to_numpy(dtype="datetime64[ms]").astype(np.int64)
+
+def top_n_categories(categories, values, n=CHART_TOP_N, other_label=CHART_OTHER_LABEL):
+    """
+    Sum values per category and keep the n largest, folding the rest into one "other" slice.
+
+    Args:
+        categories: Series of category values (grouped as-is; only the kept groups are turned into labels)
+        values: Float array aligned with categories
+
+    Returns:
+        Tuple of (labels, values, number of categories folded into other).
+        Categories keep their order of appearance when there are at most n.
+    """
+    totals = pd.Series(values, index=categories.index).groupby(categories, sort=False, dropna=False).sum()
+    folded = 0
+    if len(totals) > n:
+        ranked = totals.sort_values(ascending=False, kind='stable')
+        kept, rest = ranked.iloc[:n - 1], ranked.iloc[n - 1:]
+        totals = pd.concat([kept, pd.Series([rest.sum()], index=[other_label])])
+        folded = len(rest)
+    labels = ["N/A" if pd.isna(label) else str(label) for label in totals.index]
+    if folded:
+        labels[-1] = other_label
+    return labels, totals.to_numpy(dtype=float), folded
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling of an x-ordered series.
+
+    Bucket bounds, bucket averages and every candidate triangle area are
+    computed with numpy; only the choice of one point per bucket, which
+    depends on the point chosen in the previous bucket, walks the buckets.
+
+    Args:
+        x, y: Float arrays ordered by x
+        threshold: Points to keep (first and last are always kept)
+
+    Returns:
+        Indices of the kept points
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    # Inner points split into threshold - 2 buckets
+    edges = np.floor(np.linspace(1, n - 1, threshold - 1)).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+    counts = ends - starts
+    # Average of each bucket (the next bucket's average is the triangle's third corner); the last point closes the series
+    avg_x = np.append(np.add.reduceat(x[1:n - 1], starts - 1) / counts, x[n - 1])
+    avg_y = np.append(np.add.reduceat(y[1:n - 1], starts - 1) / counts, y[n - 1])
+
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for bucket, (start, end) in enumerate(zip(starts, ends)):
+        cx, cy = avg_x[bucket + 1], avg_y[bucket + 1]
+        ax, ay = x[a], y[a]
+        area = np.abs((ax - cx) * (y[start:end] - ay) - (ax - x[start:end]) * (cy - ay))
+        a = start + int(np.argmax(area))
+        kept[bucket + 1] = a
+    return kept
+
+def build_chart(df, chart_type, x_column=None, y_column=None, max_points=CHART_MAX_POINTS, top_n=CHART_TOP_N):
+    """
+    Compact, chart-ready figure spec for a result.
+
+    Args:
+        df: Result dataframe
+        chart_type: One of insights.VALID_CHART_TYPES (None = bar)
+        x_column, y_column: Axis columns (see chart_recommender); chart_columns picks them when x_column is None
+
+    Returns:
+        Dict with type, x (column and kind: category, datetime or number),
+        y (column, None when rows are counted), points ([x, y] pairs, x as
+        a label, epoch milliseconds or number), source_rows and reduction
+        (top_n, lttb or None) with other_categories for top_n; None when
+        the result cannot be charted
+    """
+    if df.empty or len(df.columns) == 0:
+        return None
+    chart_type = chart_type if chart_type in CATEGORY_CHARTS + SERIES_CHARTS else "bar"
+    if x_column is None or x_column not in df.columns or (y_column is not None and y_column not in df.columns):
+        x_column, y_column = chart_columns(df)
+    x, y = df[x_column], df[y_column] if y_column is not None else None
+    spec = {'type': chart_type, 'y': {'column': y_column}, 'source_rows': len(df), 'reduction': None}
+
+    if chart_type in CATEGORY_CHARTS or y is None:
+        values = y.fillna(0).to_numpy(dtype=float) if y is not None else np.ones(len(df))
+        labels, values, folded = top_n_categories(x, values, top_n)
+        spec['x'] = {'column': x_column, 'kind': 'category'}
+        spec['points'] = [list(point) for point in zip(labels, values.tolist())]
+        if folded:
+            spec['reduction'] = 'top_n'
+            spec['other_categories'] = folded
+        return spec
+
+    kind = 'datetime' if is_datetime_column(x) else 'number' if is_measure_column(x) else 'category'
+    frame = pd.DataFrame({'x': x, 'y': y}).dropna()
+    if kind != 'category':
+        # Category x values keep the result's order; dates and numbers are plotted in x order
+        frame = frame.sort_values('x', kind='stable')
+    x_values = epoch_ms(frame['x']) if kind == 'datetime' else frame['x'].to_numpy()
+    y_values = frame['y'].to_numpy(dtype=float)
+    if len(frame) > max_points:
+        positions = x_values.astype(float) if kind != 'category' else np.arange(len(frame), dtype=float)
+        kept = lttb(positions, y_values, max_points)
+        x_values, y_values = x_values[kept], y_values[kept]
+        spec['reduction'] = 'lttb'
+    spec['x'] = {'column': x_column, 'kind': kind}
+    x_list = x_values.astype(str).tolist() if kind == 'category' else x_values.tolist()
+    spec['points'] = [list(point) for point in zip(x_list, y_values.tolist())]
+    return spec
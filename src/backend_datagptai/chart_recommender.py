@@ -0,0 +1,124 @@
+#chart_recommender.py picks the chart type and axes from the result's dtypes so most results skip the viz LLM call
+import os
+import re
+import logging
+import pandas as pd
+from chart_data import is_datetime_column, is_measure_column
+
+logger = logging.getLogger(__name__)
+
+# Recommendations at or above this confidence are used as-is; below it Gemini picks the chart
+CHART_RECOMMENDER_MIN_CONFIDENCE = float(os.environ.get("CHART_RECOMMENDER_MIN_CONFIDENCE", "0.7"))
+# Pie charts only for this many slices or fewer
+CHART_PIE_MAX_SLICES = int(os.environ.get("CHART_PIE_MAX_SLICES", "6"))
+
+# Questions asking how a whole splits into parts
+_SHARE_WORDS = re.compile(r"\b(share|shares|percent|percentage|proportion|distribution|breakdown|split|composition|mix)\b", re.I)
+# Numeric columns that are really an ordered time or sequence axis
+_SEQUENCE_NAME = re.compile(r"(^|_)(year|quarter|month|week|day|hour|period|fiscal_year|fy|seq|index|rank)($|_)", re.I)
+
+def column_kind(series):
+    if is_datetime_column(series):
+        return 'datetime'
+    if pd.api.types.is_bool_dtype(series):
+        return 'boolean'
+    if is_measure_column(series):
+        return 'numeric'
+    return 'category'
+
+def profile_result(df):
+    """
+    Per-column facts the chart rules need, each computed with one vectorized pass.
+
+    Returns:
+        Dict with rows and columns: list of {name, kind, distinct, nulls,
+        monotonic, non_negative} in result order
+    """
+    columns = []
+    for name in df.columns:
+        series = df[name]
+        kind = column_kind(series)
+        columns.append({
+            'name': name,
+            'kind': kind,
+            'distinct': int(series.nunique(dropna=True)),
+            'nulls': int(series.isna().sum()),
+            'monotonic': bool(kind in ('datetime', 'numeric') and series.dropna().is_monotonic_increasing),
+            'non_negative': bool(kind == 'numeric' and (series.dropna() >= 0).all()),
+        })
+    return {'rows': len(df), 'columns': columns}
+
+def _recommendation(chart_type, x, y, confidence, reason):
+    return {
+        'chart_type': chart_type,
+        'x': x['name'] if x else None,
+        'y': y['name'] if y else None,
+        'confidence': confidence,
+        'reason': reason,
+    }
+
+def recommend_chart(df, user_query=""):
+    """
+    Deterministic chart choice for a result.
+
+    Args:
+        df: Result dataframe
+        user_query: The user's question (share/breakdown wording favours pie charts)
+
+    Returns:
+        Dict with chart_type (one of insights.VALID_CHART_TYPES or None for
+        no chart), x and y columns, confidence (0-1), reason and confident
+        (confidence >= CHART_RECOMMENDER_MIN_CONFIDENCE)
+    """
+    profile = profile_result(df)
+    recommendation = _apply_rules(profile, user_query or "")
+    recommendation['confident'] = recommendation['confidence'] >= CHART_RECOMMENDER_MIN_CONFIDENCE
+    return recommendation
+
+def _apply_rules(profile, user_query):
+    rows = profile['rows']
+    columns = profile['columns']
+    dates = [column for column in columns if column['kind'] == 'datetime']
+    measures = [column for column in columns if column['kind'] == 'numeric']
+    categories = [column for column in columns if column['kind'] in ('category', 'boolean')]
+    sequences = [column for column in measures if _SEQUENCE_NAME.search(str(column['name']))]
+    values = [column for column in measures if column not in sequences]
+
+    if rows == 0 or not columns:
+        return _recommendation(None, None, None, 1.0, "empty result")
+    if rows == 1 and not dates:
+        return _recommendation(None, None, values[0] if values else None, 0.8, "single row, nothing to compare")
+
+    if dates and measures:
+        x, y = dates[0], (values or measures)[0]
+        if x['distinct'] <= 2:
+            return _recommendation("bar", x, y, 0.75, "two or fewer dates compared side by side")
+        return _recommendation("line", x, y, 0.95, "numeric values over a date/time column")
+
+    if sequences and values and not categories:
+        x, y = sequences[0], values[0]
+        if x['distinct'] >= 3:
+            return _recommendation("line", x, y, 0.85, f"numeric values over the ordered {x['name']} column")
+        return _recommendation("bar", x, y, 0.75, f"few {x['name']} values compared side by side")
+
+    if categories and values:
+        x, y = categories[0], values[0]
+        if len(categories) > 1:
+            # Several label columns: only the first is plotted, which may not be the one the question is about
+            return _recommendation("bar", x, y, 0.5, "several label columns")
+        if x['distinct'] <= CHART_PIE_MAX_SLICES and y['non_negative'] and _SHARE_WORDS.search(user_query):
+            return _recommendation("pie", x, y, 0.9, "parts of a whole across a few categories")
+        if x['distinct'] == rows or x['distinct'] > CHART_PIE_MAX_SLICES:
+            return _recommendation("bar", x, y, 0.9, "one numeric value per category")
+        return _recommendation("bar", x, y, 0.75, "numeric values across a few categories")
+
+    if len(values) >= 2 and not categories:
+        x, y = values[0], values[1]
+        if rows >= 3:
+            return _recommendation("scatter", x, y, 0.8, f"relationship between {x['name']} and {y['name']}")
+        return _recommendation("bar", x, y, 0.5, "two numeric columns with too few rows to correlate")
+
+    if categories and not measures:
+        return _recommendation("bar", categories[0], None, 0.6, "no numeric column, counting rows per category")
+
+    return _recommendation("bar", columns[0], (values or measures or [None])[0], 0.3, "no rule matched the result's columns")
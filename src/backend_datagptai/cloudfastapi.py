@@ -1,13 +1,41 @@
 from cmath import e
 import os
+import time
+import asyncio
 import traceback
 from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import google.generativeai as genai
 from google.cloud import bigquery
-import plotly.express as px
 import pandas as pd
 import logging
+from bq_clients import get_bigquery_client
+from gemini_models import get_gemini_model, gemini_limiter, GeminiOverloadedError
+from metadata_catalog import catalog, schema_pairs, CATALOG_WARM_DATASETS
+from nl2sql import remember_sql, sql_cache_metadata
+from sql_cache import sql_cache, normalize_question
+from result_handoff import load_handoff_job, normalize_sql
+from insights import generate_insights
+from chart_data import build_chart, chart_axes
+from result_profile import result_section
+from async_utils import (blocking_executor, run_blocking, run_query_job, request_deadline, iterate_blocking, time_left,
+                         cancel_on_disconnect)
+from streaming import STREAM_FORMATS, stream_analysis_events, close_event_stream, sse_event
+from serialization import negotiate_format, serialize_result
+from pagination import read_first_page, read_next_page, run_first_page, clamp_page_size, single_page
+from preview import get_table_preview as read_table_preview, parse_columns, preview_cache, PREVIEW_ROWS
+from sql_validation import validate_sql, SqlValidationError
+from preflight import preflight, execution_config, dry_run_cache, QueryBudgetExceeded
+from query_pipeline import run_sql_pipeline
+from request_budget import (StageTimer, RequestAborted, stage_latency, GEMINI_STAGES, ANALYSIS_STAGES,
+                            REUSED_ANALYSIS_STAGES)
+from value_index import value_index
+from example_store import example_store
+from local_engine import local_engine
+from conversation import conversation
+from single_flight import description_flight, query_flight, flight_key, single_flight_stats
+from analysis_jobs import analysis_jobs, job_status, SUCCEEDED, FAILED, CANCELLED, JOB_EVENT_POLL_SECONDS
 import functions_framework
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
@@ -25,8 +53,8 @@ app.add_middleware(
 )
 
 # Configure credentials (these should be set as environment variables in production)
-BIGQUERY_CREDENTIALS = "E:\dataplatr_chatbot\src\credentials_resources\datagpt-bigquery.json"
-GEMINI_CREDENTIALS = "E:\dataplatr_chatbot\src\credentials_resources\datagpt-gemini.json"
+BIGQUERY_CREDENTIALS = os.environ.get("BIGQUERY_CREDENTIALS", "E:\dataplatr_chatbot\src\credentials_resources\datagpt-bigquery.json")
+GEMINI_CREDENTIALS = os.environ.get("GEMINI_CREDENTIALS", "E:\dataplatr_chatbot\src\credentials_resources\datagpt-gemini.json")
 
 # Dataset ID
 DATASET_ID = "dataplatr-sandbox.LLM_UseCases"
@@ -34,13 +62,6 @@ DATASET_ID = "dataplatr-sandbox.LLM_UseCases"
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-# Generation configuration for Gemini
-generation_config = {
-    "temperature": 0.4,
-    "top_p": 1,
-    "top_k": 32,
-    "max_output_tokens": 4096,
-}
 
 # Pydantic models for request validation
 class GeminiRequest(BaseModel):
@@ -49,44 +70,46 @@ class GeminiRequest(BaseModel):
     project_id: str
     dataset_id: str
     table_id: str
+    confirm_cost: bool = False
+    session_id: Optional[str] = None
 
 class BigQueryRequest(BaseModel):
     sql_query: str
     original_query: Optional[str] = None
     query_description: Optional[str] = None
+    result_handle: Optional[str] = None
+    format: Optional[str] = None
+    page_size: Optional[int] = None
+    confirm_cost: bool = False
+    session_id: Optional[str] = None
+
+class BigQueryPageRequest(BaseModel):
+    cursor: str
+    format: Optional[str] = None
+
+class BigQueryStreamRequest(BigQueryRequest):
+    format: str = 'ndjson'
 
 # Retrieve dataset schema
 def get_dataset_schema(dataset_id):
     """Fetches schema details for all tables in the specified dataset, including column types."""
     bq_client = initialize_bigquery()
-    tables = bq_client.list_tables(dataset_id)
-    schema = {}
-    for table in tables:
-        table_ref = f"{table.project}.{table.dataset_id}.{table.table_id}"
-        table_info = bq_client.get_table(table_ref)
-        schema[table.table_id] = [(field.name, field.field_type) for field in table_info.schema]
-    return schema
-
-# Gemini Configuration
-def configure_gemini():
+    tables = catalog.get_dataset(bq_client, dataset_id)
+    return {table_id: schema_pairs(entry) for table_id, entry in tables.items()}
+
+# Gemini Configuration (shared model handle per named generation config, see gemini_models.GENERATION_CONFIGS)
+def configure_gemini(config_name="default"):
     try:
-        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = GEMINI_CREDENTIALS
-        genai.configure()
-        
-        return genai.GenerativeModel(
-            model_name="gemini-pro",
-            generation_config=generation_config
-        )
+        return get_gemini_model(GEMINI_CREDENTIALS, config_name)
     except Exception as e:
         logger.error(f"Gemini configuration error: {e}")
         logger.error(traceback.format_exc())
         raise
 
-# BigQuery Initialization
+# BigQuery Initialization (returns the shared pooled client, credentials are loaded explicitly)
 def initialize_bigquery():
     try:
-        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = BIGQUERY_CREDENTIALS
-        return bigquery.Client()
+        return get_bigquery_client(BIGQUERY_CREDENTIALS)
     except Exception as e:
         logger.error(f"BigQuery initialization error: {e}")
         logger.error(traceback.format_exc())
@@ -95,8 +118,8 @@ def initialize_bigquery():
 @app.get('/api/bigquery/connections')
 async def get_bigquery_connections():
     try:
-        bq_client = initialize_bigquery()
-        projects = list(bq_client.list_projects())
+        bq_client = await run_blocking(initialize_bigquery)
+        projects = await run_blocking(lambda: list(bq_client.list_projects()))
         project_ids = [project.project_id for project in projects]
         
         logger.info(f"Fetched {len(project_ids)} BigQuery projects")
@@ -110,10 +133,10 @@ async def get_bigquery_connections():
 @app.get('/api/bigquery/datasets')
 async def get_bigquery_datasets():
     try:
-        bq_client = initialize_bigquery()
+        bq_client = await run_blocking(initialize_bigquery)
         project_id = bq_client.project
         
-        datasets = list(bq_client.list_datasets())
+        datasets = await run_blocking(lambda: list(bq_client.list_datasets()))
         dataset_ids = [f"{project_id}.{dataset.dataset_id}" for dataset in datasets]
         
         logger.info(f"Fetched {len(dataset_ids)} datasets for project {project_id}")
@@ -130,7 +153,7 @@ async def get_bigquery_tables(dataset_id: str):
         if not dataset_id:
             raise HTTPException(status_code=400, detail="Dataset ID is required")
         
-        bq_client = initialize_bigquery()
+        bq_client = await run_blocking(initialize_bigquery)
         
         try:
             project_id, dataset_name = dataset_id.split('.')
@@ -139,19 +162,28 @@ async def get_bigquery_tables(dataset_id: str):
             dataset_name = dataset_id
         
         dataset_ref = bigquery.DatasetReference(project_id, dataset_name)
-        tables = list(bq_client.list_tables(dataset_ref))
+        tables = await run_blocking(lambda: list(bq_client.list_tables(dataset_ref)))
         table_ids = [table.table_id for table in tables]
         
         logger.info(f"Fetched {len(table_ids)} tables for dataset {dataset_id}")
         return table_ids
     
+    except HTTPException:
+        raise
+
     except Exception as e:
         logger.error(f"Error fetching BigQuery tables: {e}")
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Failed to fetch BigQuery tables: {str(e)}")
 
 @app.post('/gemini')
-async def gemini_endpoint(request: GeminiRequest):
+async def gemini_endpoint(request: GeminiRequest, raw_request: Request):
+    # Blocking SDK calls run on the shared thread pool; the whole request shares one deadline
+    # (X-Request-Deadline / X-Request-Timeout) that every stage checks before it starts
+    deadline = request_deadline(raw_request)
+    timer = StageTimer(deadline)
+    # A client that goes away abandons the request: its BigQuery job is cancelled and no further Gemini calls are made
+    watcher = asyncio.create_task(cancel_on_disconnect(raw_request, timer))
     try:
         logger.info(f"Gemini Endpoint - Received Request: {request}")
 
@@ -161,74 +193,90 @@ async def gemini_endpoint(request: GeminiRequest):
                 detail="All connection details and query are required"
             )
 
-        # Retrieve schema for ONLY the selected table
-        bq_client = initialize_bigquery()
         table_ref = f"{request.project_id}.{request.dataset_id}.{request.table_id}"
-        table = bq_client.get_table(table_ref)
-        
-        # Create schema just for the selected table
-        schema = {
-            request.table_id: [(field.name, field.field_type) for field in table.schema]
-        }
-
-        # Format the schema string specifically for the selected table
-        schema_string = f"Table: {request.table_name}\nColumns: {', '.join([f'{name} ({dtype})' for name, dtype in schema[request.table_id]])}"
-
-        model = configure_gemini()
-
-        # Generate SQL query dynamically
-        prompt = f"""
-        Convert the following natural language query into an SQL query. Use ONLY the columns from the selected table: {request.table_name}
-
-        Dataset schema for selected table:
-        {schema_string}
 
-        User query: {request.query}
-
-         Provide the SQL query that answers the user's question, ensuring the following:
-         1. Use only BigQuery-compatible syntax and functions and do not use functions as 'STRFTIME()' or STRFTIME_UTC which are not supported by BigQuery.
-         2. When applying filters:
-            - Prioritize using teh most relavant column with distinct values that closely match the keywords in the User query.
-            - For example, if the user query mentions "Purchase Invoices" and the dataset schema contains distinct values in multiple columns such as ['Purchase Invoices', 'Sales Orders'] in `JournalCategory` or `TransactionType`, prefer the column that aligns with the user's intent, such as `JournalCategory`.
-         3. If multiple columns have similar values, use the column with the most meaningful relationship to the User query context. For instance, for financial transactions, `JournalCategory` should be prioritized over `TransactionType`.
-
-         4. If no data is retrieved from BigQuery, consider refining the query logic by re-evaluating the column selection or filters.
-        """
-
-        response = model.generate_content([prompt])
-        query = response.text.strip().replace("```sql", "").replace("```", "").strip()
-
-        # Validate that the query uses only the selected table
-        if request.table_id.lower() not in query.lower():
-            logger.error(f"Query does not match the selected table: {request.table_name}")
-            raise HTTPException(
-                status_code=400,
-                detail=f"Query must be based on selected table: {request.table_name}. Please select the correct table or rephrase your query."
-            )
-
-        # Execute query
-        query_job = bq_client.query(query)
-        df = query_job.to_dataframe()
-        datetime_column = [col for col in df.columns if
-    pd.api.types.is_datetime64_any_dtype(df[col])]
-        df=df.dropna(subset=datetime_column)
-        
-        # If no data is returned
-        if df.empty:
-            raise HTTPException(
-                status_code=404,
-                detail="No data found matching the query for the selected table."
-            )
+        # Follow-ups that only filter, sort or cut the session's previous result ("only 2024",
+        # "sort by revenue", "top 5") are answered from that result: no SQL generation, no query job
+        session_id = request.session_id or raw_request.headers.get('x-session-id')
+        follow_up = None
+        if session_id:
+            with timer.stage('follow_up'):
+                follow_up = await run_blocking(
+                    conversation.answer, session_id, request.query, table_ref, deadline=deadline
+                )
+
+        if follow_up is not None:
+            query, df, result_handle, total_rows = follow_up['sql'], follow_up['df'], follow_up['result_handle'], None
+            coalesced = []
+            metadata = {'follow_up': follow_up['plan'], 'engine': follow_up['engine']}
+        else:
+            # Requests that cannot finish in time given recent stage latencies are shed with a 503 up front
+            timer.check(*GEMINI_STAGES)
+
+            # Retrieve schema for ONLY the selected table
+            bq_client = await run_blocking(initialize_bigquery)
+            with timer.stage('catalog'):
+                table = await run_blocking(catalog.get_table, bq_client, table_ref, deadline=deadline)
+
+            # Generate SQL (answered from the SQL cache for repeated questions), validate it locally,
+            # dry-run it against the bytes budget and run it, reading only the rows needed for the
+            # emptiness check and description sample. Failed or empty attempts are sent back to
+            # Gemini for a bounded number of repairs. The job is handed to /api/bigquery through
+            # result_handle so the query is not run twice.
+            try:
+                outcome = await run_blocking(
+                    run_sql_pipeline, bq_client, configure_gemini, request.query, request.table_name, table,
+                    user=raw_request.headers.get('x-user-id'), confirmed=request.confirm_cost,
+                    deadline=deadline, timer=timer
+                )
+            except SqlValidationError as e:
+                logger.error(f"Generated SQL rejected for {request.table_name}: {e}")
+                raise HTTPException(status_code=400, detail=f"{e}. Please select the correct table or rephrase your query.")
+            query, df, result_handle, total_rows = outcome['sql'], outcome['df'], outcome['result_handle'], outcome['total_rows']
+
+            # If no data is returned
+            if df.empty:
+                raise HTTPException(
+                    status_code=404,
+                    detail="No data found matching the query for the selected table."
+                )
+
+            # The query returned data, so cache it for identical questions
+            remember_sql(query, outcome['sql_info'])
+            if session_id:
+                # The probe rows are the whole result when it is that small; otherwise /api/bigquery attaches it
+                complete = outcome['total_rows'] is not None and outcome['total_rows'] <= len(df)
+                conversation.remember(session_id, request.query, query, table_ref, df if complete else None)
+
+            coalesced = outcome['coalesced']
+            metadata = {
+                'sql_cache': sql_cache_metadata(outcome['sql_info']),
+                'sql_validation': outcome['validation'],
+                'preflight': outcome['preflight'],
+                'repair': outcome['repair'],
+                'value_matches': outcome['value_matches'],
+                'schema': outcome['schema'],
+                'examples': outcome['examples'],
+                'engine': outcome['engine'],
+            }
 
-        # Description prompt with table-specific context
+        # Description prompt with the result's column statistics (see result_profile)
         description_prompt = f"""
         you are an AI assistant that summarizes the results of following query in plain english.
         SQL Query: {query}
-        Query Results (Sample): {df.head(5).to_json()}
+        {result_section(df, total_rows)}
         describe in brief what the data represents , 
         key metrics,and any important insights or patterns seamlessley without any astricks
         """
-        description_response = model.generate_content([description_prompt])
+        # Requests that coalesced on the same query build the same prompt and share one description call
+        with timer.stage('description'):
+            description_response, shared = await run_blocking(
+                description_flight.do, flight_key('description', description_prompt),
+                configure_gemini("summary").generate_content, [description_prompt],
+                timeout=time_left(deadline), deadline=deadline
+            )
+        if shared:
+            coalesced = coalesced + ['description']
         result_description = description_response.text.strip()
 
         logger.info(f"Generated SQL Query: {query}")
@@ -237,9 +285,36 @@ async def gemini_endpoint(request: GeminiRequest):
             'sql_query': query,
             'original_query': request.query,
             'query_description': result_description,
-            'table_reference': request.table_name
+            'table_reference': request.table_name,
+            'result_handle': result_handle,
+            'metadata': {**metadata, 'coalesced': coalesced, 'timings_ms': timer.as_dict()}
         }
     
+    except HTTPException:
+        raise
+
+    except QueryBudgetExceeded as e:
+        logger.warning(f"Gemini Endpoint - Over budget: {e}")
+        return JSONResponse(status_code=409, content=e.to_dict())
+
+    except GeminiOverloadedError as e:
+        logger.warning(f"Gemini Endpoint - Rejected: {e}")
+        raise HTTPException(status_code=503, detail=str(e), headers={'Retry-After': '1'})
+
+    except RequestAborted as e:
+        logger.warning(f"Gemini Endpoint - Aborted: {e}")
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers or None)
+
+    except asyncio.TimeoutError:
+        # The pipeline thread keeps running: stop it at its next stage and cancel its query job
+        timer.cancel("Request deadline exceeded")
+        logger.error("Gemini Endpoint - Request deadline exceeded")
+        raise HTTPException(status_code=504, detail="Query processing did not finish within the request timeout")
+
+    except asyncio.CancelledError:
+        timer.cancel("Request cancelled")
+        raise
+
     except Exception as e:
         logger.error(f"Gemini Endpoint Error: {e}")
         logger.error(traceback.format_exc())
@@ -248,36 +323,85 @@ async def gemini_endpoint(request: GeminiRequest):
             detail=f"Internal server error occurred during query processing: {str(e)}"
         )
 
-def convert_datetime(obj):
-    """
-    Convert datetime objects to ISO format string or None for NaT values.
-    
-    Args:
-        obj: Input value to convert
-    
-    Returns:
-        Converted value (string, None, or original value)
-    """
-    if pd.isna(obj):
-        return None
-    if isinstance(obj, pd.Timestamp):
-        return obj.isoformat()
-    return obj
+    finally:
+        watcher.cancel()
 
 @app.post('/api/bigquery')
-async def bigquery_endpoint(request: BigQueryRequest):
+async def bigquery_endpoint(request: BigQueryRequest, raw_request: Request):
+    deadline = request_deadline(raw_request)
+    timer = StageTimer(deadline)
+    watcher = asyncio.create_task(cancel_on_disconnect(raw_request, timer))
     try:
         logger.info(f"BigQuery Endpoint - Received Request: {request}")
 
         if not request.sql_query:
             raise HTTPException(status_code=400, detail="No SQL query provided")
 
-        bq_client = initialize_bigquery()
-        
-        logger.info(f"Executing SQL Query: {request.sql_query}")
-        query_job = bq_client.query(request.sql_query)
+        # Output format: records (default), columnar or arrow (body "format" or Accept header)
+        try:
+            result_format = negotiate_format(request.format, raw_request.headers.get('accept'))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        bq_client = await run_blocking(initialize_bigquery)
         
-        df = query_job.to_dataframe()
+        # Reuse the job already run by /gemini when a result handle is supplied
+        query_job = None
+        if request.result_handle:
+            query_job = await run_blocking(
+                load_handoff_job, bq_client, request.result_handle, request.sql_query, deadline=deadline
+            )
+        result_reused = query_job is not None
+        estimate = None
+        coalesced = []
+        # Follow-ups answered by /gemini from the session's previous result are served from that frame
+        local = conversation.load(request.result_handle, request.sql_query) if request.result_handle else None
+        if not result_reused and local is None:
+            validate_sql(request.sql_query, auto_limit=0)
+            if local_engine.available:
+                # Small or hot tables are answered from their local extract when DuckDB can run the SQL;
+                # results larger than a page go to BigQuery so they can be paged
+                with timer.stage('execute_local'):
+                    local = await run_blocking(
+                        local_engine.run, bq_client, request.sql_query, max_rows=clamp_page_size(request.page_size),
+                        deadline=deadline
+                    )
+        if local is None:
+            timer.check(*(REUSED_ANALYSIS_STAGES if result_reused else ANALYSIS_STAGES))
+        # Only the first page is materialized (page_size, capped by MAX_ROWS_PER_REQUEST);
+        # later pages are read from the job's destination table through /api/bigquery/page
+        start = time.perf_counter()
+        if local is not None:
+            df, engine = local
+            page = single_page(df)
+        elif result_reused:
+            logger.info(f"Reusing results of job {query_job.job_id} for SQL Query: {request.sql_query}")
+            with timer.stage('read_results'):
+                df, page = await run_query_job(
+                    query_job, read_first_page, bq_client, query_job, request.page_size, deadline=deadline
+                )
+        else:
+            with timer.stage('dry_run'):
+                estimate = await run_blocking(
+                    preflight, bq_client, request.sql_query, raw_request.headers.get('x-user-id'), request.confirm_cost,
+                    deadline=deadline
+                )
+            logger.info(f"Executing SQL Query: {request.sql_query}")
+            start = time.perf_counter()
+            # Identical SQL already running for another request is waited for, not run again.
+            # The request that started the job owns it: the job is cancelled when that request is
+            # abandoned (disconnect or deadline), and requests sharing it fail with it.
+            with timer.stage('execute'):
+                (query_job, df, page), shared = await run_blocking(
+                    query_flight.do,
+                    flight_key('first_page', normalize_sql(request.sql_query), clamp_page_size(request.page_size)),
+                    run_first_page, bq_client, request.sql_query, execution_config(), request.page_size, timer,
+                    timeout=time_left(deadline), deadline=deadline
+                )
+            if shared:
+                coalesced.append('execute')
+        if local is None:
+            engine = {'engine': 'bigquery', 'ms': round((time.perf_counter() - start) * 1000, 1)}
         
         # Handle datetime columns
         datetime_columns = [col for col in df.columns if pd.api.types.is_datetime64_any_dtype(df[col])]
@@ -288,6 +412,11 @@ async def bigquery_endpoint(request: BigQueryRequest):
         
         logger.info(f"Query Results - Rows: {len(df)}, Columns: {list(df.columns)}")
 
+        session_id = request.session_id or raw_request.headers.get('x-session-id')
+        if session_id and not page['has_more']:
+            # The whole result is in hand, so the session's next follow-up can be answered from it
+            conversation.attach_result(session_id, request.sql_query, df)
+
         if df.empty:
             return {
                 'error': True,
@@ -297,84 +426,78 @@ async def bigquery_endpoint(request: BigQueryRequest):
                 'chart_type': None
             }
 
-        model = configure_gemini()
-
-        # Safely get sample values
-        def get_sample_values(column):
-            unique_values = column.unique()[:4]
-            return ', '.join(map(lambda x: str(x) if x is not None else 'N/A', unique_values))
-
-        sample_values_col1 = get_sample_values(df[df.columns[0]])
-        sample_values_col2 = get_sample_values(df[df.columns[1]])
-
-        description_prompt = f"""
-        You are an AI assistant that summarizes query results in plain English.
-        The result contains the following columns:{', '.join(df.columns.tolist())}.
-        For the column {df.columns[0]}, here are some sample values: {sample_values_col1}.
-        For the column {df.columns[1]}, here are some sample values: {sample_values_col2}.
-        Question: {request.original_query}
-        SQL Query: {request.sql_query}
-        SQL Result: Describe what the result dataframe represents and not the sql query itself, key metrics, and any important aggregations or patterns for eg: "based on the results, category a has more sales than category b".
-        Provide your response in the format:
-        Description: [Summary of what the SQL Result contains including key metrics and patterns]
-        """
-        description_response = model.generate_content([description_prompt])
-        data_preview_description = description_response.text.strip()
-
-        viz_prompt = f"""
-        You are an AI assistant that recommends appropriate data visualizations.
-        Question: {request.original_query}
-        SQL Query: {request.sql_query}
-        Result Description: {data_preview_description}
-        Provide your response in the format:
-        Viz: [Chart type or "none"]
-        """
-        viz_response = model.generate_content([viz_prompt])
-
-        chart_type = None
-        if "Viz:" in viz_response.text:
-            chart_type = viz_response.text.split("Viz:")[1].split("\n")[0].strip().lower()
-            
-            valid_chart_types = ["bar", "line", "scatter", "pie"]
-            if chart_type and " " in chart_type:
-                chart_type = chart_type.split()[0]
-            
-            if chart_type not in valid_chart_types:
-                chart_type = None
-
-        chart_description_prompt = f"""
-        You are an AI assistant that describes charts in simple terms.
-        Chart Type: {chart_type}
-        Data Description: {data_preview_description}
-        Describe what the chart illustrates and any key insights.
-        Provide your response in the format:
-        Chart Description: [Explanation of what the chart illustrates]
-        """
-        chart_description_response = model.generate_content([chart_description_prompt])
-        chart_description = chart_description_response.text.strip()
+        # Description, chart type and chart description (one structured LLM call, parallel fallback)
+        with timer.stage('insights'):
+            insights, shared = await run_blocking(
+                description_flight.do,
+                flight_key('insights', normalize_sql(request.sql_query), normalize_question(request.original_query or ""),
+                           len(df), list(df.columns)),
+                generate_insights, configure_gemini, df, request.original_query or "", request.sql_query,
+                timeout=time_left(deadline), deadline=deadline
+            )
+        if shared:
+            coalesced.append('insights')
 
-        # Convert dataframe to dict with datetime handling
-        processed_data = df.apply(
-            lambda col: col.map(convert_datetime) if pd.api.types.is_datetime64_any_dtype(col) else col
-        )
+        # Chart-ready points (top-N categories, LTTB-downsampled series) so the browser never plots raw rows
+        with timer.stage('chart'):
+            chart = build_chart(df, insights['chart_type'], *chart_axes(insights))
 
         response_data = {
-            'data': processed_data.to_dict(orient='records'),
-            'columns': df.columns.tolist(),
-            'chart_type': chart_type,
-            'llm_recommendation': viz_response.text,
-            'data_preview_description': data_preview_description,
-            'chart_description': chart_description,
-            'query_description': request.query_description
+            'chart_type': insights['chart_type'],
+            'llm_recommendation': insights['llm_recommendation'],
+            'data_preview_description': insights['data_preview_description'],
+            'chart_description': insights['chart_description'],
+            'chart': chart,
+            'query_description': request.query_description,
+            'pagination': page,
+            'metadata': {
+                'result_reused': result_reused,
+                'preflight': estimate,
+                'insight_mode': insights['insight_mode'],
+                'chart_recommendation': insights['chart_recommendation'],
+                'engine': engine,
+                'coalesced': coalesced,
+                'timings_ms': timer.as_dict()
+            }
         }
 
+        # Vectorized datetime/NaN handling, then records/columnar JSON or Arrow IPC (CPU bound, kept off the event loop)
+        body, media_type = await run_blocking(serialize_result, df, response_data, result_format)
+
         logger.info("BigQuery Endpoint - Response Prepared")
-        return response_data
+        return Response(content=body, media_type=media_type)
     
+    except HTTPException:
+        raise
+
+    except SqlValidationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    except QueryBudgetExceeded as e:
+        logger.warning(f"BigQuery Endpoint - Over budget: {e}")
+        return JSONResponse(status_code=409, content=e.to_dict())
+
+    except GeminiOverloadedError as e:
+        logger.warning(f"BigQuery Endpoint - Rejected: {e}")
+        raise HTTPException(status_code=503, detail=str(e), headers={'Retry-After': '1'})
+
+    except RequestAborted as e:
+        logger.warning(f"BigQuery Endpoint - Aborted: {e}")
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers or None)
+
+    except asyncio.TimeoutError:
+        timer.cancel("Request deadline exceeded")
+        logger.error("BigQuery Endpoint - Request deadline exceeded")
+        raise HTTPException(status_code=504, detail="Query did not finish within the request timeout")
+
+    except asyncio.CancelledError:
+        timer.cancel("Request cancelled")
+        raise
+
     except Exception as e:
         logger.error(f"BigQuery Endpoint Error: {e}")
         logger.error(traceback.format_exc())
-    raise HTTPException(
+        raise HTTPException(
             status_code=500,
             detail={
                 'error': 'Internal server error',
@@ -383,6 +506,200 @@ async def bigquery_endpoint(request: BigQueryRequest):
             }
         )
 
+    finally:
+        watcher.cancel()
+
+@app.get('/api/bigquery/preview')
+async def get_table_preview(project_id: str, dataset_id: str, table_id: str,
+                            columns: Optional[str] = None, max_rows: int = PREVIEW_ROWS):
+    """First rows of a table via tabledata.list: no query job, nothing billed."""
+    try:
+        bq_client = await run_blocking(initialize_bigquery)
+        df, preview_info = await run_blocking(
+            read_table_preview, bq_client, f"{project_id}.{dataset_id}.{table_id}",
+            columns=parse_columns(columns), max_rows=max_rows
+        )
+        body, media_type = serialize_result(df, {'metadata': {'preview': preview_info}})
+        return Response(content=body, media_type=media_type)
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    except Exception as e:
+        logger.error(f"Table Preview Error: {e}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Failed to fetch table preview: {str(e)}")
+
+@app.post('/api/bigquery/page')
+async def bigquery_page_endpoint(request: BigQueryPageRequest, raw_request: Request):
+    """Next page of a /api/bigquery result, read with the cursor from the previous response (no new query job)."""
+    deadline = request_deadline(raw_request)
+    try:
+        result_format = negotiate_format(request.format, raw_request.headers.get('accept'))
+        bq_client = await run_blocking(initialize_bigquery)
+        df, page = await run_blocking(read_next_page, bq_client, request.cursor, deadline=deadline)
+        body, media_type = await run_blocking(serialize_result, df, {'pagination': page}, result_format)
+        return Response(content=body, media_type=media_type)
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Result page did not arrive within the request timeout")
+
+    except Exception as e:
+        logger.error(f"BigQuery Page Endpoint Error: {e}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Failed to fetch result page: {str(e)}")
+
+@app.post('/api/bigquery/stream')
+async def bigquery_stream_endpoint(request: BigQueryStreamRequest, raw_request: Request):
+    """Streaming variant of /api/bigquery: column metadata, row pages, then Gemini text as it is generated."""
+    if not request.sql_query:
+        raise HTTPException(status_code=400, detail="No SQL query provided")
+    if request.format not in STREAM_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported stream format: {request.format}")
+
+    try:
+        bq_client = await run_blocking(initialize_bigquery)
+        query_job = None
+        if request.result_handle:
+            query_job = await run_blocking(load_handoff_job, bq_client, request.result_handle, request.sql_query)
+        if query_job is None:
+            validate_sql(request.sql_query, auto_limit=0)
+            await run_blocking(preflight, bq_client, request.sql_query, raw_request.headers.get('x-user-id'), request.confirm_cost)
+            logger.info(f"Streaming SQL Query: {request.sql_query}")
+            query_job = await run_blocking(bq_client.query, request.sql_query, job_config=execution_config())
+
+    except SqlValidationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    except QueryBudgetExceeded as e:
+        return JSONResponse(status_code=409, content=e.to_dict())
+
+    except Exception as e:
+        logger.error(f"BigQuery Stream Endpoint Error: {e}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Failed to start result stream: {str(e)}")
+
+    media_type, encode_event = STREAM_FORMATS[request.format]
+    events = stream_analysis_events(query_job, configure_gemini, request.original_query or "", request.sql_query)
+
+    # Page reads and Gemini chunks block, so the generator is advanced on the shared thread pool;
+    # a client disconnect closes the generator, which cancels the query job
+    async def body():
+        try:
+            async for event in iterate_blocking(events):
+                yield encode_event(event)
+        finally:
+            blocking_executor.submit(close_event_stream, events, query_job)
+
+    return StreamingResponse(body(), media_type=media_type)
+
+@app.post('/api/jobs', status_code=202)
+async def submit_analysis_job(request: BigQueryRequest, raw_request: Request):
+    """Asynchronous /api/bigquery: validates and preflight checks the SQL, then returns a job id right away."""
+    if not request.sql_query:
+        raise HTTPException(status_code=400, detail="No SQL query provided")
+    try:
+        result_format = negotiate_format(request.format, raw_request.headers.get('accept'))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        bq_client = await run_blocking(initialize_bigquery)
+        validate_sql(request.sql_query, auto_limit=0)
+        estimate = await run_blocking(
+            preflight, bq_client, request.sql_query, raw_request.headers.get('x-user-id'), request.confirm_cost
+        )
+        return await run_blocking(analysis_jobs.submit, bq_client, configure_gemini, {
+            'sql_query': request.sql_query,
+            'original_query': request.original_query or "",
+            'query_description': request.query_description,
+            'page_size': request.page_size,
+            'format': result_format,
+            'preflight': estimate,
+        })
+
+    except SqlValidationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    except QueryBudgetExceeded as e:
+        return JSONResponse(status_code=409, content=e.to_dict())
+
+    except Exception as e:
+        logger.error(f"Job Submit Error: {e}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Failed to submit analysis job: {str(e)}")
+
+async def find_job(job_id):
+    job = await run_blocking(analysis_jobs.store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job
+
+@app.get('/api/jobs/{job_id}')
+async def get_analysis_job(job_id: str):
+    return job_status(await find_job(job_id))
+
+@app.get('/api/jobs/{job_id}/result')
+async def get_analysis_job_result(job_id: str):
+    """Finished job: the /api/bigquery response body. Unfinished: 202 with the job status."""
+    job = await find_job(job_id)
+    if job['state'] == SUCCEEDED:
+        return Response(content=job['result'], media_type=job['mimetype'])
+    if job['state'] == FAILED:
+        raise HTTPException(status_code=500, detail=f"Analysis job failed: {job['error']}")
+    if job['state'] == CANCELLED:
+        raise HTTPException(status_code=410, detail="Analysis job was cancelled")
+    return JSONResponse(status_code=202, content=job_status(job))
+
+@app.post('/api/jobs/{job_id}/cancel')
+async def cancel_analysis_job(job_id: str):
+    bq_client = await run_blocking(initialize_bigquery)
+    job = await run_blocking(analysis_jobs.cancel, bq_client, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job
+
+@app.get('/api/jobs/{job_id}/events')
+async def analysis_job_events(job_id: str):
+    """Server-Sent Events with the job's status on every change, until it finishes."""
+    await find_job(job_id)
+
+    async def body():
+        last, finished = None, False
+        while not finished:
+            event, last, finished = await run_blocking(analysis_jobs.poll_event, job_id, last)
+            if event is not None:
+                yield sse_event(event)
+            if not finished:
+                await asyncio.sleep(JOB_EVENT_POLL_SECONDS)
+
+    return StreamingResponse(body(), media_type='text/event-stream')
+
+@app.get('/api/cache/stats')
+async def get_cache_stats():
+    return {
+        'metadata_catalog': catalog.stats(),
+        'gemini': gemini_limiter.stats(),
+        'sql_cache': sql_cache.stats(),
+        'dry_run_cache': dry_run_cache.stats(),
+        'preview': preview_cache.stats(),
+        'value_index': value_index.stats(),
+        'examples': example_store.stats(),
+        'single_flight': single_flight_stats(),
+        'jobs': analysis_jobs.stats(),
+        'stage_latency': stage_latency.stats(),
+        'local_engine': local_engine.stats(),
+        'conversation': conversation.stats()
+    }
+
+# Warm the metadata catalog in the background (CATALOG_WARM_DATASETS) so first questions skip metadata round trips
+catalog.warm_up_in_background(initialize_bigquery, CATALOG_WARM_DATASETS)
+# Extract the hot tables (LOCAL_ENGINE_HOT_TABLES) for the local engine
+local_engine.warm_up_in_background(initialize_bigquery)
+
 # Cloud Function entry point
 @functions_framework.http
 def main(request):
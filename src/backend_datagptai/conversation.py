@@ -0,0 +1,437 @@
+#conversation.py per-session result frames so follow-up filters, sorts and top-N cuts are answered without a new query
+import os
+import re
+import time
+import threading
+import logging
+from collections import OrderedDict
+import pandas as pd
+from text_utils import tokenize
+from result_handoff import normalize_sql, make_conversation_handle
+
+logger = logging.getLogger(__name__)
+
+# A session's last result is dropped after this long without a question
+CONVERSATION_TTL_SECONDS = float(os.environ.get("CONVERSATION_TTL_SECONDS", "1800"))
+CONVERSATION_MAX_SESSIONS = int(os.environ.get("CONVERSATION_MAX_SESSIONS", "1000"))
+# Memory held by all sessions' frames, and by a single frame (larger results are not kept)
+CONVERSATION_MAX_BYTES = int(os.environ.get("CONVERSATION_MAX_BYTES", str(256 * 1024 * 1024)))
+CONVERSATION_MAX_FRAME_BYTES = int(os.environ.get("CONVERSATION_MAX_FRAME_BYTES", str(32 * 1024 * 1024)))
+
+# Clause separators: "only 2024, sorted by revenue and top 5" (captured so "or" can be told apart)
+_CLAUSE_SPLIT = re.compile(r"\s*([,;]|\bthen\b|\band\b|\bor\b)\s*")
+# Words that lead a follow-up clause without changing its meaning
+_FILLER = re.compile(
+    r"^(?:(?:now|also|ok|okay|please|can|could|you|show|me|give|list|display|keep|just|only|filter|filtered|"
+    r"narrow|restrict|limit|limited|it|them|this|that|these|those|the|results?|rows?|data)\s+)*"
+)
+_NEGATION = re.compile(r"^(?:exclude|excluding|except|without|not|but not|drop|remove)\s+")
+_TOP_N = re.compile(
+    r"^(top|bottom|highest|lowest|largest|smallest|best|worst)\s+(\d{1,6})"
+    r"(?:\s+(?!by\b)([a-z_]+))?(?:\s+by\s+(.+))?$"
+)
+_SORT = re.compile(
+    r"^(?:sort|sorted|order|ordered|rank|ranked|arrange|arranged)\s+(?:it\s+|them\s+|results?\s+)?by\s+(.+?)"
+    r"(?:\s+(asc|ascending|increasing|lowest first|smallest first|desc|descending|decreasing|highest first|largest first))?$"
+)
+_COMPARISON = re.compile(
+    r"^(?:where\s+|with\s+)?(.+?)\s+(>=|<=|>|<|over|above|more than|greater than|at least|under|below|less than|at most)"
+    r"\s+(-?[\d,]*\.?\d+)$"
+)
+_EQUALITY = re.compile(r"^(?:where\s+|with\s+)?(.+?)\s+(?:is|=|equals|equal to)\s+(.+)$")
+_VALUE_PREFIX = re.compile(r"^(?:to|for|in|on|from|of)\s+")
+_YEAR = re.compile(r"^(?:19|20)\d{2}$")
+# "top 3 months" is a cut of the result; "last 3 months" is a new question, and so is "top 3 by week" on daily rows
+_TIME_UNITS = {"day", "days", "week", "weeks", "month", "months", "quarter", "quarters", "year", "years"}
+# Nouns in "top 5 <noun>" that name no entity ("top 5 rows")
+_GENERIC_NOUNS = {"row", "rows", "result", "results", "record", "records", "entry", "entries", "item", "items", "one", "ones"}
+
+_COMPARATORS = {
+    '>': '>', 'over': '>', 'above': '>', 'more than': '>', 'greater than': '>',
+    '>=': '>=', 'at least': '>=',
+    '<': '<', 'under': '<', 'below': '<', 'less than': '<',
+    '<=': '<=', 'at most': '<=',
+}
+
+def _words(text):
+    return " ".join(tokenize(text))
+
+def resolve_column(phrase, df):
+    """The result column a phrase names (exact, then unique partial match on its words), or None."""
+    wanted = _words(phrase)
+    if not wanted:
+        return None
+    names = {column: _words(str(column)) for column in df.columns}
+    exact = [column for column, words in names.items() if words == wanted]
+    if len(exact) == 1:
+        return exact[0]
+    wanted_tokens = set(wanted.split())
+    partial = [column for column, words in names.items() if wanted_tokens <= set(words.split())]
+    return partial[0] if len(partial) == 1 else None
+
+def _is_year_column(column, series):
+    if pd.api.types.is_datetime64_any_dtype(series) or str(series.dtype) == 'dbdate':
+        return True
+    return pd.api.types.is_integer_dtype(series) and 'year' in _words(str(column)).split()
+
+def measure_columns(df):
+    """Numeric columns that can rank rows (years excluded)."""
+    return [
+        column for column in df.columns
+        if pd.api.types.is_numeric_dtype(df[column]) and not pd.api.types.is_bool_dtype(df[column])
+        and not _is_year_column(column, df[column])
+    ]
+
+def _text_columns(df):
+    return [
+        column for column in df.columns
+        if pd.api.types.is_object_dtype(df[column]) or pd.api.types.is_string_dtype(df[column])
+        or isinstance(df[column].dtype, pd.CategoricalDtype)
+    ]
+
+def _value_filter(text, df, negate):
+    """Filter for a bare value: a year on the result's single date/year column, or a value of one text column."""
+    value = text.strip().strip("'\"")
+    if _YEAR.match(value):
+        columns = [column for column in df.columns if _is_year_column(column, df[column])]
+        if len(columns) == 1 and pd.api.types.is_integer_dtype(df[columns[0]]):
+            return {'op': 'in', 'column': columns[0], 'values': [int(value)], 'negate': negate}
+        if len(columns) == 1:
+            return {'op': 'year', 'column': columns[0], 'value': int(value), 'negate': negate}
+    matches = []
+    for column in _text_columns(df):
+        distinct = pd.Series(df[column].dropna().unique())
+        found = distinct[distinct.astype(str).str.lower() == value.lower()]
+        if len(found):
+            matches.append((column, found.tolist()))
+    if len(matches) != 1:
+        return None
+    column, values = matches[0]
+    return {'op': 'in', 'column': column, 'values': values, 'negate': negate}
+
+def _classify_clause(clause, df, plan, alternative=False):
+    """
+    Add one clause to the plan; False when the clause is not a filter, sort or top-N of this result.
+
+    Filters are ANDed, so a clause joined by "or" (alternative) is only
+    accepted as another value of the previous clause's column ("West or
+    East"); anything else needs a union the plan cannot express.
+    """
+    clause = _FILLER.sub("", clause.strip(" .?!"))
+    if not clause:
+        return not alternative
+
+    match = _TOP_N.match(clause)
+    if match:
+        direction, n, noun, by = match.groups()
+        # One sort and limit per plan: "top 1 and bottom 1" would keep only the last cut
+        if alternative or noun in _TIME_UNITS or plan['limit'] is not None:
+            return False
+        if noun and noun not in _GENERIC_NOUNS:
+            # "top 5 regions" cuts a {region, revenue} result; "top 5 products" asks about another entity
+            label = resolve_column(noun, df)
+            if label is None or label in measure_columns(df):
+                return False
+        column = resolve_column(by, df) if by else None
+        if column is None and by is None:
+            if plan['sort'] is not None:
+                column = plan['sort']['column']
+            else:
+                measures = measure_columns(df)
+                column = measures[0] if len(measures) == 1 else None
+        if column is None:
+            return False
+        plan['sort'] = {'column': column, 'ascending': direction in ('bottom', 'lowest', 'smallest', 'worst')}
+        plan['limit'] = int(n)
+        return True
+
+    match = _SORT.match(clause)
+    if match:
+        column = resolve_column(match.group(1), df)
+        if alternative or column is None:
+            return False
+        direction = match.group(2)
+        if direction is None:
+            # Measures read naturally highest first ("sort by revenue"), labels alphabetically
+            ascending = column not in measure_columns(df)
+        else:
+            ascending = direction in ('asc', 'ascending', 'increasing', 'lowest first', 'smallest first')
+        if plan['limit'] is not None and plan['sort'] != {'column': column, 'ascending': ascending}:
+            # Re-sorting a top-N cut would change which rows the cut keeps
+            return False
+        plan['sort'] = {'column': column, 'ascending': ascending}
+        return True
+
+    match = _COMPARISON.match(clause)
+    if match:
+        column = resolve_column(match.group(1), df)
+        if alternative or column is None or column not in measure_columns(df):
+            return False
+        value = float(match.group(3).replace(",", ""))
+        plan['filters'].append({'op': _COMPARATORS[match.group(2)], 'column': column, 'value': value, 'negate': False})
+        return True
+
+    negate = bool(_NEGATION.match(clause))
+    clause = _NEGATION.sub("", clause)
+    match = _EQUALITY.match(clause)
+    if match:
+        column = resolve_column(match.group(1), df)
+        condition = _value_filter(match.group(2), df[[column]], negate) if column is not None else None
+    else:
+        condition = _value_filter(_VALUE_PREFIX.sub("", clause), df, negate)
+    if condition is None:
+        return False
+    previous = plan['filters'][-1] if plan['filters'] else None
+    if (previous and previous['op'] == 'in' and condition['op'] == 'in'
+            and previous['column'] == condition['column'] and previous['negate'] == condition['negate']):
+        # "only West and East": values of one column listed together mean either of them
+        previous['values'] = previous['values'] + [value for value in condition['values'] if value not in previous['values']]
+    elif alternative:
+        return False
+    else:
+        plan['filters'].append(condition)
+    return True
+
+def classify_follow_up(question, df):
+    """
+    Recognize a follow-up answered by filtering, sorting or cutting the previous result.
+
+    Args:
+        question: Follow-up question ("only 2024", "sort by revenue", "top 5")
+        df: Previous result
+
+    Returns:
+        Plan dict with filters (list), sort (column, ascending or None) and
+        limit (rows or None), or None when any part of the question needs a
+        new query (unknown columns or values, ambiguity, "or" across columns,
+        more than one top/bottom cut, other wording)
+    """
+    plan = {'filters': [], 'sort': None, 'limit': None}
+    parts = _CLAUSE_SPLIT.split(question.lower().strip())
+    # parts alternate clause, separator, clause, ...; a clause is an alternative when "or" precedes it
+    clauses = [(clause, position > 0 and parts[position - 1] == 'or')
+               for position, clause in enumerate(parts) if position % 2 == 0 and clause]
+    if not clauses:
+        return None
+    for clause, alternative in clauses:
+        if not _classify_clause(clause, df, plan, alternative):
+            return None
+    if not plan['filters'] and plan['sort'] is None and plan['limit'] is None:
+        return None
+    return plan
+
+def apply_follow_up(df, plan):
+    """Apply a follow-up plan with vectorized pandas operations (filters, then sort, then limit)."""
+    mask = pd.Series(True, index=df.index)
+    for condition in plan['filters']:
+        column = df[condition['column']]
+        if condition['op'] == 'in':
+            matched = column.isin(condition['values'])
+        elif condition['op'] == 'year':
+            matched = pd.to_datetime(column, errors='coerce').dt.year == condition['value']
+        else:
+            matched = {
+                '>': column.gt, '>=': column.ge, '<': column.lt, '<=': column.le,
+            }[condition['op']](condition['value'])
+        mask &= ~matched if condition['negate'] else matched
+    result = df[mask]
+    if plan['sort'] is not None:
+        ascending = plan['sort']['ascending']
+        # Same NULL placement as BigQuery's ORDER BY (first ascending, last descending)
+        result = result.sort_values(
+            plan['sort']['column'], ascending=ascending, kind='stable', na_position='first' if ascending else 'last'
+        )
+    if plan['limit'] is not None:
+        result = result.head(plan['limit'])
+    return result.reset_index(drop=True)
+
+def _quote_identifier(column):
+    return "`" + str(column).replace("`", "\\`") + "`"
+
+def _literal(value):
+    if isinstance(value, str):
+        return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def follow_up_sql(sql, plan):
+    """BigQuery SQL equivalent to apply_follow_up on the result of sql (shown to the user and run if the frame is gone)."""
+    conditions = []
+    for condition in plan['filters']:
+        column = _quote_identifier(condition['column'])
+        if condition['op'] == 'in':
+            text = f"{column} IN ({', '.join(_literal(value) for value in condition['values'])})"
+        elif condition['op'] == 'year':
+            text = f"EXTRACT(YEAR FROM {column}) = {condition['value']}"
+        else:
+            text = f"{column} {condition['op']} {_literal(condition['value'])}"
+        conditions.append(f"NOT ({text})" if condition['negate'] else text)
+    lines = ["SELECT *", "FROM (", sql.strip().rstrip(";"), ")"]
+    if conditions:
+        lines.append("WHERE " + " AND ".join(conditions))
+    if plan['sort'] is not None:
+        lines.append(f"ORDER BY {_quote_identifier(plan['sort']['column'])} {'ASC' if plan['sort']['ascending'] else 'DESC'}")
+    if plan['limit'] is not None:
+        lines.append(f"LIMIT {plan['limit']}")
+    return "\n".join(lines)
+
+def describe_plan(plan):
+    """Plan as JSON-friendly metadata."""
+    return {
+        'filters': [{**condition, 'column': str(condition['column'])} for condition in plan['filters']],
+        'sort': {**plan['sort'], 'column': str(plan['sort']['column'])} if plan['sort'] else None,
+        'limit': plan['limit'],
+    }
+
+def frame_bytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+class ConversationStore:
+    """
+    Last question, SQL and (when it fitted in one response) result frame of
+    each session, in an LRU bounded by session count, total frame memory and
+    idle time. A follow-up answered from the frame becomes the session's new
+    last result, so "only 2024", then "sort by revenue", then "top 5" chain.
+    """
+
+    def __init__(self, ttl_seconds=CONVERSATION_TTL_SECONDS, max_sessions=CONVERSATION_MAX_SESSIONS,
+                 max_bytes=CONVERSATION_MAX_BYTES, max_frame_bytes=CONVERSATION_MAX_FRAME_BYTES):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.max_frame_bytes = max_frame_bytes
+        self._sessions = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.follow_ups = 0
+        self.new_questions = 0
+        self.frames_served = 0
+
+    def _get(self, session_id):
+        """Live session state (caller holds the lock)."""
+        state = self._sessions.get(session_id)
+        if state is None:
+            return None
+        if time.time() - state['updated_at'] > self.ttl_seconds:
+            self._drop(session_id)
+            return None
+        return state
+
+    def _drop(self, session_id):
+        state = self._sessions.pop(session_id, None)
+        if state is not None:
+            self._bytes -= state['bytes']
+
+    def _store(self, session_id, state):
+        """Replace a session's state and evict least recently used sessions over the bounds."""
+        with self._lock:
+            self._drop(session_id)
+            self._sessions[session_id] = state
+            self._bytes += state['bytes']
+            while self._sessions and (len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes):
+                self._drop(next(iter(self._sessions)))
+
+    def _state(self, question, sql, table_ref, df, turn):
+        if df is not None and frame_bytes(df) > self.max_frame_bytes:
+            logger.info(f"Conversation - result of {len(df)} rows too large to keep for follow-ups")
+            df = None
+        return {
+            'question': question, 'sql': sql, 'table_ref': table_ref, 'df': df, 'turn': turn,
+            'bytes': frame_bytes(df) if df is not None else 0, 'updated_at': time.time(),
+        }
+
+    def remember(self, session_id, question, sql, table_ref, df=None):
+        """
+        Record a newly answered question as the session's last result.
+
+        Args:
+            df: The complete result, or None when only part of it was read
+                (attach_result adds it once /api/bigquery has read it whole)
+        """
+        with self._lock:
+            previous = self._get(session_id)
+            self.new_questions += 1
+        turn = previous['turn'] + 1 if previous else 1
+        self._store(session_id, self._state(question, sql, table_ref, df, turn))
+
+    def attach_result(self, session_id, sql, df):
+        """Keep the complete result of the session's last SQL, read by /api/bigquery."""
+        with self._lock:
+            state = self._get(session_id)
+            if state is None or state['df'] is not None or normalize_sql(state['sql']) != normalize_sql(sql):
+                return
+        self._store(session_id, self._state(state['question'], state['sql'], state['table_ref'], df, state['turn']))
+
+    def answer(self, session_id, question, table_ref):
+        """
+        Answer a follow-up from the session's last result.
+
+        Returns:
+            Dict with sql (equivalent BigQuery SQL), df, result_handle, plan
+            and engine, or None when the question needs the full pipeline
+            (no kept result, another table, or not a filter/sort/top-N)
+        """
+        with self._lock:
+            state = self._get(session_id)
+        if state is None or state['df'] is None or state['table_ref'] != table_ref:
+            return None
+        start = time.perf_counter()
+        plan = classify_follow_up(question, state['df'])
+        if plan is None:
+            return None
+        df = apply_follow_up(state['df'], plan)
+        if df.empty:
+            # An empty cut usually means the question was read wrongly; let the full pipeline answer it
+            return None
+        sql = follow_up_sql(state['sql'], plan)
+        turn = state['turn'] + 1
+        self._store(session_id, self._state(question, sql, table_ref, df, turn))
+        with self._lock:
+            self.follow_ups += 1
+        logger.info(f"Conversation - follow-up answered from the previous result: {describe_plan(plan)}")
+        return {
+            'sql': sql,
+            'df': df,
+            'result_handle': make_conversation_handle(session_id, turn),
+            'plan': describe_plan(plan),
+            'engine': {'engine': 'pandas', 'ms': round((time.perf_counter() - start) * 1000, 1)},
+        }
+
+    def load(self, handle, sql):
+        """
+        Result frame behind a conversation result handle.
+
+        Returns:
+            Tuple of (dataframe, engine info), or None when the handle is not
+            a conversation handle, the session moved on or expired, or the
+            SQL does not match (the caller then runs the SQL)
+        """
+        if not isinstance(handle, str) or not handle.startswith("conversation:"):
+            return None
+        session_id, _, turn = handle[len("conversation:"):].rpartition(":")
+        try:
+            turn = int(turn)
+        except ValueError:
+            return None
+        start = time.perf_counter()
+        with self._lock:
+            state = self._get(session_id)
+            if (state is None or state['df'] is None or state['turn'] != turn
+                    or normalize_sql(state['sql']) != normalize_sql(sql)):
+                return None
+            state['updated_at'] = time.time()
+            self.frames_served += 1
+        return state['df'], {'engine': 'pandas', 'ms': round((time.perf_counter() - start) * 1000, 1)}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'frame_bytes': self._bytes,
+                'new_questions': self.new_questions,
+                'follow_ups': self.follow_ups,
+                'frames_served': self.frames_served,
+            }
+
+conversation = ConversationStore()
@@ -0,0 +1,134 @@
+#example_store.py past successful question/SQL pairs, retrieved with BM25 as few-shot examples
+import os
+import time
+import sqlite3
+import tempfile
+import threading
+import logging
+from text_utils import tokenize, BM25Index
+from sql_cache import normalize_question
+
+logger = logging.getLogger(__name__)
+
+# SQLite file holding the examples (empty = in-memory only)
+EXAMPLE_STORE_DB = os.environ.get(
+    "EXAMPLE_STORE_DB", os.path.join(tempfile.gettempdir(), "datagpt_examples.sqlite")
+)
+# Examples added to the SQL prompt, and the most recent examples per table kept in the index
+EXAMPLE_FEW_SHOT = int(os.environ.get("EXAMPLE_FEW_SHOT", "3"))
+EXAMPLE_MAX_PER_TABLE = int(os.environ.get("EXAMPLE_MAX_PER_TABLE", "5000"))
+# Similarity (over every word and operator of the normalized question) at or above which a stored example's SQL
+# is reused without calling Gemini; 1.0 = the same words in any order, since one changed word ("in the US") can be a filter
+EXAMPLE_BYPASS_SIMILARITY = float(os.environ.get("EXAMPLE_BYPASS_SIMILARITY", "1.0"))
+
+def similarity(question_tokens, example_tokens):
+    """Jaccard similarity of two token sets (1.0 for the same words in any order)."""
+    a, b = set(question_tokens), set(example_tokens)
+    return len(a & b) / len(a | b) if a | b else 0.0
+
+class ExampleStore:
+    """
+    Successful (question, table, SQL, row count) examples, kept per table
+    and schema fingerprint so examples never outlive a schema change.
+    """
+
+    def __init__(self, db_path=EXAMPLE_STORE_DB):
+        self.db_path = db_path or ":memory:"
+        self._conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._indexes = {}  # (table_ref, fingerprint) -> (examples, BM25 token lists, all-word token sets, BM25Index)
+        self.retrievals = 0
+        self.bypasses = 0
+        with self._lock, self._conn:
+            if db_path:
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS examples ("
+                "table_ref TEXT, fingerprint TEXT, normalized TEXT, question TEXT, sql TEXT, "
+                "row_count INTEGER, created_at REAL, PRIMARY KEY (table_ref, fingerprint, normalized))"
+            )
+
+    def add(self, table_ref, fingerprint, question, sql, row_count=None):
+        """Store (or refresh) the example for a question that returned rows."""
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO examples "
+                    "(table_ref, fingerprint, normalized, question, sql, row_count, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (table_ref, fingerprint, normalize_question(question), question, sql, row_count, time.time())
+                )
+                self._indexes.pop((table_ref, fingerprint), None)
+        except sqlite3.Error as e:
+            logger.warning(f"Example store - could not store example for {table_ref}: {e}")
+
+    def _index(self, table_ref, fingerprint):
+        key = (table_ref, fingerprint)
+        with self._lock:
+            cached = self._indexes.get(key)
+            if cached is not None:
+                return cached
+            rows = self._conn.execute(
+                "SELECT question, sql, row_count FROM examples WHERE table_ref = ? AND fingerprint = ? "
+                "ORDER BY created_at DESC LIMIT ?",
+                (table_ref, fingerprint, EXAMPLE_MAX_PER_TABLE)
+            ).fetchall()
+        examples = [{'question': question, 'sql': sql, 'row_count': row_count} for question, sql, row_count in rows]
+        tokens = [tokenize(example['question']) for example in examples]
+        # Stopwords only hurt BM25 ranking; the bypass compares every word and operator ("us", "per", ">")
+        words = [set(normalize_question(example['question']).split()) for example in examples]
+        cached = (examples, tokens, words, BM25Index(tokens))
+        with self._lock:
+            self._indexes[key] = cached
+        return cached
+
+    def similar(self, table_ref, fingerprint, question, k=EXAMPLE_FEW_SHOT):
+        """
+        Most similar stored examples for a question on the same table and schema.
+
+        Returns:
+            Up to k examples (question, sql, row_count, BM25 score and
+            similarity over all words and operators of the normalized question),
+            best BM25 score first
+        """
+        try:
+            examples, tokens, words, index = self._index(table_ref, fingerprint)
+        except sqlite3.Error as e:
+            logger.warning(f"Example store - could not read examples for {table_ref}: {e}")
+            return []
+        with self._lock:
+            self.retrievals += 1
+        if not examples:
+            return []
+
+        scores = index.scores(tokenize(question))
+        question_words = normalize_question(question).split()
+        best = sorted((i for i in range(len(examples)) if scores[i] > 0), key=lambda i: -scores[i])[:k]
+        return [
+            {**examples[i], 'score': round(scores[i], 3), 'similarity': round(similarity(question_words, words[i]), 3)}
+            for i in best
+        ]
+
+    def bypass_candidate(self, examples):
+        """The example whose SQL can be reused as-is, or None."""
+        candidate = max(examples, key=lambda example: example['similarity'], default=None)
+        if candidate is None or candidate['similarity'] < EXAMPLE_BYPASS_SIMILARITY:
+            return None
+        with self._lock:
+            self.bypasses += 1
+        return candidate
+
+    def stats(self):
+        try:
+            with self._lock:
+                count = self._conn.execute("SELECT COUNT(*) FROM examples").fetchone()[0]
+        except sqlite3.Error:
+            count = None
+        return {
+            'examples': count,
+            'indexed_tables': len(self._indexes),
+            'retrievals': self.retrievals,
+            'bypasses': self.bypasses,
+        }
+
+example_store = ExampleStore()
@@ -0,0 +1,161 @@
+#gemini_models.py shared, lazily built Gemini model handles with a concurrency limit
+import os
+import threading
+import logging
+from contextlib import contextmanager
+import google.generativeai as genai
+from bq_clients import load_credentials
+
+logger = logging.getLogger(__name__)
+
+GEMINI_MODEL_NAME = os.environ.get("GEMINI_MODEL_NAME", "gemini-pro")
+GEMINI_SCOPES = [
+    "https://www.googleapis.com/auth/generative-language",
+    "https://www.googleapis.com/auth/cloud-platform",
+]
+
+# Concurrency settings: calls beyond GEMINI_MAX_IN_FLIGHT wait in a bounded queue,
+# and are rejected straight away once GEMINI_MAX_QUEUED callers are already waiting
+GEMINI_MAX_IN_FLIGHT = int(os.environ.get("GEMINI_MAX_IN_FLIGHT", "8"))
+GEMINI_MAX_QUEUED = int(os.environ.get("GEMINI_MAX_QUEUED", "16"))
+GEMINI_QUEUE_TIMEOUT = float(os.environ.get("GEMINI_QUEUE_TIMEOUT", "10"))
+
+# Named generation configurations
+GENERATION_CONFIGS = {
+    "default": {
+        "temperature": 0.4,
+        "top_p": 1,
+        "top_k": 32,
+        "max_output_tokens": 4096,
+    },
+    # SQL generation wants deterministic, short answers
+    "sql": {
+        "temperature": 0.1,
+        "top_p": 1,
+        "top_k": 32,
+        "max_output_tokens": 1024,
+    },
+    # Result and chart descriptions
+    "summary": {
+        "temperature": 0.4,
+        "top_p": 1,
+        "top_k": 32,
+        "max_output_tokens": 1024,
+    },
+    # Single structured call returning description, chart type and chart description
+    "insights": {
+        "temperature": 0.4,
+        "top_p": 1,
+        "top_k": 32,
+        "max_output_tokens": 2048,
+        "response_mime_type": "application/json",
+    },
+}
+
+class GeminiOverloadedError(RuntimeError):
+    """Raised when a Gemini call cannot get a slot; callers should answer 503."""
+
+class GeminiLimiter:
+    """Semaphore with a bounded wait queue and fast rejection."""
+
+    def __init__(self, max_in_flight, max_queued, queue_timeout):
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self.rejected = 0
+
+    @contextmanager
+    def slot(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self._waiting >= self.max_queued:
+                    self.rejected += 1
+                    raise GeminiOverloadedError("Too many Gemini requests queued, please retry shortly")
+                self._waiting += 1
+            try:
+                acquired = self._slots.acquire(timeout=self.queue_timeout)
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+            if not acquired:
+                with self._lock:
+                    self.rejected += 1
+                raise GeminiOverloadedError(f"No Gemini slot available within {self.queue_timeout}s")
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        return {'waiting': self._waiting, 'rejected': self.rejected}
+
+gemini_limiter = GeminiLimiter(GEMINI_MAX_IN_FLIGHT, GEMINI_MAX_QUEUED, GEMINI_QUEUE_TIMEOUT)
+
+class LimitedModel:
+    """Wraps a GenerativeModel so every generate_content call holds a limiter slot."""
+
+    def __init__(self, model, limiter):
+        self.model = model
+        self.limiter = limiter
+
+    def generate_content(self, *args, **kwargs):
+        with self.limiter.slot():
+            return self.model.generate_content(*args, **kwargs)
+
+    def stream_content(self, *args, **kwargs):
+        """generate_content(stream=True); the limiter slot is held until the stream is consumed."""
+        with self.limiter.slot():
+            for chunk in self.model.generate_content(*args, stream=True, **kwargs):
+                yield chunk
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+_models = {}
+_models_lock = threading.Lock()
+_configured_with = None
+
+def _configure(credentials_path):
+    """Run genai.configure() once per credentials file, with explicitly loaded credentials."""
+    global _configured_with
+    if _configured_with == credentials_path:
+        return
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if api_key:
+        genai.configure(api_key=api_key)
+    else:
+        credentials, _ = load_credentials(credentials_path, scopes=GEMINI_SCOPES)
+        genai.configure(credentials=credentials)
+    _configured_with = credentials_path
+
+def get_gemini_model(credentials_path, config_name="default"):
+    """
+    Return the shared model handle for a named generation config.
+
+    Args:
+        credentials_path: Path to the Gemini service account JSON file
+        config_name: Key of GENERATION_CONFIGS
+
+    Returns:
+        LimitedModel whose calls are bounded by gemini_limiter
+    """
+    model = _models.get(config_name)
+    if model is not None:
+        return model
+
+    with _models_lock:
+        model = _models.get(config_name)
+        if model is None:
+            _configure(credentials_path)
+            model = LimitedModel(
+                genai.GenerativeModel(
+                    model_name=GEMINI_MODEL_NAME,
+                    generation_config=GENERATION_CONFIGS[config_name]
+                ),
+                gemini_limiter
+            )
+            _models[config_name] = model
+            logger.info(f"Built Gemini model handle '{config_name}' ({GEMINI_MODEL_NAME})")
+    return model
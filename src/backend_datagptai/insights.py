@@ -0,0 +1,187 @@
+#insights.py result description, chart type and chart description for /api/bigquery
+import os
+import re
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from google.api_core.exceptions import InvalidArgument
+from chart_recommender import recommend_chart
+from result_profile import result_section
+
+logger = logging.getLogger(__name__)
+
+# "bundle": one structured call returning all three answers as JSON
+# "parallel": separate description and viz calls run concurrently, then the chart description
+INSIGHT_MODE = os.environ.get("INSIGHT_MODE", "bundle")
+
+VALID_CHART_TYPES = ["bar", "line", "scatter", "pie"]
+
+# Flipped off the first time the model rejects JSON output mode
+_structured_output_supported = True
+
+def result_context(df, total_rows=None):
+    """Column statistics shared by every insight prompt, computed once per result (see result_profile)."""
+    return result_section(df, total_rows)
+
+def normalize_chart_type(value):
+    """Map a free-text chart answer onto one of VALID_CHART_TYPES, or None."""
+    chart_type = (value or "").strip().lower()
+    if chart_type and " " in chart_type:
+        chart_type = chart_type.split()[0]
+    return chart_type if chart_type in VALID_CHART_TYPES else None
+
+def parse_viz_answer(text):
+    """Chart type from a 'Viz: <type>' answer, tolerating markdown emphasis and brackets."""
+    match = re.search(r"Viz\W*\s*([A-Za-z]+)", text or "", re.IGNORECASE)
+    return normalize_chart_type(match.group(1)) if match else None
+
+def build_description_prompt(context, user_query, sql_query):
+    return f"""
+        You are an AI assistant that summarizes query results in plain English.
+        {context}
+        Question: {user_query}
+        SQL Query: {sql_query}
+        SQL Result: Describe what the result dataframe represents and not the sql query itself, key metrics, and any important aggregations or patterns for eg: "based on the results, category a has more sales than category b".
+        Provide your response in the format:
+        Description: [Summary of what the SQL Result contains including key metrics and patterns]
+        """
+
+def build_viz_prompt(context, user_query, sql_query):
+    return f"""
+        You are an AI assistant that recommends appropriate data visualizations.
+        {context}
+        Question: {user_query}
+        SQL Query: {sql_query}
+        Provide your response in the format:
+        Viz: [Chart type or "none"]
+        """
+
+def build_chart_description_prompt(chart_type, data_preview_description):
+    return f"""
+        You are an AI assistant that describes charts in simple terms.
+        Chart Type: {chart_type}
+        Data Description: {data_preview_description}
+        Describe what the chart illustrates and any key insights.
+        Provide your response in the format:
+        Chart Description: [Explanation of what the chart illustrates]
+        """
+
+def build_insight_bundle_prompt(context, user_query, sql_query, chosen=None):
+    """Bundle prompt; with a chosen (local) chart recommendation the model only describes that chart."""
+    if chosen is None:
+        chart_keys = '''"chart_type": one of "bar", "line", "scatter", "pie" or "none".
+        "chart_description": what that chart illustrates and any key insights.'''
+    elif chosen['chart_type']:
+        chart_keys = f'''"chart_description": what the {chosen['chart_type']} chart of this result illustrates and any key insights.'''
+    else:
+        chart_keys = ""
+    return f"""
+        You are an AI assistant that summarizes query results and recommends a visualization.
+        {context}
+        Question: {user_query}
+        SQL Query: {sql_query}
+        Respond with a single JSON object and nothing else, with these keys:
+        "description": what the result dataframe represents (not the sql query itself), key metrics, and any important aggregations or patterns, for eg: "based on the results, category a has more sales than category b".
+        {chart_keys}
+        """
+
+def parse_insight_bundle(text):
+    """Parse the bundle JSON, tolerating markdown fences or prose around the object."""
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if not match:
+        raise ValueError("Insight bundle response contains no JSON object")
+    bundle = json.loads(match.group(0))
+    if not isinstance(bundle, dict) or not bundle.get("description"):
+        raise ValueError("Insight bundle response is missing the description")
+    return bundle
+
+def generate_insight_bundle(model_factory, context, user_query, sql_query, chosen=None):
+    """Single LLM call; uses JSON output mode when the model supports it. chosen skips the chart choice."""
+    global _structured_output_supported
+    prompt = build_insight_bundle_prompt(context, user_query, sql_query, chosen)
+    if _structured_output_supported:
+        try:
+            response = model_factory("insights").generate_content([prompt])
+        except InvalidArgument as e:
+            logger.warning(f"Structured output not supported by the model, using plain text JSON: {e}")
+            _structured_output_supported = False
+    if not _structured_output_supported:
+        response = model_factory("summary").generate_content([prompt])
+
+    bundle = parse_insight_bundle(response.text)
+    chart_type = chosen['chart_type'] if chosen else normalize_chart_type(bundle.get("chart_type"))
+    return {
+        'data_preview_description': bundle["description"].strip(),
+        'chart_type': chart_type,
+        'chart_description': (bundle.get("chart_description") or "").strip(),
+        'llm_recommendation': f"Viz: {chart_type or 'none'}",
+        'insight_mode': 'bundle',
+    }
+
+def generate_insights_parallel(model_factory, context, user_query, sql_query, chosen=None):
+    """
+    Fallback: description and viz calls run concurrently, then the chart description.
+    With a chosen (local) chart recommendation the viz call is skipped.
+    """
+    model = model_factory("summary")
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        description_future = pool.submit(model.generate_content, [build_description_prompt(context, user_query, sql_query)])
+        viz_future = None
+        if chosen is None:
+            viz_future = pool.submit(model.generate_content, [build_viz_prompt(context, user_query, sql_query)])
+        data_preview_description = description_future.result().text.strip()
+        viz_response = viz_future.result() if viz_future is not None else None
+
+    chart_type = parse_viz_answer(viz_response.text) if viz_response is not None else chosen['chart_type']
+    chart_description = ""
+    if chart_type is not None:
+        chart_description = model.generate_content(
+            [build_chart_description_prompt(chart_type, data_preview_description)]
+        ).text.strip()
+    return {
+        'data_preview_description': data_preview_description,
+        'chart_type': chart_type,
+        'chart_description': chart_description,
+        'llm_recommendation': viz_response.text if viz_response is not None else f"Viz: {chart_type or 'none'}",
+        'insight_mode': 'parallel',
+    }
+
+def generate_insights(model_factory, df, user_query, sql_query):
+    """
+    Describe a query result and pick a chart for it.
+
+    The chart type and axes come from chart_recommender; Gemini is asked
+    for the chart type only when the recommendation is not confident.
+
+    Args:
+        model_factory: Callable returning a Gemini model for a generation config name
+        df: Result dataframe
+        user_query: The user's question
+        sql_query: SQL that produced df
+
+    Returns:
+        Dict with data_preview_description, chart_type, chart_description,
+        llm_recommendation, insight_mode and chart_recommendation (x, y,
+        confidence, reason and source: local or llm)
+    """
+    recommendation = recommend_chart(df, user_query)
+    chosen = recommendation if recommendation['confident'] else None
+    context = result_context(df)
+
+    insights = None
+    if INSIGHT_MODE == "bundle":
+        try:
+            insights = generate_insight_bundle(model_factory, context, user_query, sql_query, chosen)
+        except ValueError as e:
+            logger.warning(f"Insight bundle unusable, falling back to parallel calls: {e}")
+    if insights is None:
+        insights = generate_insights_parallel(model_factory, context, user_query, sql_query, chosen)
+
+    insights['chart_recommendation'] = {
+        'x': recommendation['x'],
+        'y': recommendation['y'],
+        'confidence': recommendation['confidence'],
+        'reason': recommendation['reason'],
+        'source': 'local' if chosen else 'llm',
+    }
+    return insights
@@ -0,0 +1,76 @@
+#loadtest_fastapi.py shows that concurrent slow requests no longer serialize on the event loop
+#
+# Fires N concurrent requests at /api/bigquery/connections with a stubbed BigQuery
+# client whose list_projects() blocks for --delay seconds, plus one /api/cache/stats
+# request issued at the same time. Runs the same load against a copy of the previous route
+# (blocking call directly inside async def) for comparison. Needs httpx.
+#   python loadtest_fastapi.py --requests 20 --delay 0.5
+import time
+import asyncio
+import argparse
+import httpx
+from fastapi import FastAPI
+import cloudfastapi
+
+class SlowProject:
+    def __init__(self, project_id):
+        self.project_id = project_id
+
+class SlowBigQueryClient:
+    """Stands in for bigquery.Client; every list call blocks like a slow API round trip."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.project = "loadtest"
+
+    def list_projects(self):
+        time.sleep(self.delay)
+        return [SlowProject("loadtest")]
+
+def blocking_app(client):
+    """The previous pattern: blocking SDK call made directly on the event loop."""
+    app = FastAPI()
+
+    @app.get('/api/bigquery/connections')
+    async def get_bigquery_connections():
+        return [project.project_id for project in client.list_projects()]
+
+    @app.get('/api/cache/stats')
+    async def get_cache_stats():
+        return {}
+
+    return app
+
+async def run_load(app, requests):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=None) as client:
+        start = time.perf_counter()
+
+        # Latency is measured from the moment the whole batch was issued
+        async def timed(path):
+            response = await client.get(path)
+            response.raise_for_status()
+            return time.perf_counter() - start
+
+        slow = [asyncio.create_task(timed('/api/bigquery/connections')) for _ in range(requests)]
+        fast = asyncio.create_task(timed('/api/cache/stats'))
+        await asyncio.gather(*slow, fast)
+        return time.perf_counter() - start, fast.result()
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrency load test for the FastAPI backend")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.5, help="seconds each stubbed BigQuery call blocks")
+    args = parser.parse_args()
+
+    client = SlowBigQueryClient(args.delay)
+    cloudfastapi.initialize_bigquery = lambda: client
+
+    print(f"{args.requests} concurrent requests, {args.delay}s blocking call each "
+          f"(fully serialized would take {args.requests * args.delay:.1f}s)")
+    for label, app in [("blocking on event loop", blocking_app(client)), ("thread pool offload", cloudfastapi.app)]:
+        total, fast_latency = asyncio.run(run_load(app, args.requests))
+        print(f"{label:<24} wall {total:6.2f}s   /api/cache/stats latency during load {fast_latency * 1000:8.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+#local_engine.py answers queries on small or hot tables from local Parquet extracts with DuckDB
+import os
+import time
+import hashlib
+import tempfile
+import threading
+import logging
+from metadata_catalog import catalog
+
+try:
+    import duckdb
+except ImportError:  # Optional: every query goes to BigQuery without it
+    duckdb = None
+
+try:
+    import sqlglot
+    from sqlglot import exp
+except ImportError:
+    sqlglot = None
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+# Set to 0 to send every query to BigQuery even when duckdb is installed
+LOCAL_ENGINE_ENABLED = os.environ.get("LOCAL_ENGINE_ENABLED", "1") == "1"
+# Directory holding the Parquet extracts (kept across restarts)
+LOCAL_ENGINE_DIR = os.environ.get("LOCAL_ENGINE_DIR", os.path.join(tempfile.gettempdir(), "datagpt_extracts"))
+# Tables up to this size are extracted automatically
+LOCAL_ENGINE_MAX_ROWS = int(os.environ.get("LOCAL_ENGINE_MAX_ROWS", "100000"))
+LOCAL_ENGINE_MAX_BYTES = int(os.environ.get("LOCAL_ENGINE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Comma-separated table references always extracted whatever their size ("project.dataset.table")
+LOCAL_ENGINE_HOT_TABLES = {ref.strip() for ref in os.environ.get("LOCAL_ENGINE_HOT_TABLES", "").split(",") if ref.strip()}
+# A table whose extract failed is not retried for this long
+LOCAL_ENGINE_RETRY_SECONDS = float(os.environ.get("LOCAL_ENGINE_RETRY_SECONDS", "900"))
+
+# Functions whose DuckDB translation matches BigQuery's results; queries using any other
+# function (FORMAT, REGEXP_*, UDFs, ...) run on BigQuery
+LOCAL_FUNCTIONS = (
+    "Sum", "Count", "CountIf", "Avg", "Min", "Max", "Round", "Abs", "Coalesce", "Nullif", "If", "Case",
+    "SafeDivide", "Cast", "TryCast", "Upper", "Lower", "Trim", "Length", "Concat", "Substring",
+    "DateTrunc", "TimestampTrunc", "DateAdd", "DateSub", "CurrentDate", "TsOrDsToDate", "TimeToStr",
+    "Extract", "RowNumber", "Rank", "DenseRank",
+)
+# EXTRACT parts numbered the same way in both engines (BigQuery's DAYOFWEEK and WEEK differ)
+LOCAL_EXTRACT_PARTS = {"YEAR", "QUARTER", "MONTH", "DAY", "HOUR", "MINUTE", "SECOND"}
+
+def positive_integer(node):
+    return isinstance(node, exp.Literal) and not node.is_string and node.this.isdigit() and int(node.this) > 0
+
+def modified_marker(modified):
+    return hashlib.sha1((modified or "").encode()).hexdigest()[:12]
+
+def view_name(table_ref):
+    return "t_" + hashlib.sha1(table_ref.encode()).hexdigest()[:16]
+
+def referenced_table(sql):
+    """The single fully qualified table a query reads, or None (joins, CTE-only, unparsable)."""
+    try:
+        tree = sqlglot.parse_one(sql, read="bigquery")
+    except sqlglot.errors.ParseError:
+        return None
+    ctes = {cte.alias_or_name for cte in tree.find_all(exp.CTE)}
+    refs = {
+        ".".join(part for part in (table.catalog, table.db, table.name) if part)
+        for table in tree.find_all(exp.Table) if table.name not in ctes
+    }
+    if len(refs) != 1:
+        return None
+    ref = refs.pop()
+    return ref if ref.count(".") == 2 else None
+
+def unsupported_function(tree):
+    """Name of the first function the local engine does not run, or None."""
+    allowed = tuple(getattr(exp, name) for name in LOCAL_FUNCTIONS if hasattr(exp, name))
+    for function in tree.find_all(exp.Func):
+        if type(function) not in allowed:
+            return function.sql(dialect="bigquery").split("(")[0] or type(function).__name__
+        if isinstance(function, exp.Extract) and function.this.name.upper() not in LOCAL_EXTRACT_PARTS:
+            return f"EXTRACT({function.this.name})"
+        # BigQuery reads a start of 0 as 1 and rejects negative lengths; DuckDB returns one
+        # character less and counts backwards, so only literal positive arguments run locally
+        if isinstance(function, exp.Substring):
+            length = function.args.get('length')
+            if not positive_integer(function.args.get('start')) or (length is not None and not positive_integer(length)):
+                return "SUBSTR with a non-literal or non-positive position or length"
+    return None
+
+def to_duckdb(sql, table_ref, view):
+    """
+    Transpile BigQuery SQL to DuckDB, reading table_ref from the extract's view.
+
+    Raises:
+        ValueError: the query uses a function outside LOCAL_FUNCTIONS
+    """
+    tree = sqlglot.parse_one(sql, read="bigquery")
+    unsupported = unsupported_function(tree)
+    if unsupported:
+        raise ValueError(f"{unsupported} is not run locally")
+    for table in tree.find_all(exp.Table):
+        if ".".join(part for part in (table.catalog, table.db, table.name) if part) == table_ref:
+            table.set("catalog", None)
+            table.set("db", None)
+            table.set("this", exp.to_identifier(view))
+    # DATE_ADD/DATE_SUB return a DATE in BigQuery; DuckDB's date + interval is a TIMESTAMP
+    for arithmetic in reversed(list(tree.find_all(exp.DateAdd, exp.DateSub))):
+        arithmetic.replace(exp.cast(arithmetic.copy(), "DATE"))
+    return tree.sql(dialect="duckdb")
+
+class LocalEngine:
+    """
+    Parquet extracts of small or hot BigQuery tables, queried with DuckDB.
+    An extract is tied to the table's last-modified time: when the table
+    changes, queries go back to BigQuery until a fresh extract is built
+    in the background.
+    """
+
+    def __init__(self, directory=LOCAL_ENGINE_DIR):
+        self.available = LOCAL_ENGINE_ENABLED and duckdb is not None and sqlglot is not None and pq is not None
+        self.directory = directory
+        self._extracts = {}  # table_ref -> {marker, path, view, rows, extracted_at}
+        self._building = set()
+        self._failed = {}
+        self._lock = threading.Lock()
+        self.local_queries = 0
+        self.fallbacks = 0
+        self.extracts = 0
+        if not self.available:
+            return
+        os.makedirs(directory, exist_ok=True)
+        self._conn = duckdb.connect()
+        self._load_existing()
+
+    def _load_existing(self):
+        """Register extracts left by a previous process (newest file per table)."""
+        found = {}
+        for name in os.listdir(self.directory):
+            if not name.endswith(".parquet") or "@" not in name:
+                continue
+            table_ref, marker = name[:-len(".parquet")].rsplit("@", 1)
+            path = os.path.join(self.directory, name)
+            if table_ref not in found or os.path.getmtime(path) > os.path.getmtime(found[table_ref][1]):
+                found[table_ref] = (marker, path)
+        for table_ref, (marker, path) in found.items():
+            try:
+                self._register(table_ref, marker, path, pq.ParquetFile(path).metadata.num_rows, os.path.getmtime(path))
+            except Exception as e:
+                logger.warning(f"Local engine - ignoring unreadable extract {path}: {e}")
+
+    def _register(self, table_ref, marker, path, rows, extracted_at):
+        view = view_name(table_ref)
+        escaped = path.replace("'", "''")
+        with self._lock:
+            self._conn.execute(f"CREATE OR REPLACE VIEW {view} AS SELECT * FROM read_parquet('{escaped}')")
+            previous = self._extracts.get(table_ref)
+            self._extracts[table_ref] = {
+                'marker': marker, 'path': path, 'view': view, 'rows': rows, 'extracted_at': extracted_at
+            }
+        if previous and previous['path'] != path:
+            try:
+                os.remove(previous['path'])
+            except OSError:
+                pass
+
+    def eligible(self, entry):
+        # Extracts go through tabledata.list, which only serves base tables
+        if entry.get('table_type', 'TABLE') != 'TABLE':
+            return False
+        if entry['table_ref'] in LOCAL_ENGINE_HOT_TABLES:
+            return True
+        return (entry.get('num_rows') is not None and entry['num_rows'] <= LOCAL_ENGINE_MAX_ROWS
+                and (entry.get('num_bytes') or 0) <= LOCAL_ENGINE_MAX_BYTES)
+
+    def refresh(self, client, entry):
+        """
+        Extract the whole table (tabledata.list, nothing billed) into a new
+        Parquet file. Every refresh is a full re-extract: tabledata.list has
+        no stable row order to append new rows from.
+        """
+        table_ref = entry['table_ref']
+        marker = modified_marker(entry['modified'])
+        path = os.path.join(self.directory, f"{table_ref}@{marker}.parquet")
+        start = time.perf_counter()
+        try:
+            table = client.list_rows(table_ref).to_arrow()
+            partial = path + ".partial"
+            pq.write_table(table, partial)
+            os.replace(partial, path)
+        except Exception as e:
+            logger.warning(f"Local engine - extract of {table_ref} failed: {e}")
+            with self._lock:
+                self._failed[table_ref] = time.monotonic()
+            return None
+        self._register(table_ref, marker, path, table.num_rows, time.time())
+        with self._lock:
+            self._failed.pop(table_ref, None)
+            self.extracts += 1
+        logger.info(f"Local engine - extracted {table_ref}: {table.num_rows} rows in {time.perf_counter() - start:.1f}s")
+        return self._extracts[table_ref]
+
+    def ensure(self, client, entry):
+        """
+        The table's extract when it matches the table's current version;
+        otherwise None, with a background extract started.
+        """
+        table_ref = entry['table_ref']
+        marker = modified_marker(entry['modified'])
+        with self._lock:
+            extract = self._extracts.get(table_ref)
+            if extract is not None and extract['marker'] == marker:
+                return extract
+            failed_at = self._failed.get(table_ref)
+            if table_ref in self._building or (failed_at and time.monotonic() - failed_at < LOCAL_ENGINE_RETRY_SECONDS):
+                return None
+            self._building.add(table_ref)
+
+        def build():
+            try:
+                self.refresh(client, entry)
+            finally:
+                with self._lock:
+                    self._building.discard(table_ref)
+
+        threading.Thread(target=build, name=f"local-extract-{table_ref}", daemon=True).start()
+        return None
+
+    def warm_up_in_background(self, client_factory, table_refs=LOCAL_ENGINE_HOT_TABLES):
+        """Extract the hot tables on a daemon thread so app startup is not delayed."""
+        if not self.available or not table_refs:
+            return None
+
+        def warm_up():
+            client = client_factory()
+            for table_ref in table_refs:
+                try:
+                    self.ensure(client, catalog.get_table(client, table_ref))
+                except Exception as e:
+                    logger.warning(f"Local engine - warm-up of {table_ref} failed: {e}")
+
+        thread = threading.Thread(target=warm_up, name="local-engine-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def run(self, client, sql, entry=None, max_rows=None):
+        """
+        Run a query locally when its table has a current extract.
+
+        Args:
+            client: BigQuery client (catalog lookups and background extracts)
+            sql: Validated BigQuery SQL
+            entry: Catalog entry of the queried table, when the caller has it
+            max_rows: Give up (BigQuery answers instead) when the result is larger
+
+        Returns:
+            Tuple of (dataframe, info with engine, ms and extract details),
+            or None when BigQuery has to answer: no single-table query, table
+            not eligible, extract missing or stale, or SQL DuckDB cannot run
+        """
+        if not self.available:
+            return None
+        table_ref = referenced_table(sql)
+        if table_ref is None:
+            return None
+        if entry is None or entry['table_ref'] != table_ref:
+            entry = catalog.get_table(client, table_ref)
+        if not self.eligible(entry):
+            return None
+        extract = self.ensure(client, entry)
+        if extract is None:
+            return None
+
+        start = time.perf_counter()
+        try:
+            local_sql = to_duckdb(sql, table_ref, extract['view'])
+            with self._lock:
+                cursor = self._conn.cursor()
+            try:
+                # BigQuery evaluates timestamps in UTC; each cursor would otherwise use the host's time zone
+                cursor.execute("SET TimeZone='UTC'")
+                df = cursor.execute(local_sql).df()
+            finally:
+                cursor.close()
+        except Exception as e:
+            logger.info(f"Local engine - falling back to BigQuery for {table_ref}: {e}")
+            with self._lock:
+                self.fallbacks += 1
+            return None
+        if max_rows is not None and len(df) > max_rows:
+            with self._lock:
+                self.fallbacks += 1
+            return None
+
+        with self._lock:
+            self.local_queries += 1
+        return df, {
+            'engine': 'duckdb',
+            'ms': round((time.perf_counter() - start) * 1000, 1),
+            'extract_rows': extract['rows'],
+            'extracted_at': extract['extracted_at'],
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                'available': self.available,
+                'tables': len(self._extracts),
+                'building': len(self._building),
+                'extracts': self.extracts,
+                'local_queries': self.local_queries,
+                'fallbacks': self.fallbacks,
+            }
+
+local_engine = LocalEngine()
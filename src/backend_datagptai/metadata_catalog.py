@@ -0,0 +1,206 @@
+#metadata_catalog.py TTL cache of BigQuery table metadata with parallel warm-up and an on-disk snapshot
+import os
+import json
+import time
+import tempfile
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+CATALOG_TTL_SECONDS = float(os.environ.get("CATALOG_TTL_SECONDS", "300"))
+CATALOG_MAX_WORKERS = int(os.environ.get("CATALOG_MAX_WORKERS", "8"))
+CATALOG_SNAPSHOT_PATH = os.environ.get(
+    "CATALOG_SNAPSHOT_PATH", os.path.join(tempfile.gettempdir(), "datagpt_metadata_catalog.json")
+)
+# Snapshot entries older than this are ignored on startup
+CATALOG_SNAPSHOT_MAX_AGE = float(os.environ.get("CATALOG_SNAPSHOT_MAX_AGE", "86400"))
+# Changes are written to the snapshot by a background timer this long after the first of them
+CATALOG_SNAPSHOT_DELAY_SECONDS = float(os.environ.get("CATALOG_SNAPSHOT_DELAY_SECONDS", "5"))
+# Comma separated datasets ("project.dataset") to warm up when the app starts
+CATALOG_WARM_DATASETS = [d for d in os.environ.get("CATALOG_WARM_DATASETS", "").split(",") if d]
+
+def table_entry(table):
+    """Convert a bigquery.Table into the JSON-serializable entry stored in the catalog."""
+    return {
+        'table_ref': f"{table.project}.{table.dataset_id}.{table.table_id}",
+        'columns': [
+            {
+                'name': field.name,
+                'type': field.field_type,
+                'mode': field.mode,
+                'description': field.description,
+            }
+            for field in table.schema
+        ],
+        'etag': table.etag,
+        'modified': table.modified.isoformat() if table.modified else None,
+        'num_rows': table.num_rows,
+        'num_bytes': table.num_bytes,
+        # TABLE, VIEW, MATERIALIZED_VIEW, EXTERNAL, SNAPSHOT...; only TABLE can be read with tabledata.list
+        'table_type': table.table_type,
+    }
+
+def schema_pairs(entry):
+    """Return the entry's columns as (name, field_type) tuples."""
+    return [(column['name'], column['type']) for column in entry['columns']]
+
+class MetadataCatalog:
+    """
+    Process-wide cache of table metadata.
+
+    Entries are served from memory for ttl_seconds, then revalidated with
+    get_table(); a changed etag or modified time replaces the entry, an
+    unchanged one only extends its TTL. The catalog is persisted to
+    snapshot_path so a cold start can answer without any metadata round
+    trips; new and replaced entries are written there by a background timer,
+    snapshot_delay seconds after the first change, never on the request thread.
+    """
+
+    def __init__(self, ttl_seconds=CATALOG_TTL_SECONDS, max_workers=CATALOG_MAX_WORKERS,
+                 snapshot_path=CATALOG_SNAPSHOT_PATH, snapshot_max_age=CATALOG_SNAPSHOT_MAX_AGE,
+                 snapshot_delay=CATALOG_SNAPSHOT_DELAY_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.max_workers = max_workers
+        self.snapshot_path = snapshot_path
+        self.snapshot_max_age = snapshot_max_age
+        self.snapshot_delay = snapshot_delay
+        self._entries = {}  # table_ref -> (entry, fetched_at monotonic, fetched_at wall clock)
+        self._lock = threading.Lock()
+        self._snapshot_timer = None
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.invalidations = 0
+        self.load_snapshot()
+
+    def get_table(self, client, table_ref, save=True):
+        """Return the catalog entry for a fully qualified table reference."""
+        cached = self._entries.get(table_ref)
+        if cached and time.monotonic() - cached[1] < self.ttl_seconds:
+            with self._lock:
+                self.hits += 1
+            return cached[0]
+
+        entry = table_entry(client.get_table(table_ref))
+        with self._lock:
+            if cached is None:
+                self.misses += 1
+            else:
+                self.revalidations += 1
+                if (cached[0]['etag'], cached[0]['modified']) == (entry['etag'], entry['modified']):
+                    # Unchanged: keep the entry, extend its TTL and leave the snapshot alone
+                    self._entries[table_ref] = (cached[0], time.monotonic(), time.time())
+                    return cached[0]
+                self.invalidations += 1
+                logger.info(f"Metadata catalog - {table_ref} changed, entry replaced")
+            self._entries[table_ref] = (entry, time.monotonic(), time.time())
+        if save:
+            self.schedule_snapshot()
+        return entry
+
+    def get_dataset(self, client, dataset_ref):
+        """
+        Return {table_id: entry} for every table in a dataset, fetching
+        uncached schemas in parallel on a bounded thread pool.
+        """
+        table_refs = {
+            table.table_id: f"{table.project}.{table.dataset_id}.{table.table_id}"
+            for table in client.list_tables(dataset_ref)
+        }
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            entries = list(pool.map(lambda ref: self.get_table(client, ref, save=False), table_refs.values()))
+        self.schedule_snapshot()
+        return dict(zip(table_refs.keys(), entries))
+
+    def warm_up(self, client, dataset_refs):
+        """Load every table of the given datasets; errors are logged, not raised."""
+        for dataset_ref in dataset_refs:
+            try:
+                tables = self.get_dataset(client, dataset_ref)
+                logger.info(f"Metadata catalog - warmed {len(tables)} tables from {dataset_ref}")
+            except Exception as e:
+                logger.error(f"Metadata catalog warm-up failed for {dataset_ref}: {e}")
+
+    def warm_up_in_background(self, client_factory, dataset_refs):
+        """Run warm_up() on a daemon thread so app startup is not delayed."""
+        if not dataset_refs:
+            return None
+        thread = threading.Thread(
+            target=lambda: self.warm_up(client_factory(), dataset_refs),
+            name="metadata-catalog-warm-up",
+            daemon=True
+        )
+        thread.start()
+        return thread
+
+    def invalidate(self, table_ref=None):
+        """Drop one entry, or every entry when table_ref is None."""
+        with self._lock:
+            if table_ref is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(table_ref, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.revalidations
+        return {
+            'tables': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'revalidations': self.revalidations,
+            'invalidations': self.invalidations,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def schedule_snapshot(self):
+        """Save the snapshot on a daemon timer; changes made while one is pending share its write."""
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            if self._snapshot_timer is not None:
+                return
+            self._snapshot_timer = threading.Timer(self.snapshot_delay, self._save_scheduled_snapshot)
+            self._snapshot_timer.daemon = True
+            self._snapshot_timer.start()
+
+    def _save_scheduled_snapshot(self):
+        # Cleared before writing so a change made during the write schedules another one
+        with self._lock:
+            self._snapshot_timer = None
+        self.save_snapshot()
+
+    def save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            snapshot = {ref: {'entry': entry, 'fetched_at': wall} for ref, (entry, _, wall) in self._entries.items()}
+        try:
+            tmp_path = f"{self.snapshot_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            logger.warning(f"Metadata catalog - could not write snapshot {self.snapshot_path}: {e}")
+
+    def load_snapshot(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Metadata catalog - ignoring unreadable snapshot {self.snapshot_path}: {e}")
+            return
+
+        now_wall = time.time()
+        now = time.monotonic()
+        for ref, item in snapshot.items():
+            # Entries written before table_type was recorded are fetched again
+            if now_wall - item['fetched_at'] < self.snapshot_max_age and 'table_type' in item['entry']:
+                # Snapshot entries are trusted for one TTL, then revalidated as usual
+                self._entries[ref] = (item['entry'], now, item['fetched_at'])
+        logger.info(f"Metadata catalog - loaded {len(self._entries)} tables from snapshot")
+
+catalog = MetadataCatalog()
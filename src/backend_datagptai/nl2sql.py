@@ -0,0 +1,130 @@
+#nl2sql.py natural language to SQL generation shared by Datagptai.py and cloudfastapi.py
+import time
+import logging
+from sql_cache import sql_cache, schema_fingerprint, cache_key
+from example_store import example_store
+from single_flight import sql_generation_flight
+
+logger = logging.getLogger(__name__)
+
+def build_schema_string(table_name, columns):
+    """Format the selected table's columns for the SQL prompt."""
+    column_list = ', '.join(f"{column['name']} ({column['type']})" for column in columns)
+    return f"Table: {table_name}\nColumns: {column_list}"
+
+def build_value_hints(value_matches):
+    """Prompt section listing stored column values that match the question's keywords."""
+    if not value_matches:
+        return ""
+    by_column = {}
+    for match in value_matches:
+        by_column.setdefault(match['column'], []).append(repr(match['value']))
+    lines = "\n".join(f"        - {column}: {', '.join(values)}" for column, values in by_column.items())
+    return f"""
+        Stored values in the selected table that match the user query (filter on these exact values):
+{lines}
+"""
+
+def build_examples_section(examples):
+    """Few-shot section with earlier questions on the same table and the SQL that answered them."""
+    if not examples:
+        return ""
+    pairs = "\n\n".join(
+        f"        Question: {example['question']}\n        SQL: {' '.join(example['sql'].split())}" for example in examples
+    )
+    return f"""
+        Examples of earlier questions on this table and the SQL that answered them:
+{pairs}
+"""
+
+def build_sql_prompt(table_name, schema_string, user_query, value_matches=None, examples=None):
+    return f"""
+        Convert the following natural language query into an SQL query. Use ONLY the columns from the selected table: {table_name}
+
+        Dataset schema for selected table:
+        {schema_string}
+{build_value_hints(value_matches)}{build_examples_section(examples)}
+        User query: {user_query}
+
+         Provide the SQL query that answers the user's question, ensuring the following:
+         1. Use only BigQuery-compatible syntax and functions and do not use functions as 'STRFTIME()' or STRFTIME_UTC which are not supported by BigQuery.
+         2. When applying filters:
+            - Prioritize using teh most relavant column with distinct values that closely match the keywords in the User query.
+            - For example, if the user query mentions "Purchase Invoices" and the dataset schema contains distinct values in multiple columns such as ['Purchase Invoices', 'Sales Orders'] in `JournalCategory` or `TransactionType`, prefer the column that aligns with the user's intent, such as `JournalCategory`.
+         3. If multiple columns have similar values, use the column with the most meaningful relationship to the User query context. For instance, for financial transactions, `JournalCategory` should be prioritized over `TransactionType`.
+
+         4. If no data is retrieved from BigQuery, consider refining the query logic by re-evaluating the column selection or filters.
+        """
+
+def clean_sql(text):
+    """Strip markdown fences from the model's answer."""
+    return text.strip().replace("```sql", "").replace("```", "").strip()
+
+def generate_sql(model, user_query, table_name, table_entry, value_matches=None, prompt_columns=None,
+                 examples=None, timeout=None):
+    """
+    Generate SQL for a question, answering from the SQL cache when possible.
+
+    Args:
+        model: Gemini model handle used on a cache miss
+        user_query: The user's natural language question
+        table_name: Fully qualified table name shown to the model
+        table_entry: Metadata catalog entry for the selected table (its table_ref is part of the cache key)
+        value_matches: Optional value index matches ({column, value}) added to the prompt
+        prompt_columns: Columns listed in the prompt (all the table's columns when None)
+        examples: Similar earlier examples from the example store; used as
+            few-shot examples, or reused as-is when one is a near duplicate
+        timeout: Seconds to wait for an identical generation already in
+            flight (None = no limit), normally the request's time left
+
+    Returns:
+        Tuple of (sql, info). info carries the cache key, whether it was a
+        hit, the SQL source (cache, example or llm), the generation
+        latency (saved latency on a hit) and whether the Gemini call was
+        shared with an identical concurrent request.
+
+    Raises:
+        DeadlineExceeded: the identical generation being waited for did not finish within timeout
+    """
+    key = cache_key(user_query, table_entry['table_ref'], schema_fingerprint(table_entry['columns']))
+    cached = sql_cache.get(key)
+    if cached is not None:
+        logger.info("NL2SQL - SQL cache hit")
+        return cached['sql'], {
+            'key': key, 'hit': True, 'source': 'cache', 'generation_ms': 0.0, 'saved_llm_ms': cached['generation_ms']
+        }
+
+    reused = example_store.bypass_candidate(examples or [])
+    if reused is not None:
+        logger.info(f"NL2SQL - reusing the SQL of a near-duplicate question: {reused['question']}")
+        return reused['sql'], {'key': key, 'hit': False, 'source': 'example', 'generation_ms': 0.0, 'saved_llm_ms': 0.0}
+
+    schema_string = build_schema_string(table_name, prompt_columns or table_entry['columns'])
+    prompt = build_sql_prompt(table_name, schema_string, user_query, value_matches, examples)
+
+    def ask():
+        start = time.perf_counter()
+        response = model.generate_content([prompt])
+        return clean_sql(response.text), (time.perf_counter() - start) * 1000
+
+    # The same question arriving while it is being generated waits for that Gemini call
+    (sql, generation_ms), coalesced = sql_generation_flight.do(key, ask, timeout=timeout)
+    return sql, {
+        'key': key, 'hit': False, 'source': 'llm', 'generation_ms': generation_ms, 'saved_llm_ms': 0.0,
+        'coalesced': coalesced
+    }
+
+def remember_sql(sql, info):
+    """Store SQL that produced results so the next identical question skips the LLM."""
+    if not info['hit']:
+        sql_cache.put(info['key'], sql, info['generation_ms'])
+
+def sql_cache_metadata(info):
+    """Cache details reported in the /gemini response metadata."""
+    return {
+        'hit': info['hit'],
+        'source': info['source'],
+        'hit_rate': sql_cache.hit_rate(),
+        'generation_ms': round(info['generation_ms'], 1),
+        'saved_llm_ms': round(info['saved_llm_ms'] or 0.0, 1),
+    }
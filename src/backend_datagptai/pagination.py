@@ -0,0 +1,107 @@
+#pagination.py cursor based paging over a query job's destination table
+import os
+import hmac
+import json
+import base64
+import hashlib
+import secrets
+import logging
+from request_budget import DeadlineExceeded, RESULT_TIMEOUT_ERRORS, time_left, cancel_query_job
+
+logger = logging.getLogger(__name__)
+
+# Rows returned per page when the client does not ask for a page size
+RESULT_PAGE_SIZE = int(os.environ.get("RESULT_PAGE_SIZE", "10000"))
+# Hard cap on rows materialized by a single request, whatever page size is asked for
+MAX_ROWS_PER_REQUEST = int(os.environ.get("MAX_ROWS_PER_REQUEST", "50000"))
+# Cursors are signed so clients cannot point them at other tables. Set CURSOR_SECRET to
+# share cursors across workers/restarts; the random default only works within one process.
+CURSOR_SECRET = os.environ.get("CURSOR_SECRET") or secrets.token_hex(32)
+
+def clamp_page_size(page_size=None):
+    return max(1, min(int(page_size or RESULT_PAGE_SIZE), MAX_ROWS_PER_REQUEST))
+
+def _signature(payload):
+    return hmac.new(CURSOR_SECRET.encode(), payload, hashlib.sha256).hexdigest()[:32]
+
+def encode_cursor(state):
+    payload = json.dumps(state, separators=(",", ":")).encode()
+    return f"{base64.urlsafe_b64encode(payload).decode()}.{_signature(payload)}"
+
+def decode_cursor(cursor):
+    """Return the cursor state; raises ValueError for malformed or tampered cursors."""
+    try:
+        encoded, signature = cursor.rsplit(".", 1)
+        payload = base64.urlsafe_b64decode(encoded.encode())
+    except (AttributeError, ValueError) as e:
+        raise ValueError("Malformed cursor") from e
+    if not hmac.compare_digest(signature, _signature(payload)):
+        raise ValueError("Invalid cursor")
+    return json.loads(payload)
+
+def make_cursor(table, page_token, offset, page_size):
+    """Signed cursor for the page of a destination table that starts at page_token (see read_next_page)."""
+    return encode_cursor({'table': str(table), 'token': page_token, 'offset': offset, 'page_size': page_size})
+
+def read_page(client, table, page_size, page_token=None, offset=0, selected_fields=None):
+    """
+    Read one page of a table with tabledata.list (no query job is run).
+
+    Returns:
+        Tuple of (dataframe, page info) where page info has total_rows,
+        offset, has_more and the signed cursor for the next page (or None).
+    """
+    rows = client.list_rows(
+        table, selected_fields=selected_fields, page_token=page_token, max_results=page_size, page_size=page_size
+    )
+    df = rows.to_dataframe(create_bqstorage_client=False)
+    next_offset = offset + len(df)
+    cursor = None
+    if rows.next_page_token and next_offset < (rows.total_rows or 0):
+        cursor = make_cursor(table, rows.next_page_token, next_offset, page_size)
+    return df, {
+        'total_rows': rows.total_rows,
+        'offset': offset,
+        'has_more': cursor is not None,
+        'cursor': cursor,
+    }
+
+def read_first_page(client, query_job, page_size=None, deadline=None):
+    """
+    First page of a finished (or running) query job, read from its destination table.
+
+    Raises:
+        DeadlineExceeded: the job did not finish before the deadline (it is
+            cancelled; the message names it so the failure can be traced)
+    """
+    if deadline is not None:
+        try:
+            schema = query_job.result(max_results=0, timeout=time_left(deadline)).schema
+        except RESULT_TIMEOUT_ERRORS:
+            cancel_query_job(query_job, "request deadline exceeded")
+            raise DeadlineExceeded(f"The query (job {query_job.job_id}) did not finish within the request deadline")
+    else:
+        schema = query_job.result(max_results=0).schema
+    destination = query_job.destination
+    table = f"{destination.project}.{destination.dataset_id}.{destination.table_id}"
+    return read_page(client, table, clamp_page_size(page_size), selected_fields=schema)
+
+def single_page(df):
+    """Pagination info for a result returned whole (no destination table to page through)."""
+    return {'total_rows': len(df), 'offset': 0, 'has_more': False, 'cursor': None}
+
+def run_first_page(client, sql, job_config=None, page_size=None, timer=None):
+    """
+    Run a query and read its first page. Returns (query_job, df, page).
+    With a StageTimer the job is tracked for cancellation and bounded by its deadline.
+    """
+    query_job = client.query(sql, job_config=job_config)
+    if timer is None:
+        return (query_job, *read_first_page(client, query_job, page_size))
+    timer.track(query_job)
+    return (query_job, *read_first_page(client, query_job, page_size, timer.deadline))
+
+def read_next_page(client, cursor):
+    """Page addressed by a cursor from a previous response."""
+    state = decode_cursor(cursor)
+    return read_page(client, state['table'], clamp_page_size(state['page_size']), state['token'], state['offset'])
@@ -0,0 +1,143 @@
+#preflight.py dry-run cost estimate and bytes budget for generated SQL
+import os
+import json
+import time
+import threading
+import logging
+from collections import OrderedDict
+from google.cloud import bigquery
+from result_handoff import normalize_sql
+
+logger = logging.getLogger(__name__)
+
+GIB = 1024 ** 3
+
+# Hard limit: executed jobs run with maximum_bytes_billed, and estimates above it are refused
+MAX_BYTES_BILLED = int(os.environ.get("MAX_BYTES_BILLED", str(10 * GIB)))
+# Soft budget: estimates above it need explicit confirmation (confirm_cost) from the user
+QUERY_BYTES_BUDGET = int(os.environ.get("QUERY_BYTES_BUDGET", str(GIB)))
+# Per-table and per-user soft budgets, JSON objects of {"project.dataset.table": bytes} / {"user": bytes}
+TABLE_BYTES_BUDGETS = json.loads(os.environ.get("TABLE_BYTES_BUDGETS", "{}"))
+USER_BYTES_BUDGETS = json.loads(os.environ.get("USER_BYTES_BUDGETS", "{}"))
+
+DRY_RUN_CACHE_TTL_SECONDS = float(os.environ.get("DRY_RUN_CACHE_TTL_SECONDS", "600"))
+DRY_RUN_CACHE_MAX_ENTRIES = int(os.environ.get("DRY_RUN_CACHE_MAX_ENTRIES", "2048"))
+
+class QueryBudgetExceeded(Exception):
+    """Raised when a dry run estimates more bytes than the caller may scan."""
+
+    def __init__(self, message, estimate, requires_confirmation):
+        super().__init__(message)
+        self.estimate = estimate
+        self.requires_confirmation = requires_confirmation
+
+    def to_dict(self):
+        return {
+            'error': True,
+            'message': str(self),
+            'requires_confirmation': self.requires_confirmation,
+            'preflight': self.estimate,
+        }
+
+def format_bytes(num_bytes):
+    for unit in ["B", "KiB", "MiB", "GiB", "TiB"]:
+        if num_bytes < 1024 or unit == "TiB":
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+
+class DryRunCache:
+    """Dry-run estimates per normalized SQL, kept for a TTL."""
+
+    def __init__(self, ttl_seconds=DRY_RUN_CACHE_TTL_SECONDS, max_entries=DRY_RUN_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and time.monotonic() - item[1] < self.ttl_seconds:
+                self.hits += 1
+                return item[0]
+            self.misses += 1
+            return None
+
+    def put(self, key, estimate):
+        with self._lock:
+            self._entries[key] = (estimate, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+dry_run_cache = DryRunCache()
+
+def dry_run(client, sql):
+    """Estimated bytes processed and referenced tables for a query, served from the cache when possible."""
+    key = normalize_sql(sql)
+    estimate = dry_run_cache.get(key)
+    if estimate is not None:
+        return {**estimate, 'cached': True}
+
+    job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+    query_job = client.query(sql, job_config=job_config)
+    estimate = {
+        'bytes_processed': query_job.total_bytes_processed or 0,
+        'referenced_tables': [
+            f"{table.project}.{table.dataset_id}.{table.table_id}" for table in (query_job.referenced_tables or [])
+        ],
+    }
+    dry_run_cache.put(key, estimate)
+    return {**estimate, 'cached': False}
+
+def bytes_budget(referenced_tables, user=None):
+    """Smallest applicable soft budget: per table, per user, then QUERY_BYTES_BUDGET."""
+    budgets = [QUERY_BYTES_BUDGET]
+    budgets += [TABLE_BYTES_BUDGETS[table] for table in referenced_tables if table in TABLE_BYTES_BUDGETS]
+    if user and user in USER_BYTES_BUDGETS:
+        budgets.append(USER_BYTES_BUDGETS[user])
+    return min(budgets)
+
+def preflight(client, sql, user=None, confirmed=False):
+    """
+    Dry-run a query and enforce the bytes budgets.
+
+    Args:
+        client: BigQuery client
+        sql: Query about to be executed
+        user: Caller identity used for USER_BYTES_BUDGETS (X-User-Id header)
+        confirmed: True when the user accepted an estimate above the soft budget
+
+    Returns:
+        Estimate dict (bytes_processed, referenced_tables, budget, cached)
+
+    Raises:
+        QueryBudgetExceeded: above MAX_BYTES_BILLED, or above the soft budget without confirmation
+    """
+    estimate = dry_run(client, sql)
+    estimate['budget'] = bytes_budget(estimate['referenced_tables'], user)
+    scanned = estimate['bytes_processed']
+
+    if scanned > MAX_BYTES_BILLED:
+        raise QueryBudgetExceeded(
+            f"Query would scan {format_bytes(scanned)}, above the {format_bytes(MAX_BYTES_BILLED)} limit. "
+            f"Please narrow the question (date range, filters or fewer columns).",
+            estimate, requires_confirmation=False
+        )
+    if scanned > estimate['budget'] and not confirmed:
+        raise QueryBudgetExceeded(
+            f"Query would scan {format_bytes(scanned)}, above the {format_bytes(estimate['budget'])} budget. "
+            f"Confirm to run it anyway.",
+            estimate, requires_confirmation=True
+        )
+    logger.info(f"Preflight - {format_bytes(scanned)} estimated (cached={estimate['cached']})")
+    return estimate
+
+def execution_config():
+    """Job config for executed queries: BigQuery itself refuses to bill more than MAX_BYTES_BILLED."""
+    return bigquery.QueryJobConfig(maximum_bytes_billed=MAX_BYTES_BILLED)
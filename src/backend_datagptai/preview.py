@@ -0,0 +1,139 @@
+#preview.py table previews read through tabledata.list (no query job) with a TTL cache; views and external tables use a bounded query
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from google.cloud import bigquery
+from metadata_catalog import catalog
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_ROWS = int(os.environ.get("PREVIEW_ROWS", "15"))
+PREVIEW_MAX_ROWS = int(os.environ.get("PREVIEW_MAX_ROWS", "100"))
+PREVIEW_CACHE_TTL_SECONDS = float(os.environ.get("PREVIEW_CACHE_TTL_SECONDS", "300"))
+PREVIEW_CACHE_MAX_ENTRIES = int(os.environ.get("PREVIEW_CACHE_MAX_ENTRIES", "256"))
+# Bytes a preview query of a view or external table may bill (tabledata.list only serves tables)
+PREVIEW_MAX_BYTES_BILLED = int(os.environ.get("PREVIEW_MAX_BYTES_BILLED", str(1024 ** 3)))
+
+NESTED_TYPES = ("RECORD", "STRUCT")
+
+class PreviewCache:
+    """Preview dataframes per (table, modified, columns, rows), kept for a TTL."""
+
+    def __init__(self, ttl_seconds=PREVIEW_CACHE_TTL_SECONDS, max_entries=PREVIEW_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and time.monotonic() - item[1] < self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return item[0]
+            self.misses += 1
+            return None
+
+    def put(self, key, df):
+        with self._lock:
+            self._entries[key] = (df, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+preview_cache = PreviewCache()
+
+def parse_columns(columns):
+    """Column projection from a comma separated query parameter (None means every column)."""
+    if not columns:
+        return None
+    return [column.strip() for column in columns.split(",") if column.strip()] or None
+
+def column_names(table_ref, entry, columns=None):
+    """
+    Requested columns, or every column of the table.
+
+    Raises:
+        ValueError: a requested column is not in the table
+    """
+    names = columns or [column['name'] for column in entry['columns']]
+    known = {column['name'] for column in entry['columns']}
+    unknown = [name for name in names if name not in known]
+    if unknown:
+        raise ValueError(f"Unknown column(s) for {table_ref}: {', '.join(unknown)}")
+    return names
+
+def selected_fields(client, table_ref, entry, columns=None):
+    """
+    Schema fields to read, built from the catalog entry so list_rows()
+    does not fetch the table again. Nested columns need their sub-fields,
+    which the catalog does not keep, so those fall back to get_table().
+
+    Raises:
+        ValueError: a requested column is not in the table
+    """
+    by_name = {column['name']: column for column in entry['columns']}
+    names = column_names(table_ref, entry, columns)
+
+    if any(by_name[name]['type'] in NESTED_TYPES for name in names):
+        schema = {field.name: field for field in client.get_table(table_ref).schema}
+        return [schema[name] for name in names]
+    return [bigquery.SchemaField(name, by_name[name]['type'], mode=by_name[name]['mode'] or "NULLABLE")
+            for name in names]
+
+def query_preview(client, table_ref, entry, columns, max_rows):
+    """First rows of a view, materialized view or external table, with a LIMIT query billed at most PREVIEW_MAX_BYTES_BILLED."""
+    select = ", ".join(f"`{name}`" for name in column_names(table_ref, entry, columns))
+    job_config = bigquery.QueryJobConfig(maximum_bytes_billed=PREVIEW_MAX_BYTES_BILLED)
+    query_job = client.query(f"SELECT {select} FROM `{table_ref}` LIMIT {max_rows}", job_config=job_config)
+    return query_job.to_dataframe(create_bqstorage_client=False)
+
+def get_table_preview(client, table_ref, columns=None, max_rows=PREVIEW_ROWS):
+    """
+    First rows of a table, without running a query job for base tables.
+    Views, materialized views and external tables are not served by
+    tabledata.list, so they are previewed with a bounded LIMIT query.
+
+    Args:
+        client: BigQuery client
+        table_ref: Fully qualified table reference
+        columns: Optional list of column names to read
+        max_rows: Rows to return (capped at PREVIEW_MAX_ROWS)
+
+    Returns:
+        Tuple of (dataframe, info) where info has cached and modified
+    """
+    entry = catalog.get_table(client, table_ref)
+    max_rows = max(1, min(int(max_rows), PREVIEW_MAX_ROWS))
+    # Keyed by the table's last-modified time, so a changed table never serves a stale preview
+    key = (table_ref, entry['modified'], tuple(columns or ()), max_rows)
+
+    df = preview_cache.get(key)
+    if df is not None:
+        return df, {'cached': True, 'modified': entry['modified']}
+
+    if entry.get('table_type', 'TABLE') == 'TABLE':
+        rows = client.list_rows(table_ref, selected_fields=selected_fields(client, table_ref, entry, columns),
+                                max_results=max_rows)
+        df = rows.to_dataframe(create_bqstorage_client=False)
+        method = "list_rows"
+    else:
+        df = query_preview(client, table_ref, entry, columns, max_rows)
+        method = f"a query ({entry['table_type']})"
+    preview_cache.put(key, df)
+    logger.info(f"Preview - read {len(df)} rows of {table_ref} with {method}")
+    return df, {'cached': False, 'modified': entry['modified']}
@@ -0,0 +1,294 @@
+#query_pipeline.py question -> validated, dry-run checked and probed SQL, with a bounded repair loop
+import os
+import time
+import difflib
+import logging
+import pandas as pd
+from google.api_core.exceptions import BadRequest, GoogleAPIError
+from nl2sql import generate_sql, build_schema_string, clean_sql
+from sql_validation import validate_sql, SqlValidationError
+from preflight import preflight, execution_config, QueryBudgetExceeded
+from result_handoff import PROBE_ROWS
+from request_budget import StageTimer, DeadlineExceeded, RESULT_TIMEOUT_ERRORS, time_left, cancel_query_job
+from value_index import value_index
+from schema_pruning import prune_columns
+from example_store import example_store
+from sql_cache import schema_fingerprint
+from result_handoff import normalize_sql, make_job_handle, make_local_handle
+from local_engine import local_engine
+from single_flight import query_flight, flight_key
+
+try:
+    import sqlglot
+    from sqlglot import exp
+except ImportError:  # optional, without it repairs get no candidate filter values
+    sqlglot = None
+
+logger = logging.getLogger(__name__)
+
+# Repairs after the first attempt, and the time they may take in total
+SQL_REPAIR_MAX_ATTEMPTS = int(os.environ.get("SQL_REPAIR_MAX_ATTEMPTS", "2"))
+SQL_REPAIR_BUDGET_SECONDS = float(os.environ.get("SQL_REPAIR_BUDGET_SECONDS", "45"))
+# No repair is started with less than this left before the request deadline
+SQL_REPAIR_MIN_TIME_LEFT = float(os.environ.get("SQL_REPAIR_MIN_TIME_LEFT", "5"))
+# Existing values offered per filtered column when a query returns no rows
+REPAIR_CANDIDATE_VALUES = int(os.environ.get("REPAIR_CANDIDATE_VALUES", "10"))
+REPAIR_SCANNED_VALUES = int(os.environ.get("REPAIR_SCANNED_VALUES", "200"))
+
+def probe(query_job, deadline=None):
+    """
+    Read the first PROBE_ROWS rows of a query job (emptiness check and description sample).
+    Rows with missing datetimes are dropped, as the endpoints always did.
+
+    Returns:
+        Tuple of (dataframe, total rows of the result when known)
+    """
+    timeout = {'timeout': time_left(deadline)} if deadline is not None else {}
+    try:
+        rows = query_job.result(max_results=PROBE_ROWS, **timeout)
+        df = rows.to_dataframe()
+    except RESULT_TIMEOUT_ERRORS:
+        cancel_query_job(query_job, "request deadline exceeded")
+        raise DeadlineExceeded(f"The query (job {query_job.job_id}) did not finish within the request deadline")
+    return drop_missing_datetimes(df), getattr(rows, 'total_rows', None)
+
+def drop_missing_datetimes(df):
+    datetime_columns = [col for col in df.columns if pd.api.types.is_datetime64_any_dtype(df[col])]
+    return df.dropna(subset=datetime_columns)
+
+def execute(client, sql, timer):
+    """Run a query and probe its first rows. Returns (query_job, df, total_rows)."""
+    query_job = client.query(sql, job_config=execution_config())
+    timer.track(query_job)
+    df, total_rows = probe(query_job, timer.deadline)
+    return query_job, df, total_rows
+
+def filter_literals(sql, columns):
+    """{column: [string literals]} compared against STRING columns in the query's filters."""
+    if sqlglot is None:
+        return {}
+    string_columns = {column['name'].lower(): column['name'] for column in columns if column['type'] == "STRING"}
+    try:
+        statement = sqlglot.parse_one(sql, read="bigquery")
+    except sqlglot.errors.SqlglotError:
+        return {}
+
+    literals = {}
+    for node in statement.find_all(exp.EQ, exp.NEQ, exp.Like, exp.ILike, exp.In):
+        column = next(node.find_all(exp.Column), None)
+        if column is None or column.name.lower() not in string_columns:
+            continue
+        values = [literal.this for literal in node.find_all(exp.Literal) if literal.is_string]
+        literals.setdefault(string_columns[column.name.lower()], []).extend(values)
+    return {name: values for name, values in literals.items() if values}
+
+def closest_values(literals, values):
+    """Values ordered by closeness to any of the literals, at most REPAIR_CANDIDATE_VALUES."""
+    by_lower = {value.lower(): value for value in values}
+    closest = []
+    for literal in literals:
+        closest += difflib.get_close_matches(literal.lower(), list(by_lower), n=REPAIR_CANDIDATE_VALUES, cutoff=0)
+    return list(dict.fromkeys(by_lower[value] for value in closest))[:REPAIR_CANDIDATE_VALUES]
+
+def candidate_values(client, table_ref, sql, columns, timer=None):
+    """
+    Existing values of the STRING columns a query filtered on, closest to
+    the literals it used first. Values come from the value index when the
+    column is indexed, otherwise from one small aggregate query (skipped,
+    empty dict, when it would exceed the bytes budget, fails or does not
+    finish SQL_REPAIR_MIN_TIME_LEFT before the timer's deadline, which
+    leaves the repair itself time to run).
+    """
+    literals = filter_literals(sql, columns)
+    indexed = {name: value_index.values(table_ref, name) for name in literals}
+    known = {name: values for name, values in indexed.items() if values is not None}
+    missing = [name for name in literals if name not in known]
+    if not missing:
+        return {name: closest_values(literals[name], known[name]) for name in literals}
+    selects = ", ".join(
+        f"ARRAY_AGG(DISTINCT `{name}` IGNORE NULLS LIMIT {REPAIR_SCANNED_VALUES}) AS `{name}`" for name in missing
+    )
+    values_sql = f"SELECT {selects} FROM `{table_ref}`"
+    deadline = timer.deadline if timer is not None else None
+    timeout = {'timeout': max(0.0, time_left(deadline) - SQL_REPAIR_MIN_TIME_LEFT)} if deadline is not None else {}
+    query_job = None
+    try:
+        preflight(client, values_sql)
+        query_job = client.query(values_sql, job_config=execution_config())
+        if timer is not None:
+            timer.track(query_job)
+        row = next(iter(query_job.result(**timeout)))
+    except RESULT_TIMEOUT_ERRORS:
+        if query_job is not None:
+            cancel_query_job(query_job, "request deadline exceeded")
+        logger.warning(f"Query repair - candidate values for {table_ref} did not finish within the request deadline")
+        return {}
+    except (QueryBudgetExceeded, GoogleAPIError, StopIteration) as e:
+        logger.warning(f"Query repair - no candidate values for {table_ref}: {e}")
+        return {}
+
+    known.update({name: [str(value) for value in (row[name] or [])] for name in missing})
+    return {name: closest_values(literals[name], known[name]) for name in literals}
+
+def build_repair_prompt(table_name, columns, user_query, sql, problem, candidates=None):
+    schema_string = build_schema_string(table_name, columns)
+    candidate_lines = "\n".join(f"        - {name}: {values}" for name, values in (candidates or {}).items())
+    candidate_section = f"""
+        Values that exist in the filtered columns (use the closest match):
+{candidate_lines}
+        """ if candidate_lines else ""
+    return f"""
+        The following SQL query was generated for the user's question on the table {table_name}, but it {problem}
+
+        Dataset schema for selected table:
+        {schema_string}
+
+        User query: {user_query}
+
+        SQL query:
+        {sql}
+        {candidate_section}
+        Fix the SQL query so it answers the user's question. Use only BigQuery-compatible syntax, only the
+        selected table and only its columns. Return only the corrected SQL query.
+        """
+
+def can_repair(attempts, started, deadline):
+    if len(attempts) > SQL_REPAIR_MAX_ATTEMPTS:
+        return False
+    if time.monotonic() - started > SQL_REPAIR_BUDGET_SECONDS:
+        return False
+    return deadline is None or time_left(deadline) > SQL_REPAIR_MIN_TIME_LEFT
+
+def run_sql_pipeline(client, model_factory, user_query, table_name, table_entry,
+                     user=None, confirmed=False, deadline=None, timer=None):
+    """
+    Generate SQL for a question and run it, repairing failed or empty attempts.
+
+    Every attempt is validated locally, then answered by the local engine
+    when the table has a current extract, or dry-run checked (preflight),
+    executed on BigQuery and probed. A BigQuery error, a validation error or an empty
+    result is sent back to Gemini (empty results with candidate filter
+    values) and the corrected SQL is tried, within SQL_REPAIR_MAX_ATTEMPTS
+    and SQL_REPAIR_BUDGET_SECONDS.
+
+    Args:
+        client: BigQuery client
+        model_factory: configure_gemini, called with a generation config name
+        user_query: The user's natural language question
+        table_name: Fully qualified table name shown to the model
+        table_entry: Metadata catalog entry for the selected table
+        user: Caller identity for the bytes budget
+        confirmed: True when the user accepted a cost above the soft budget
+        deadline: Optional monotonic deadline for the whole request (the timer's when None)
+        timer: StageTimer to record into and check before each stage (a new one when None)
+
+    Returns:
+        Dict with sql, sql_info, validation, preflight (None when the local
+        engine answered), query_job (None likewise), result_handle, engine
+        (which engine answered and its latency), df (empty when no attempt
+        returned rows), total_rows (rows in the whole result), repair, value_matches, schema
+        (pruning info), examples (questions used as few-shot examples),
+        coalesced (stages shared with an identical concurrent request) and timer.
+
+    Raises:
+        SqlValidationError / BadRequest: the last attempt was still invalid
+        QueryBudgetExceeded: an attempt is above the bytes budget (not repaired)
+        RequestAborted: the deadline passed, the request was cancelled or a stage was shed
+    """
+    timer = timer or StageTimer(deadline)
+    deadline = deadline if deadline is not None else timer.deadline
+    table_ref = table_entry['table_ref']
+    started = time.monotonic()
+
+    # Stored values matching the question's keywords ground the filters (e.g. JournalCategory = 'Purchase Invoices')
+    with timer.stage('value_lookup'):
+        value_matches = value_index.lookup(client, table_entry, user_query)
+    # Wide tables: only the columns relevant to the question go into the prompt
+    with timer.stage('schema_pruning'):
+        prompt_columns, schema_info = prune_columns(table_ref, table_entry['columns'], user_query, value_matches)
+    # Similar questions that ran successfully before become few-shot examples (or the answer itself)
+    fingerprint = schema_fingerprint(table_entry['columns'])
+    with timer.stage('examples'):
+        examples = example_store.similar(table_ref, fingerprint, user_query)
+    with timer.stage('generate_sql'):
+        sql, sql_info = generate_sql(
+            model_factory("sql"), user_query, table_name, table_entry, value_matches, prompt_columns,
+            examples, timeout=timer.time_left()
+        )
+    coalesced = ['generate_sql'] if sql_info.get('coalesced') else []
+
+    attempts = []
+    while True:
+        error = None
+        try:
+            with timer.stage('validate'):
+                sql, validation = validate_sql(sql, table_ref, table_entry['columns'])
+            local = None
+            if local_engine.available:
+                # Small or hot tables are answered from their local extract when DuckDB can run the SQL
+                with timer.stage('execute_local'):
+                    local = local_engine.run(client, sql, table_entry)
+            if local is not None:
+                local_df, engine = local
+                query_job, estimate = None, None
+                df, total_rows = drop_missing_datetimes(local_df.head(PROBE_ROWS)), len(local_df)
+            else:
+                with timer.stage('dry_run'):
+                    estimate = preflight(client, sql, user, confirmed)
+                start = time.perf_counter()
+                with timer.stage('execute'):
+                    # Identical SQL already running for another request is waited for, not run again
+                    (query_job, df, total_rows), shared = query_flight.do(
+                        flight_key(normalize_sql(sql)), execute, client, sql, timer,
+                        timeout=timer.time_left()
+                    )
+                engine = {'engine': 'bigquery', 'ms': round((time.perf_counter() - start) * 1000, 1)}
+                if shared:
+                    coalesced.append('execute')
+            attempts.append({'sql': sql, 'outcome': 'empty' if df.empty else 'ok'})
+            if not df.empty:
+                break
+            problem = "returned no rows. The filters probably do not match the stored values."
+        except (SqlValidationError, BadRequest) as e:
+            error = e
+            message = getattr(e, 'message', None) or str(e)
+            attempts.append({'sql': sql, 'outcome': 'error', 'error': message})
+            problem = f"failed with this error: {message}"
+
+        if not can_repair(attempts, started, deadline):
+            if error is not None:
+                raise error
+            break
+
+        logger.info(f"Query repair - attempt {len(attempts)} {attempts[-1]['outcome']}, asking for a fix")
+        candidates = None
+        if error is None:
+            with timer.stage('candidates'):
+                candidates = candidate_values(client, table_ref, sql, table_entry['columns'], timer)
+        with timer.stage('repair'):
+            prompt = build_repair_prompt(table_name, prompt_columns, user_query, sql, problem, candidates)
+            sql = clean_sql(model_factory("sql").generate_content([prompt]).text)
+
+    if len(attempts) > 1 and not df.empty:
+        # Cache the repaired SQL under the question instead of the one that failed
+        sql_info = {**sql_info, 'hit': False}
+    if not df.empty:
+        example_store.add(table_ref, fingerprint, user_query, sql, total_rows)
+
+    return {
+        'sql': sql,
+        'sql_info': sql_info,
+        'validation': validation,
+        'preflight': estimate,
+        'query_job': query_job,
+        'result_handle': make_job_handle(query_job) if query_job is not None else make_local_handle(table_ref),
+        'engine': engine,
+        'df': df,
+        'total_rows': total_rows,
+        'repair': {'attempts': attempts, 'repaired': len(attempts) > 1 and not df.empty},
+        'value_matches': value_matches,
+        'schema': schema_info,
+        'examples': [example['question'] for example in examples],
+        'coalesced': coalesced,
+        'timer': timer,
+    }
@@ -0,0 +1,196 @@
+#request_budget.py request deadlines, per-stage budget checks, cancellation and load shedding
+import os
+import time
+import threading
+import logging
+import concurrent.futures
+from contextlib import contextmanager
+import requests
+from google.api_core.exceptions import DeadlineExceeded as ApiDeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+# Default per-request time budget; clients can lower it with X-Request-Timeout (seconds)
+# or X-Request-Deadline (absolute Unix time in seconds or milliseconds)
+REQUEST_TIMEOUT_SECONDS = float(os.environ.get("REQUEST_TIMEOUT_SECONDS", "120"))
+# Smoothing of the per-stage latency estimate, and observations needed before it is trusted
+STAGE_LATENCY_ALPHA = float(os.environ.get("STAGE_LATENCY_ALPHA", "0.2"))
+STAGE_LATENCY_MIN_SAMPLES = int(os.environ.get("STAGE_LATENCY_MIN_SAMPLES", "5"))
+# A stage is shed when the time left is below its expected latency times this factor (0 disables shedding)
+LOAD_SHED_FACTOR = float(os.environ.get("LOAD_SHED_FACTOR", "1.0"))
+
+# Stages a request goes through, checked up front so hopeless requests are rejected before any work
+GEMINI_STAGES = ("catalog", "generate_sql", "execute", "description")
+ANALYSIS_STAGES = ("execute", "insights")
+REUSED_ANALYSIS_STAGES = ("read_results", "insights")
+
+class RequestAborted(Exception):
+    """The request's work was stopped; status_code and headers are used for the error response."""
+    status_code = 500
+    headers = {}
+
+class DeadlineExceeded(RequestAborted, TimeoutError):
+    status_code = 504
+
+# What waiting on a BigQuery job with a timeout can raise once it runs out: result() raises
+# concurrent.futures.TimeoutError (the builtin from Python 3.11), while the HTTP transport
+# and the API itself can time out first
+RESULT_TIMEOUT_ERRORS = (TimeoutError, concurrent.futures.TimeoutError, requests.exceptions.Timeout, ApiDeadlineExceeded)
+
+class RequestCancelled(RequestAborted):
+    status_code = 499
+
+class LoadShed(RequestAborted):
+    status_code = 503
+    headers = {'Retry-After': '1'}
+
+def time_left(deadline):
+    """Seconds remaining before the deadline (never negative)."""
+    return max(0.0, deadline - time.monotonic())
+
+def deadline_from_headers(headers):
+    """
+    Monotonic deadline for a request.
+
+    X-Request-Deadline (absolute Unix time, seconds or milliseconds) wins
+    over X-Request-Timeout (seconds from now); both are capped by
+    REQUEST_TIMEOUT_SECONDS, which also applies when neither is sent.
+    """
+    timeout = REQUEST_TIMEOUT_SECONDS
+    deadline_header = headers.get("x-request-deadline")
+    timeout_header = headers.get("x-request-timeout")
+    try:
+        if deadline_header:
+            at = float(deadline_header)
+            if at > 1e11:  # JavaScript Date.now()
+                at /= 1000
+            timeout = min(at - time.time(), REQUEST_TIMEOUT_SECONDS)
+        elif timeout_header:
+            timeout = min(float(timeout_header), REQUEST_TIMEOUT_SECONDS)
+    except ValueError:
+        logger.warning(f"Ignoring invalid request deadline headers: {deadline_header or timeout_header}")
+    return time.monotonic() + timeout
+
+def cancel_query_job(query_job, reason):
+    try:
+        logger.warning(f"Cancelling BigQuery job {query_job.job_id}: {reason}")
+        query_job.cancel()
+    except Exception as e:
+        logger.warning(f"Could not cancel BigQuery job {query_job.job_id}: {e}")
+
+class StageLatency:
+    """Exponentially weighted moving average of each stage's latency across requests."""
+
+    def __init__(self, alpha=STAGE_LATENCY_ALPHA, min_samples=STAGE_LATENCY_MIN_SAMPLES):
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self._stages = {}  # name -> [average seconds, samples]
+        self._lock = threading.Lock()
+        self.shed = 0
+
+    def observe(self, name, seconds):
+        with self._lock:
+            entry = self._stages.get(name)
+            if entry is None:
+                self._stages[name] = [seconds, 1]
+            else:
+                entry[0] += self.alpha * (seconds - entry[0])
+                entry[1] += 1
+
+    def record_shed(self):
+        with self._lock:
+            self.shed += 1
+
+    def expected(self, name):
+        """Expected seconds for a stage (0 until min_samples observations)."""
+        with self._lock:
+            entry = self._stages.get(name)
+        if entry is None or entry[1] < self.min_samples:
+            return 0.0
+        return entry[0]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'stages_ms': {name: round(average * 1000, 1) for name, (average, _) in self._stages.items()},
+                'shed': self.shed,
+            }
+
+stage_latency = StageLatency()
+
+class StageTimer:
+    """
+    Per-request stage bookkeeping: wall time per stage (metadata.timings_ms),
+    deadline and cancellation checks before each stage, and the BigQuery
+    jobs to cancel when the request is abandoned.
+    """
+
+    def __init__(self, deadline=None):
+        self.deadline = deadline
+        self._timings = {}
+        self._cancelled = threading.Event()
+        self._reason = None
+        self._jobs = []
+        self._lock = threading.Lock()
+
+    def time_left(self):
+        return time_left(self.deadline) if self.deadline is not None else None
+
+    def check(self, *stages):
+        """
+        Make sure the request may start the given stages.
+
+        Raises:
+            RequestCancelled: the client went away or the request was abandoned
+            DeadlineExceeded: the deadline has passed
+            LoadShed: the time left is below the stages' expected latency
+        """
+        if self._cancelled.is_set():
+            raise RequestCancelled(self._reason)
+        if self.deadline is None:
+            return
+        left = time_left(self.deadline)
+        if left <= 0:
+            raise DeadlineExceeded(f"Request deadline passed before {stages[0] if stages else 'completion'}")
+        expected = sum(stage_latency.expected(stage) for stage in stages) * LOAD_SHED_FACTOR
+        if expected > left:
+            stage_latency.record_shed()
+            raise LoadShed(
+                f"Not enough time left for {', '.join(stages)} ({left:.1f}s left, about {expected:.1f}s needed)"
+            )
+
+    @contextmanager
+    def stage(self, name):
+        self.check(name)
+        start = time.perf_counter()
+        completed = False
+        try:
+            yield
+            completed = True
+        finally:
+            elapsed = time.perf_counter() - start
+            self._timings[name] = self._timings.get(name, 0.0) + elapsed * 1000
+            if completed:
+                # Only stages that finished feed the estimate; a timed out stage says nothing about its latency
+                stage_latency.observe(name, elapsed)
+
+    def track(self, query_job):
+        """Remember a BigQuery job so cancel() can stop it (cancelled right away if already abandoned)."""
+        with self._lock:
+            self._jobs.append(query_job)
+        if self._cancelled.is_set():
+            cancel_query_job(query_job, self._reason)
+
+    def cancel(self, reason):
+        """Abandon the request: later stages fail their check and tracked BigQuery jobs are cancelled."""
+        with self._lock:
+            if self._cancelled.is_set():
+                return
+            self._reason = reason
+            self._cancelled.set()
+            jobs = list(self._jobs)
+        for query_job in jobs:
+            cancel_query_job(query_job, reason)
+
+    def as_dict(self):
+        return {name: round(ms, 1) for name, ms in self._timings.items()}
@@ -0,0 +1,72 @@
+#result_handoff.py lets /api/bigquery reuse the query job that /gemini already ran
+import os
+import re
+import logging
+from google.api_core.exceptions import GoogleAPIError
+
+logger = logging.getLogger(__name__)
+
+# Rows /gemini reads from the generated query (emptiness check + description sample)
+PROBE_ROWS = int(os.environ.get("PROBE_ROWS", "5"))
+
+# Quoted string literals and identifiers, kept byte for byte by normalize_sql
+_QUOTED = re.compile(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`)""")
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_sql(sql):
+    """
+    Key for "the same query": whitespace collapsed and the trailing semicolon
+    dropped outside quoted literals. Case is kept, since string literals
+    ('EU' vs 'eu') and table names are case-sensitive in BigQuery.
+    """
+    parts = _QUOTED.split(sql.strip())
+    # Odd positions are the quoted parts captured by the split
+    parts = [part if position % 2 else _WHITESPACE.sub(" ", part) for position, part in enumerate(parts)]
+    return "".join(parts).rstrip(";").rstrip()
+
+def make_job_handle(query_job):
+    """Opaque handle returned to the client for a finished BigQuery query job."""
+    return f"bq:{query_job.location}:{query_job.job_id}"
+
+def make_local_handle(table_ref):
+    """Handle for a result answered by the local engine; /api/bigquery answers it locally again."""
+    return f"local:{table_ref}"
+
+def make_conversation_handle(session_id, turn):
+    """Handle for a follow-up answered from a session's previous result (see conversation.ConversationStore.load)."""
+    return f"conversation:{session_id}:{turn}"
+
+def load_handoff_job(client, handle, sql_query):
+    """
+    Resolve a result handle back to its BigQuery query job.
+
+    Args:
+        client: BigQuery client
+        handle: Handle produced by make_job_handle()
+        sql_query: SQL the caller wants results for; must match the job's query
+
+    Returns:
+        The finished QueryJob, whose results are read from its destination
+        table without re-running the query, or None when the handle cannot
+        be used (unknown format, local engine result, expired or failed job,
+        different SQL).
+    """
+    try:
+        kind, location, job_id = handle.split(":", 2)
+    except (AttributeError, ValueError):
+        return None
+    if kind != "bq":
+        return None
+
+    try:
+        query_job = client.get_job(job_id, location=location)
+    except GoogleAPIError as e:
+        logger.warning(f"Result handoff - job {job_id} unavailable: {e}")
+        return None
+
+    if query_job.job_type != "query" or query_job.error_result:
+        return None
+    if normalize_sql(query_job.query) != normalize_sql(sql_query):
+        logger.warning(f"Result handoff - job {job_id} does not match the requested SQL")
+        return None
+    return query_job
@@ -0,0 +1,197 @@
+#result_profile.py compact per-column statistics of a result, rendered into summary prompts under a token budget
+import os
+import logging
+import numpy as np
+import pandas as pd
+from chart_recommender import column_kind
+from text_utils import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Estimated prompt tokens for the whole result section (column lines and sample rows)
+PROFILE_TOKEN_BUDGET = int(os.environ.get("PROFILE_TOKEN_BUDGET", "400"))
+# Most frequent values listed for each text/boolean column
+PROFILE_TOP_K = int(os.environ.get("PROFILE_TOP_K", "3"))
+# Results this small are also sent row by row when the rows fit in the budget
+PROFILE_SAMPLE_ROWS = int(os.environ.get("PROFILE_SAMPLE_ROWS", "5"))
+# Longer text values are cut in the prompt
+PROFILE_MAX_VALUE_CHARS = int(os.environ.get("PROFILE_MAX_VALUE_CHARS", "40"))
+
+def _category_counts(series):
+    """Value counts (nulls excluded), hashing unhashable ARRAY/STRUCT values by their text."""
+    try:
+        return series.value_counts(dropna=True, sort=True)
+    except TypeError:
+        return series.dropna().astype(str).value_counts(sort=True)
+
+def profile_frame(df, top_k=PROFILE_TOP_K):
+    """
+    Per-column statistics of a result.
+
+    Null counts are taken for the whole frame at once, min/max/mean for
+    all numeric columns together over one float matrix, and each text
+    column is hashed once (its value counts give both the distinct count
+    and the top values), so the cost is linear in the result size.
+
+    Args:
+        df: Result dataframe
+        top_k: Most frequent values kept for text and boolean columns
+
+    Returns:
+        Dict with rows and columns: list of {name, kind, nulls, null_rate}
+        plus min, max and mean for numeric columns, min and max for
+        datetime columns, and distinct and top ([value, count] pairs) for
+        category and boolean columns, in result order
+    """
+    rows = len(df)
+    kinds = [column_kind(df[name]) for name in df.columns]
+    nulls = df.isna().sum().to_numpy()
+
+    numeric = [position for position, kind in enumerate(kinds) if kind == 'numeric']
+    numeric_stats = {}
+    if numeric and rows:
+        # NUMERIC/BIGNUMERIC Decimal objects and nullable integers become float64 here
+        matrix = df.iloc[:, numeric].astype(float).to_numpy()
+        with np.errstate(all='ignore'):
+            present = ~np.isnan(matrix)
+            counts = present.sum(axis=0)
+            minimums = np.where(present, matrix, np.inf).min(axis=0)
+            maximums = np.where(present, matrix, -np.inf).max(axis=0)
+            means = np.where(present, matrix, 0).sum(axis=0) / np.maximum(counts, 1)
+        for index, position in enumerate(numeric):
+            if counts[index]:
+                numeric_stats[position] = {
+                    'min': float(minimums[index]), 'max': float(maximums[index]), 'mean': float(means[index]),
+                }
+
+    columns = []
+    for position, (name, kind) in enumerate(zip(df.columns, kinds)):
+        series = df.iloc[:, position]
+        column = {
+            'name': name,
+            'kind': kind,
+            'nulls': int(nulls[position]),
+            'null_rate': float(nulls[position] / rows) if rows else 0.0,
+        }
+        if kind == 'numeric':
+            column.update(numeric_stats.get(position, {}))
+        elif kind == 'datetime':
+            present = series.dropna()
+            if len(present):
+                column['min'], column['max'] = present.min(), present.max()
+        else:
+            counts = _category_counts(series)
+            column['distinct'] = len(counts)
+            column['top'] = [[value, int(count)] for value, count in counts.head(top_k).items()]
+        columns.append(column)
+    return {'rows': rows, 'columns': columns}
+
+def format_value(value):
+    """Short prompt text for one statistic: grouped large numbers with cents, 4 significant digits below 1,000, dates without midnight."""
+    if isinstance(value, (bool, np.bool_)):
+        return str(bool(value))
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        value = float(value)
+        if abs(value) >= 1e15 or abs(value) < 1000:
+            return f"{value:.4g}"
+        return f"{int(value):,}" if value.is_integer() else f"{value:,.2f}"
+    if isinstance(value, pd.Timestamp):
+        if value.tz is None and value == value.normalize():
+            return value.strftime("%Y-%m-%d")
+        return value.isoformat()
+    text = str(value)
+    return text if len(text) <= PROFILE_MAX_VALUE_CHARS else text[:PROFILE_MAX_VALUE_CHARS - 1] + "…"
+
+def _plural(count, noun):
+    return f"{count:,} {noun}" + ("" if count == 1 else "s")
+
+def _percent(count, total):
+    share = 100 * count / total if total else 0
+    return "<1%" if 0 < share < 1 else f"{share:.0f}%"
+
+def column_line(column, rows, short=False):
+    """One prompt line for a profiled column; short keeps only the name and kind."""
+    line = f"- {column['name']} ({column['kind']}"
+    if short:
+        return line + ")"
+    if not column.get('distinct') and 'min' not in column:
+        return line + "): all null"
+    if column['kind'] in ('category', 'boolean'):
+        line += f", {column['distinct']:,} distinct): "
+        top = column['top']
+        if top and all(count == 1 for _, count in top):
+            line += ", ".join(format_value(value) for value, _ in top)
+            if column['distinct'] > len(top):
+                line += ", …"
+        else:
+            present = rows - column['nulls']
+            line += ", ".join(f"{format_value(value)} ({_percent(count, present)})" for value, count in top)
+    elif column['kind'] == 'numeric':
+        line += f"): min {format_value(column['min'])}, max {format_value(column['max'])}, mean {format_value(column['mean'])}"
+    else:
+        line += f"): {format_value(column['min'])} to {format_value(column['max'])}"
+    if column['nulls']:
+        line += f", {_percent(column['nulls'], rows)} null"
+    return line
+
+def render_profile(profile, total_rows=None, token_budget=PROFILE_TOKEN_BUDGET):
+    """
+    Prompt section for a result profile.
+
+    Columns are listed in result order; once the full lines no longer fit
+    the budget the remaining columns get name-and-kind lines, and columns
+    that do not fit at all are counted in a closing line.
+
+    Args:
+        profile: Output of profile_frame()
+        total_rows: Rows in the whole result when the profile covers only its first rows
+
+    Returns:
+        Tuple of (section text, estimated tokens)
+    """
+    rows, columns = profile['rows'], profile['columns']
+    header = f"The result has {_plural(rows, 'row')} and {_plural(len(columns), 'column')}."
+    if total_rows is not None and total_rows > rows:
+        header = (f"The result has {_plural(total_rows, 'row')} and {_plural(len(columns), 'column')}; "
+                  f"statistics cover the first {rows:,}.")
+    lines, tokens = [header, "Columns:"], estimate_tokens(header) + 3
+    omitted = 0
+    for column in columns:
+        if omitted:
+            omitted += 1
+            continue
+        for short in (False, True):
+            line = column_line(column, rows, short)
+            cost = estimate_tokens(line) + 1
+            if tokens + cost <= token_budget:
+                lines.append(line)
+                tokens += cost
+                break
+        else:
+            omitted = 1
+    if omitted:
+        lines.append(f"- ({omitted} more columns not shown)")
+        tokens += 6
+    return "\n".join(lines), tokens
+
+def result_section(df, total_rows=None, token_budget=PROFILE_TOKEN_BUDGET, top_k=PROFILE_TOP_K):
+    """
+    Result description for summary prompts: the column profile, plus the
+    rows themselves for results of at most PROFILE_SAMPLE_ROWS rows when
+    they fit in what is left of the budget.
+
+    Args:
+        df: Result dataframe (or its first rows, see total_rows)
+        total_rows: Rows in the whole result, when df holds only the first of them
+        token_budget: Estimated prompt tokens allowed for the section
+
+    Returns:
+        Prompt text
+    """
+    section, tokens = render_profile(profile_frame(df, top_k), total_rows, token_budget)
+    if 0 < len(df) <= PROFILE_SAMPLE_ROWS:
+        label = "First rows" if total_rows is not None and total_rows > len(df) else "Rows"
+        rows = f"{label}: {df.to_json(orient='records', date_format='iso', default_handler=str)}"
+        if tokens + estimate_tokens(rows) <= token_budget:
+            section += "\n" + rows
+    return section
@@ -0,0 +1,152 @@
+#schema_pruning.py keeps only the columns relevant to a question in the SQL prompt of wide tables
+import os
+import threading
+import logging
+from collections import OrderedDict
+from text_utils import tokenize, estimate_tokens, BM25Index
+from sql_cache import schema_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# Tables with at most this many columns are sent whole
+SCHEMA_PRUNE_MIN_COLUMNS = int(os.environ.get("SCHEMA_PRUNE_MIN_COLUMNS", "40"))
+# Relevance-ranked columns kept, and the token budget of the column list in the prompt
+SCHEMA_TOP_K = int(os.environ.get("SCHEMA_TOP_K", "30"))
+SCHEMA_TOKEN_BUDGET = int(os.environ.get("SCHEMA_TOKEN_BUDGET", "600"))
+
+DATE_TYPES = {"DATE", "DATETIME", "TIMESTAMP", "TIME"}
+KEY_SUFFIXES = ("id", "key", "number", "num", "code")
+
+# Question words mapped to the words ERP column names and descriptions tend to use instead
+SYNONYMS = {
+    "amount": ["value", "total", "sum", "balance", "cost", "price"],
+    "revenue": ["sale", "income", "amount"],
+    "sale": ["revenue", "amount", "order", "invoice"],
+    "spend": ["cost", "expense", "amount"],
+    "expense": ["cost", "spend"],
+    "cost": ["expense", "amount", "price"],
+    "customer": ["client", "buyer", "account"],
+    "client": ["customer"],
+    "vendor": ["supplier", "payee"],
+    "supplier": ["vendor"],
+    "employee": ["worker", "staff", "person"],
+    "date": ["day", "time", "period", "posted", "created"],
+    "month": ["period", "date"],
+    "year": ["fiscal", "period", "date"],
+    "quarter": ["period", "date"],
+    "when": ["date", "time"],
+    "count": ["number", "quantity", "qty"],
+    "quantity": ["qty", "count", "unit"],
+    "qty": ["quantity"],
+    "category": ["type", "class", "group"],
+    "type": ["category", "kind"],
+    "region": ["country", "territory", "area", "location"],
+    "department": ["dept", "division", "cost", "center"],
+    "invoice": ["bill", "document"],
+    "currency": ["curr", "ccy"],
+    "status": ["state"],
+}
+SYNONYM_WEIGHT = 0.5
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+def column_document(column):
+    """Tokens describing a column: its name (counted twice), description and type."""
+    name_tokens = tokenize(column['name'])
+    return name_tokens * 2 + tokenize(column.get('description') or "") + [column['type'].lower()]
+
+def is_mandatory(column):
+    """Date columns and key-like columns are always offered to the model."""
+    if column['type'] in DATE_TYPES:
+        return True
+    tokens = tokenize(column['name'], keep_stopwords=True)
+    return bool(tokens) and tokens[-1] in KEY_SUFFIXES
+
+def question_weights(question):
+    """Question tokens with weight 1, their synonyms with SYNONYM_WEIGHT."""
+    weights = {}
+    for token in tokenize(question):
+        weights[token] = 1.0
+        for synonym in SYNONYMS.get(token, []):
+            weights.setdefault(synonym, SYNONYM_WEIGHT)
+    return weights
+
+def column_index(table_ref, columns):
+    """BM25 index over a table's columns, cached per schema fingerprint."""
+    key = (table_ref, schema_fingerprint(columns))
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            return index
+    index = BM25Index([column_document(column) for column in columns])
+    with _indexes_lock:
+        _indexes[key] = index
+        while len(_indexes) > 128:
+            _indexes.popitem(last=False)
+    return index
+
+def column_line_tokens(column):
+    return estimate_tokens(f"{column['name']} ({column['type']}), ")
+
+def prune_columns(table_ref, columns, question, value_matches=None,
+                  top_k=SCHEMA_TOP_K, token_budget=SCHEMA_TOKEN_BUDGET, min_columns=SCHEMA_PRUNE_MIN_COLUMNS):
+    """
+    Choose the columns listed in the SQL prompt.
+
+    Columns are added in priority order until the token budget is spent:
+    columns with value index matches, then the top_k BM25 matches for the
+    question (names, descriptions, types, with synonyms), then mandatory
+    date and key columns. Table order is preserved in the result.
+
+    Args:
+        table_ref: Fully qualified table reference (index cache key)
+        columns: Catalog columns of the table
+        question: The user's natural language question
+        value_matches: Value index matches; their columns are always kept
+        top_k: Relevance-ranked columns to keep
+        token_budget: Estimated prompt tokens allowed for the column list
+        min_columns: Tables with at most this many columns are not pruned
+
+    Returns:
+        Tuple of (columns, info) with info total_columns, kept_columns,
+        pruned and estimated_tokens
+    """
+    if len(columns) <= min_columns:
+        return columns, {
+            'pruned': False,
+            'total_columns': len(columns),
+            'kept_columns': len(columns),
+            'estimated_tokens': sum(column_line_tokens(column) for column in columns),
+        }
+
+    scores = column_index(table_ref, columns).scores(question_weights(question))
+    ranked = [position for position in sorted(range(len(columns)), key=lambda i: -scores[i]) if scores[position] > 0]
+    if not ranked:
+        # Nothing in the question matches any column: fall back to the table's leading columns
+        ranked = list(range(len(columns)))
+
+    matched_names = {match['column'] for match in value_matches or []}
+    priority = [position for position, column in enumerate(columns) if column['name'] in matched_names]
+    priority += ranked[:top_k]
+    priority += [position for position, column in enumerate(columns) if is_mandatory(column)]
+
+    kept, tokens = set(), 0
+    for position in priority:
+        if position in kept:
+            continue
+        cost = column_line_tokens(columns[position])
+        if tokens + cost > token_budget:
+            continue
+        kept.add(position)
+        tokens += cost
+
+    pruned = [column for position, column in enumerate(columns) if position in kept]
+    logger.info(f"Schema pruning - {table_ref}: {len(pruned)} of {len(columns)} columns, ~{tokens} tokens")
+    return pruned, {
+        'pruned': True,
+        'total_columns': len(columns),
+        'kept_columns': len(pruned),
+        'estimated_tokens': tokens,
+    }
@@ -0,0 +1,118 @@
+#serialization.py vectorized result serialization with negotiable output formats
+import json
+import logging
+import numpy as np
+import pandas as pd
+from streaming import json_default
+
+try:
+    import orjson
+except ImportError:  # optional fast JSON encoder
+    orjson = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # optional, needed only for the "arrow" format
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+ARROW_MIMETYPE = "application/vnd.apache.arrow.stream"
+
+# records: [{column: value}, ...] (default, what the frontend reads)
+# columnar: {column: [values]} - column names are sent once
+# arrow: Apache Arrow IPC stream, response fields in the schema metadata
+RESULT_FORMATS = ("records", "columnar", "arrow")
+
+def datetime_to_iso(series):
+    """
+    Vectorized replacement for the old per-cell convert_datetime().
+
+    Returns an object array of ISO 8601 strings (same text as
+    Timestamp.isoformat()) with None for NaT.
+    """
+    suffix = ""
+    if series.dt.tz is not None:
+        series = series.dt.tz_convert("UTC").dt.tz_localize(None)
+        suffix = "+00:00"
+    values = series.to_numpy(dtype="datetime64[us]")
+    missing = np.isnat(values)
+
+    iso = np.datetime_as_string(values, unit="s").astype(object)
+    has_micros = (values.astype(np.int64) % 1_000_000) != 0
+    if has_micros.any():
+        iso = np.where(has_micros, np.datetime_as_string(values, unit="us"), iso).astype(object)
+    if suffix:
+        iso = iso + suffix
+    iso[missing] = None
+    return iso
+
+def column_values(series):
+    """Python list for one column: datetimes as ISO strings, NaN/NaT/NA as None."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return datetime_to_iso(series).tolist()
+    if pd.api.types.is_float_dtype(series):
+        values = series.to_numpy(dtype=object)
+        values[series.isna().to_numpy()] = None
+        return values.tolist()
+    if series.hasnans:
+        return series.astype(object).where(series.notna(), None).tolist()
+    return series.tolist()
+
+def frame_to_columns(df):
+    return {column: column_values(df[column]) for column in df.columns}
+
+def frame_to_records(df):
+    columns = frame_to_columns(df)
+    names = list(columns)
+    return [dict(zip(names, row)) for row in zip(*columns.values())]
+
+def encode_json(payload):
+    """JSON bytes, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(payload, default=json_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, default=json_default).encode()
+
+def encode_arrow(df, payload):
+    if pa is None:
+        raise ValueError("The arrow format requires pyarrow")
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        b"response": encode_json(payload),
+    })
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def negotiate_format(requested=None, accept=None):
+    """Explicit format (body or query string) wins, then the Accept header, then records."""
+    if requested:
+        if requested not in RESULT_FORMATS:
+            raise ValueError(f"Unsupported result format: {requested}")
+        return requested
+    if accept and ARROW_MIMETYPE in accept:
+        return "arrow"
+    return "records"
+
+def serialize_result(df, payload, result_format="records"):
+    """
+    Encode a result dataframe together with the other response fields.
+
+    Args:
+        df: Result dataframe
+        payload: Response fields other than data/columns
+        result_format: One of RESULT_FORMATS
+
+    Returns:
+        Tuple of (body bytes, mimetype)
+    """
+    payload = {**payload, 'columns': df.columns.tolist(), 'data_format': result_format}
+    if result_format == "arrow":
+        return encode_arrow(df, payload), ARROW_MIMETYPE
+    if result_format == "columnar":
+        payload['data'] = frame_to_columns(df)
+    else:
+        payload['data'] = frame_to_records(df)
+    return encode_json(payload), "application/json"
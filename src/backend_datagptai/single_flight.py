@@ -0,0 +1,96 @@
+#single_flight.py coalesces identical concurrent calls (SQL generation, query execution, descriptions)
+import json
+import hashlib
+import threading
+import logging
+from request_budget import DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+def flight_key(*parts):
+    """Stable key for a normalized payload (any JSON-serializable parts)."""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time. Callers arriving while a call
+    with the same key is in flight wait for it and share its result (or
+    its exception) instead of starting their own. Nothing is cached once
+    the call finishes.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, timeout=None, **kwargs):
+        """
+        Run fn(*args, **kwargs), or wait for the identical call already in flight.
+
+        Args:
+            key: Normalized payload key (see flight_key)
+            fn: Callable doing the work
+            timeout: Seconds a waiting caller gives the in-flight call (None = no limit)
+
+        Returns:
+            Tuple of (result, coalesced) where coalesced is True when the
+            result came from another caller's call
+
+        Raises:
+            Whatever fn raised, in every caller; DeadlineExceeded when a
+            waiting caller's timeout passes first
+        """
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            logger.info(f"Single flight ({self.name}) - waiting for an identical call in flight")
+            if not call.done.wait(timeout):
+                raise DeadlineExceeded(f"Identical {self.name} call did not finish within the request deadline")
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'executions': self.executions,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._calls),
+        }
+
+sql_generation_flight = SingleFlight("sql_generation")
+query_flight = SingleFlight("query_execution")
+description_flight = SingleFlight("description")
+
+def single_flight_stats():
+    return {flight.name: flight.stats() for flight in (sql_generation_flight, query_flight, description_flight)}
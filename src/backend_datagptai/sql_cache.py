@@ -0,0 +1,136 @@
+#sql_cache.py cache of generated SQL keyed on normalized question, table and schema fingerprint
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+SQL_CACHE_MAX_ENTRIES = int(os.environ.get("SQL_CACHE_MAX_ENTRIES", "1024"))
+SQL_CACHE_TTL_SECONDS = float(os.environ.get("SQL_CACHE_TTL_SECONDS", "86400"))
+# Optional SQLite file shared by every worker on the host (empty = in-memory only)
+SQL_CACHE_DB = os.environ.get("SQL_CACHE_DB", "")
+
+# Words, plus the operators and signs that change a question's meaning ("amount > 1000", "growth of -5%")
+_QUESTION_TOKEN = re.compile(r"!=|<>|<=|>=|[<>=%-]|\w+")
+
+def normalize_question(question):
+    """Lowercase, drop punctuation other than comparison operators, minus and percent, and collapse whitespace."""
+    tokens = _QUESTION_TOKEN.findall(question.lower())
+    return " ".join("!=" if token == "<>" else token for token in tokens)
+
+def schema_fingerprint(columns):
+    """Stable hash of a table's (name, type) columns; any schema change yields a new fingerprint."""
+    payload = json.dumps([(column['name'], column['type']) for column in columns])
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+def cache_key(question, table_ref, fingerprint):
+    """Key on the fully qualified table: the same table id in two datasets gets separate entries."""
+    payload = "\x1f".join([normalize_question(question), table_ref, fingerprint])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class SqliteBackend:
+    """Shared local store so several worker processes reuse each other's entries."""
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sql_cache ("
+                "key TEXT PRIMARY KEY, sql TEXT NOT NULL, generation_ms REAL, created_at REAL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, key):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT sql, generation_ms, created_at FROM sql_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'sql': row[0], 'generation_ms': row[1], 'created_at': row[2]}
+
+    def put(self, key, entry):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sql_cache (key, sql, generation_ms, created_at) VALUES (?, ?, ?, ?)",
+                (key, entry['sql'], entry['generation_ms'], entry['created_at'])
+            )
+
+class SqlGenerationCache:
+    """In-memory LRU in front of an optional SQLite backend, with hit/miss accounting."""
+
+    def __init__(self, max_entries=SQL_CACHE_MAX_ENTRIES, ttl_seconds=SQL_CACHE_TTL_SECONDS, db_path=SQL_CACHE_DB):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.backend = SqliteBackend(db_path) if db_path else None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_llm_ms = 0.0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is None and self.backend is not None:
+            try:
+                entry = self.backend.get(key)
+            except sqlite3.Error as e:
+                logger.warning(f"SQL cache backend read failed: {e}")
+            if entry is not None:
+                self._remember(key, entry)
+
+        if entry is not None and time.time() - entry['created_at'] > self.ttl_seconds:
+            entry = None
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.saved_llm_ms += entry['generation_ms'] or 0.0
+        return entry
+
+    def put(self, key, sql, generation_ms):
+        entry = {'sql': sql, 'generation_ms': generation_ms, 'created_at': time.time()}
+        self._remember(key, entry)
+        if self.backend is not None:
+            try:
+                self.backend.put(key, entry)
+            except sqlite3.Error as e:
+                logger.warning(f"SQL cache backend write failed: {e}")
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return round(self.hits / lookups, 4) if lookups else 0.0
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'shared_backend': self.backend.path if self.backend else None,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate(),
+            'saved_llm_ms': round(self.saved_llm_ms, 1),
+        }
+
+sql_cache = SqlGenerationCache()
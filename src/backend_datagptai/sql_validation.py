@@ -0,0 +1,139 @@
+#sql_validation.py local checks and rewrites of generated SQL before it is sent to BigQuery
+import os
+import re
+import time
+import logging
+
+try:
+    import sqlglot
+    from sqlglot import exp
+except ImportError:  # optional, without it only the table-name and statement checks run
+    sqlglot = None
+
+logger = logging.getLogger(__name__)
+
+# LIMIT added to queries that return one row per table row; 0 disables the rewrite
+SQL_AUTO_LIMIT = int(os.environ.get("SQL_AUTO_LIMIT", "10000"))
+
+# Columns BigQuery provides on partitioned / wildcard tables without listing them in the schema
+PSEUDO_COLUMNS = {"_partitiontime", "_partitiondate", "_table_suffix", "_file_name"}
+
+# Statement types that write or run commands, rejected anywhere in the tree
+WRITE_EXPRESSIONS = (
+    (exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Create, exp.Drop, exp.Alter, exp.Command) if sqlglot else ()
+)
+
+class SqlValidationError(ValueError):
+    """Generated SQL that must not be sent to BigQuery."""
+
+def _matches_table(table, table_ref):
+    """
+    True when a parsed table name is the selected table (missing project/dataset parts are allowed).
+    Dataset and table names are case-sensitive in BigQuery; only project ids are not.
+    """
+    project, dataset, table_id = table_ref.split(".")
+    return (
+        table.name == table_id
+        and table.db in ("", dataset)
+        and table.catalog.lower() in ("", project.lower())
+    )
+
+def _is_aggregate(select):
+    """A SELECT returning one row per group rather than per table row."""
+    if select.args.get("group"):
+        return True
+    return any(
+        agg.find_ancestor(exp.Window) is None
+        for expression in select.expressions
+        for agg in expression.find_all(exp.AggFunc)
+    )
+
+def _check_columns(statement, columns):
+    """Names referenced by the query must be table columns, aliases defined in the query, or struct/UNNEST fields."""
+    schema_names = {column['name'].lower() for column in columns}
+    defined = {alias.alias.lower() for alias in statement.find_all(exp.Alias)}
+    defined |= {cte.alias_or_name.lower() for cte in statement.find_all(exp.CTE)}
+    for table_alias in statement.find_all(exp.TableAlias):
+        defined.add(table_alias.name.lower())
+        defined |= {column.name.lower() for column in table_alias.columns}
+    # Qualifiers whose fields are not in the table schema: UNNEST aliases and RECORD columns
+    opaque = schema_names | {
+        unnest.alias_or_name.lower() for unnest in statement.find_all(exp.Unnest) if unnest.alias_or_name
+    }
+    for unnest in statement.find_all(exp.Unnest):
+        opaque |= {column.name.lower() for column in (unnest.args.get("alias") or exp.TableAlias()).columns}
+
+    unknown = sorted({
+        column.name
+        for column in statement.find_all(exp.Column)
+        if column.name.lower() not in schema_names | defined | PSEUDO_COLUMNS
+        and not (column.table and column.table.lower() in opaque)
+    })
+    if unknown:
+        raise SqlValidationError(f"Unknown column(s) in generated SQL: {', '.join(unknown)}")
+
+def _validate_fallback(sql, table_ref):
+    """Checks used when sqlglot is not installed: one SELECT statement naming the selected table."""
+    body = sql.strip().rstrip(";")
+    if ";" in body or not re.match(r"^\s*\(*\s*(select|with)\b", body, re.IGNORECASE):
+        raise SqlValidationError("Only a single SELECT statement is allowed")
+    if table_ref and table_ref.split(".")[-1] not in body:
+        raise SqlValidationError(f"Query must be based on selected table: {table_ref}")
+    return body
+
+def validate_sql(sql, table_ref=None, columns=None, auto_limit=SQL_AUTO_LIMIT):
+    """
+    Parse SQL with the BigQuery dialect and reject or rewrite it locally.
+
+    Args:
+        sql: SQL to check
+        table_ref: Fully qualified selected table; when set, no other table may be referenced
+        columns: Catalog columns of the selected table; when set, referenced columns are checked
+        auto_limit: LIMIT added to non-aggregate queries without one (0/None to disable)
+
+    Returns:
+        Tuple of (sql, info). The SQL is unchanged unless a LIMIT was added.
+
+    Raises:
+        SqlValidationError: unparsable SQL, anything but a single SELECT,
+        another table, or an unknown column
+    """
+    start = time.perf_counter()
+    info = {'parser': 'sqlglot' if sqlglot else 'basic', 'limit_added': False}
+    if sqlglot is None:
+        sql = _validate_fallback(sql, table_ref)
+        info['validation_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        return sql, info
+
+    try:
+        statements = [statement for statement in sqlglot.parse(sql, read="bigquery") if statement is not None]
+    except sqlglot.errors.SqlglotError as e:
+        raise SqlValidationError(f"Generated SQL could not be parsed: {e}") from e
+    if len(statements) != 1:
+        raise SqlValidationError("Only a single SELECT statement is allowed")
+    statement = statements[0]
+    if not isinstance(statement, exp.Query) or statement.find(*WRITE_EXPRESSIONS):
+        raise SqlValidationError("Only SELECT statements are allowed")
+
+    if table_ref:
+        cte_names = {cte.alias_or_name.lower() for cte in statement.find_all(exp.CTE)}
+        tables = [
+            table for table in statement.find_all(exp.Table)
+            if not (not table.db and table.name.lower() in cte_names)
+        ]
+        other = sorted({table.sql(dialect="bigquery") for table in tables if not _matches_table(table, table_ref)})
+        if other:
+            raise SqlValidationError(f"Query must be based on selected table {table_ref}, not {', '.join(other)}")
+        if not tables:
+            raise SqlValidationError(f"Query must be based on selected table: {table_ref}")
+    if columns is not None:
+        _check_columns(statement, columns)
+
+    if auto_limit and not statement.args.get("limit"):
+        # Set operations (UNION ALL ...) are limited as a whole
+        if not (isinstance(statement, exp.Select) and _is_aggregate(statement)):
+            sql = statement.limit(auto_limit).sql(dialect="bigquery")
+            info['limit_added'] = True
+
+    info['validation_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    return sql, info
@@ -0,0 +1,138 @@
+#streaming.py NDJSON / Server-Sent Events stream of query results and LLM text
+import os
+import json
+import math
+import logging
+import pandas as pd
+from insights import result_context, build_description_prompt, build_viz_prompt, build_chart_description_prompt, parse_viz_answer
+from chart_recommender import recommend_chart
+from pagination import MAX_ROWS_PER_REQUEST, make_cursor, clamp_page_size
+
+logger = logging.getLogger(__name__)
+
+# Rows requested per BigQuery page; each page becomes one "rows" event
+STREAM_PAGE_SIZE = int(os.environ.get("STREAM_PAGE_SIZE", "1000"))
+# Rows kept in memory to build the description prompt
+STREAM_SAMPLE_ROWS = int(os.environ.get("STREAM_SAMPLE_ROWS", "1000"))
+
+def json_default(obj):
+    """Dates and timestamps as ISO strings, anything else (Decimal, bytes) as str."""
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    return str(obj)
+
+def json_value(value):
+    """NaN and +/-Infinity (FLOAT64 results) as None; JSON has no literal for them."""
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+def row_record(row):
+    return {name: json_value(value) for name, value in row.items()}
+
+# allow_nan=False: a non-finite float that was not converted fails here instead of emitting invalid JSON
+def ndjson_event(event):
+    return json.dumps(event, default=json_default, allow_nan=False) + "\n"
+
+def sse_event(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event, default=json_default, allow_nan=False)}\n\n"
+
+# format name -> (mimetype, encoder)
+STREAM_FORMATS = {
+    'ndjson': ('application/x-ndjson', ndjson_event),
+    'sse': ('text/event-stream', sse_event),
+}
+
+def remaining_rows(query_job, rows, streamed):
+    """has_more and the /api/bigquery/page cursor for the rows after the first `streamed` ones."""
+    has_more = streamed < (rows.total_rows or 0)
+    destination = getattr(query_job, 'destination', None)
+    token = getattr(rows, 'next_page_token', None)
+    cursor = None
+    if has_more and token and destination is not None:
+        table = f"{destination.project}.{destination.dataset_id}.{destination.table_id}"
+        cursor = make_cursor(table, token, streamed, clamp_page_size())
+    return {'streamed_rows': streamed, 'has_more': has_more, 'cursor': cursor}
+
+def stream_analysis_events(query_job, model_factory, user_query, sql_query, page_size=STREAM_PAGE_SIZE,
+                           max_rows=MAX_ROWS_PER_REQUEST):
+    """
+    Yield the /api/bigquery analysis as a sequence of events.
+
+    Event order: "columns" (schema and total row count), one "rows" event
+    per BigQuery page up to max_rows rows, "description" text chunks as
+    Gemini produces them, a "chart" event with the chart type,
+    "chart_description" chunks and finally "done" with streamed_rows,
+    has_more and the cursor for the remaining rows (read with
+    /api/bigquery/page). Failures are reported as an "error" event. If the
+    consumer stops early (client disconnect), the query job is cancelled.
+    """
+    finished = False
+    try:
+        # max_results stops the iterator at the cap on a page boundary, so its next page token starts the rest
+        rows = query_job.result(page_size=min(page_size, max_rows), max_results=max_rows)
+        columns = [field.name for field in rows.schema]
+        yield {'type': 'columns', 'columns': columns, 'total_rows': rows.total_rows}
+
+        sample = []
+        streamed = 0
+        for page in rows.pages:
+            records = [row_record(row) for row in page][:max_rows - streamed]
+            if len(sample) < STREAM_SAMPLE_ROWS:
+                sample.extend(records[:STREAM_SAMPLE_ROWS - len(sample)])
+            streamed += len(records)
+            yield {'type': 'rows', 'rows': records}
+            if streamed >= max_rows:
+                break
+
+        if not sample:
+            finished = True
+            yield {'type': 'done', 'message': 'No data found for the query', **remaining_rows(query_job, rows, streamed)}
+            return
+
+        df = pd.DataFrame(sample, columns=columns)
+        context = result_context(df, rows.total_rows)
+        model = model_factory("summary")
+
+        description = []
+        for chunk in model.stream_content([build_description_prompt(context, user_query, sql_query)]):
+            description.append(chunk.text)
+            yield {'type': 'description', 'text': chunk.text}
+
+        # The chart type comes from the sample's dtypes; Gemini picks it only when that is not conclusive
+        recommendation = recommend_chart(df, user_query)
+        if recommendation['confident']:
+            chart_type = recommendation['chart_type']
+            llm_recommendation = f"Viz: {chart_type or 'none'}"
+        else:
+            viz_response = model.generate_content([build_viz_prompt(context, user_query, sql_query)])
+            chart_type = parse_viz_answer(viz_response.text)
+            llm_recommendation = viz_response.text
+        yield {'type': 'chart', 'chart_type': chart_type, 'llm_recommendation': llm_recommendation,
+               'chart_recommendation': {**recommendation, 'source': 'local' if recommendation['confident'] else 'llm'}}
+
+        if chart_type is not None:
+            chart_prompt = build_chart_description_prompt(chart_type, "".join(description).strip())
+            for chunk in model.stream_content([chart_prompt]):
+                yield {'type': 'chart_description', 'text': chunk.text}
+
+        finished = True
+        yield {'type': 'done', **remaining_rows(query_job, rows, streamed)}
+
+    except Exception as e:
+        finished = True
+        logger.error(f"Streaming analysis error: {e}")
+        yield {'type': 'error', 'message': str(e)}
+
+    finally:
+        if not finished:
+            logger.warning(f"Stream closed early, cancelling BigQuery job {query_job.job_id}")
+            query_job.cancel()
+
+def close_event_stream(events, query_job):
+    """Close a stream from outside; if it is busy in another thread, cancel the query job directly."""
+    try:
+        events.close()
+    except ValueError:
+        logger.warning(f"Stream busy while closing, cancelling BigQuery job {query_job.job_id}")
+        query_job.cancel()
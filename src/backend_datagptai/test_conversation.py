@@ -0,0 +1,29 @@
+#test_conversation.py follow-ups answered from the previous result, and the ones that must go back to SQL generation
+import pandas as pd
+import pytest
+from conversation import classify_follow_up, apply_follow_up
+
+@pytest.fixture
+def regions():
+    return pd.DataFrame({'region': ['West', 'East', 'North', 'South'], 'revenue': [50.0, 70.0, 80.0, 10.0]})
+
+def test_top_n_of_the_result_entity(regions):
+    plan = classify_follow_up("top 2 regions", regions)
+    assert plan == {'filters': [], 'sort': {'column': 'revenue', 'ascending': False}, 'limit': 2}
+    assert apply_follow_up(regions, plan)['region'].tolist() == ['North', 'East']
+
+def test_top_n_without_noun(regions):
+    assert classify_follow_up("top 3", regions)['limit'] == 3
+    assert classify_follow_up("top 3 rows", regions)['limit'] == 3
+
+@pytest.mark.parametrize("question", ["top 5 products", "top 2 customers", "bottom 3 vendors by revenue"])
+def test_top_n_of_another_entity_needs_sql(regions, question):
+    assert classify_follow_up(question, regions) is None
+
+@pytest.mark.parametrize("question", ["top 3 months", "revenue over 60 or region is West", "top 1 and bottom 1"])
+def test_questions_the_plan_cannot_express(regions, question):
+    assert classify_follow_up(question, regions) is None
+
+def test_or_between_values_of_one_column(regions):
+    plan = classify_follow_up("only West or East", regions)
+    assert plan['filters'] == [{'op': 'in', 'column': 'region', 'values': ['West', 'East'], 'negate': False}]
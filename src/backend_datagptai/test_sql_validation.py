@@ -0,0 +1,70 @@
+#test_sql_validation.py sql_validation.validate_sql over a corpus of generated-SQL cases
+import pytest
+from sql_validation import validate_sql, SqlValidationError
+
+TABLE_REF = "dataplatr-project.finance.gl_journals"
+COLUMNS = [
+    {'name': name, 'type': field_type}
+    for name, field_type in [
+        ("JournalId", "STRING"), ("JournalCategory", "STRING"), ("TransactionType", "STRING"),
+        ("Amount", "FLOAT"), ("Currency", "STRING"), ("PostedDate", "DATE"), ("CreatedAt", "TIMESTAMP"),
+        ("Lines", "RECORD"), ("Tags", "STRING"),
+    ]
+]
+
+# (sql, expected outcome): "ok", "limit" (accepted with a LIMIT added) or "reject"
+CORPUS = [
+    # Aggregates keep their shape
+    ("SELECT JournalCategory, SUM(Amount) AS total FROM `dataplatr-project.finance.gl_journals` GROUP BY JournalCategory", "ok"),
+    ("SELECT COUNT(*) FROM `dataplatr-project.finance.gl_journals`", "ok"),
+    ("SELECT FORMAT_DATE('%Y-%m', PostedDate) AS month, AVG(Amount) avg_amount FROM finance.gl_journals GROUP BY month ORDER BY month", "ok"),
+    ("SELECT EXTRACT(YEAR FROM PostedDate) AS yr, COUNT(DISTINCT JournalId) AS n FROM gl_journals GROUP BY yr", "ok"),
+    ("SELECT DATE_TRUNC(PostedDate, MONTH) AS m, SUM(Amount) FROM `dataplatr-project.finance.gl_journals` "
+     "WHERE PostedDate >= DATE_SUB(CURRENT_DATE(), INTERVAL 90 DAY) GROUP BY m", "ok"),
+    ("WITH totals AS (SELECT Currency, SUM(Amount) AS total FROM `dataplatr-project.finance.gl_journals` GROUP BY Currency) "
+     "SELECT Currency, total FROM totals ORDER BY total DESC LIMIT 5", "ok"),
+    ("SELECT JournalCategory FROM `dataplatr-project.finance.gl_journals` WHERE TransactionType = 'Purchase Invoices' LIMIT 20", "ok"),
+    ("SELECT MAX(Amount) FROM `dataplatr-project.finance.gl_journals` WHERE _PARTITIONDATE = '2024-01-01'", "ok"),
+    # Row-level queries get a LIMIT
+    ("SELECT * FROM `dataplatr-project.finance.gl_journals`", "limit"),
+    ("SELECT JournalId, Amount FROM `dataplatr-project.finance.gl_journals` WHERE Amount > 1000 ORDER BY Amount DESC", "limit"),
+    ("SELECT JournalId, SUM(Amount) OVER (PARTITION BY Currency) AS running FROM `dataplatr-project.finance.gl_journals`", "limit"),
+    ("SELECT DISTINCT Currency FROM `dataplatr-project.finance.gl_journals`", "limit"),
+    ("SELECT j.JournalId, l.account FROM `dataplatr-project.finance.gl_journals` AS j, UNNEST(j.Lines) AS l", "limit"),
+    ("SELECT JournalId, Lines.account FROM `dataplatr-project.finance.gl_journals`", "limit"),
+    ("SELECT JournalId FROM `dataplatr-project.finance.gl_journals` UNION ALL "
+     "SELECT JournalId FROM `dataplatr-project.finance.gl_journals`", "limit"),
+    # Wrong or extra tables
+    ("SELECT * FROM `dataplatr-project.finance.gl_journals_archive`", "reject"),
+    ("SELECT * FROM `dataplatr-project.sales.gl_journals`", "reject"),
+    ("SELECT * FROM `other-project.finance.gl_journals`", "reject"),
+    # Dataset and table names are case-sensitive, project ids are not
+    ("SELECT * FROM `dataplatr-project.Finance.gl_journals`", "reject"),
+    ("SELECT * FROM `dataplatr-project.finance.GL_Journals`", "reject"),
+    ("SELECT * FROM GL_JOURNALS", "reject"),
+    ("SELECT * FROM `Dataplatr-Project.finance.gl_journals`", "limit"),
+    ("SELECT a.JournalId FROM `dataplatr-project.finance.gl_journals` a JOIN `dataplatr-project.hr.employees` e "
+     "ON a.JournalId = e.JournalId", "reject"),
+    ("SELECT 1", "reject"),
+    # Anything but one SELECT
+    ("DELETE FROM `dataplatr-project.finance.gl_journals` WHERE TRUE", "reject"),
+    ("UPDATE `dataplatr-project.finance.gl_journals` SET Amount = 0 WHERE TRUE", "reject"),
+    ("INSERT INTO `dataplatr-project.finance.gl_journals` (JournalId) VALUES ('x')", "reject"),
+    ("DROP TABLE `dataplatr-project.finance.gl_journals`", "reject"),
+    ("CREATE TABLE finance.copy AS SELECT * FROM `dataplatr-project.finance.gl_journals`", "reject"),
+    ("SELECT * FROM `dataplatr-project.finance.gl_journals`; DROP TABLE `dataplatr-project.finance.gl_journals`", "reject"),
+    # Columns that are not in the schema
+    ("SELECT JournalCategory, SUM(Amout) FROM `dataplatr-project.finance.gl_journals` GROUP BY JournalCategory", "reject"),
+    ("SELECT InvoiceNumber FROM `dataplatr-project.finance.gl_journals`", "reject"),
+    # Not SQL
+    ("Here is the query you asked for: SELECT FROM WHERE", "reject"),
+]
+
+@pytest.mark.parametrize("sql, expected", CORPUS)
+def test_corpus(sql, expected):
+    if expected == "reject":
+        with pytest.raises(SqlValidationError):
+            validate_sql(sql, TABLE_REF, COLUMNS)
+    else:
+        _, info = validate_sql(sql, TABLE_REF, COLUMNS)
+        assert info['limit_added'] == (expected == "limit")
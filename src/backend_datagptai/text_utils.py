@@ -0,0 +1,76 @@
+#text_utils.py tokenizer, token estimate and BM25 shared by the lexical lookups over questions, values and column names
+import re
+import math
+from collections import Counter
+
+# Words that carry no meaning for matching a question against column names or stored values
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "give", "how",
+    "i", "in", "is", "it", "list", "me", "much", "many", "my", "of", "on", "or", "our", "per", "please",
+    "show", "tell", "than", "that", "the", "their", "there", "this", "to", "us", "was", "we", "what",
+    "when", "where", "which", "who", "with", "all", "each", "get", "find", "display",
+}
+
+_CAMEL_BOUNDARY = re.compile(r"(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])")
+_NON_WORD = re.compile(r"[^0-9a-zA-Z]+")
+
+def stem(token):
+    """Very light plural folding so 'invoices' matches 'invoice'."""
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+def tokenize(text, keep_stopwords=False):
+    """
+    Split text into lowercase tokens on punctuation, underscores and
+    camelCase boundaries ('JournalCategory' -> ['journal', 'category']).
+    """
+    tokens = []
+    for word in _NON_WORD.split(_CAMEL_BOUNDARY.sub(" ", text or "")):
+        token = word.lower()
+        if token and (keep_stopwords or token not in STOPWORDS):
+            tokens.append(stem(token))
+    return tokens
+
+def estimate_tokens(text):
+    """Rough LLM token count (about four characters per token), good enough for budgeting prompts."""
+    return (len(text) + 3) // 4
+
+class BM25Index:
+    """Okapi BM25 over pre-tokenized documents."""
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_counts = [Counter(document) for document in documents]
+        self.lengths = [len(document) for document in documents]
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        document_frequency = Counter(term for counts in self.term_counts for term in counts)
+        count = len(self.term_counts)
+        self.idf = {
+            term: math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+            for term, frequency in document_frequency.items()
+        }
+
+    def scores(self, query_weights):
+        """
+        Score every document for a query.
+
+        Args:
+            query_weights: {token: weight} (a plain token list counts each token once)
+
+        Returns:
+            List of scores, one per document, in document order
+        """
+        if not isinstance(query_weights, dict):
+            query_weights = {token: 1.0 for token in query_weights}
+        results = []
+        for counts, length in zip(self.term_counts, self.lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / self.average_length) if self.average_length else self.k1
+            score = 0.0
+            for term, weight in query_weights.items():
+                frequency = counts.get(term)
+                if frequency:
+                    score += weight * self.idf[term] * frequency * (self.k1 + 1) / (frequency + norm)
+            results.append(score)
+        return results
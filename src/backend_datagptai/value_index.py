@@ -0,0 +1,274 @@
+#value_index.py distinct values of low-cardinality STRING columns, for grounding filters in SQL generation
+import os
+import json
+import time
+import sqlite3
+import tempfile
+import threading
+import logging
+from collections import defaultdict
+from google.api_core.exceptions import GoogleAPIError
+from text_utils import tokenize
+from preflight import preflight, execution_config, QueryBudgetExceeded
+
+logger = logging.getLogger(__name__)
+
+# SQLite file holding the index across restarts (empty = in-memory only)
+VALUE_INDEX_DB = os.environ.get(
+    "VALUE_INDEX_DB", os.path.join(tempfile.gettempdir(), "datagpt_value_index.sqlite")
+)
+# Columns with more distinct values than this are not indexed
+VALUE_INDEX_MAX_DISTINCT = int(os.environ.get("VALUE_INDEX_MAX_DISTINCT", "500"))
+VALUE_INDEX_MAX_COLUMNS = int(os.environ.get("VALUE_INDEX_MAX_COLUMNS", "60"))
+VALUE_INDEX_MAX_VALUE_LENGTH = int(os.environ.get("VALUE_INDEX_MAX_VALUE_LENGTH", "120"))
+# A table whose build failed (or was over budget) is not retried for this long
+VALUE_INDEX_RETRY_SECONDS = float(os.environ.get("VALUE_INDEX_RETRY_SECONDS", "900"))
+# Column/value pairs injected into the SQL prompt, and the share of a value's tokens the question must match
+VALUE_MATCHES_LIMIT = int(os.environ.get("VALUE_MATCHES_LIMIT", "12"))
+VALUE_MATCH_MIN_SCORE = float(os.environ.get("VALUE_MATCH_MIN_SCORE", "0.5"))
+
+def _similar(a, b):
+    """Cheap typo tolerance: equal, or one edit apart for tokens of 5+ characters."""
+    if a == b:
+        return True
+    if min(len(a), len(b)) < 5 or abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) == len(b):
+        return sum(x != y for x, y in zip(a, b)) == 1
+    short, long_ = sorted((a, b), key=len)
+    return any(long_[:i] + long_[i + 1:] == short for i in range(len(long_)))
+
+def build_token_index(columns):
+    """Inverted index {token: {(column, value)}} over the indexed values."""
+    index = defaultdict(set)
+    for column, values in columns.items():
+        for value in values:
+            for token in tokenize(value, keep_stopwords=True):
+                index[token].add((column, value))
+    return index
+
+def group_by_initial(tokens):
+    """{first character: [tokens]}, so typo matching only compares tokens that start alike."""
+    groups = defaultdict(list)
+    for token in tokens:
+        groups[token[:1]].append(token)
+    return groups
+
+def with_token_index(state):
+    state['tokens'] = build_token_index(state['columns'])
+    state['initials'] = group_by_initial(state['tokens'])
+    return state
+
+class SqliteStore:
+    """Local store for the per-table value lists."""
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS value_index_tables ("
+                "table_ref TEXT PRIMARY KEY, modified TEXT, built_at REAL, high_cardinality TEXT)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS value_index_values (table_ref TEXT, column_name TEXT, value TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS value_index_by_table ON value_index_values (table_ref)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def load(self, table_ref):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT modified, built_at, high_cardinality FROM value_index_tables WHERE table_ref = ?", (table_ref,)
+            ).fetchone()
+            if row is None:
+                return None
+            columns = defaultdict(list)
+            for column, value in conn.execute(
+                "SELECT column_name, value FROM value_index_values WHERE table_ref = ?", (table_ref,)
+            ):
+                columns[column].append(value)
+        return {'modified': row[0], 'built_at': row[1], 'high_cardinality': json.loads(row[2]), 'columns': dict(columns)}
+
+    def save(self, table_ref, state):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM value_index_values WHERE table_ref = ?", (table_ref,))
+            conn.executemany(
+                "INSERT INTO value_index_values (table_ref, column_name, value) VALUES (?, ?, ?)",
+                [(table_ref, column, value) for column, values in state['columns'].items() for value in values]
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO value_index_tables (table_ref, modified, built_at, high_cardinality) "
+                "VALUES (?, ?, ?, ?)",
+                (table_ref, state['modified'], state['built_at'], json.dumps(state['high_cardinality']))
+            )
+
+class ValueIndex:
+    """
+    Per-table index of the distinct values of low-cardinality STRING columns.
+
+    The index is built with two aggregate queries (approximate distinct
+    counts, then the values of the columns under VALUE_INDEX_MAX_DISTINCT)
+    and stored in SQLite. When the catalog reports a new last-modified
+    time it is rebuilt in the background while the previous values keep
+    serving; columns already known to be high-cardinality are not scanned
+    again.
+    """
+
+    def __init__(self, db_path=VALUE_INDEX_DB):
+        self.store = SqliteStore(db_path) if db_path else None
+        self._tables = {}  # table_ref -> state with 'columns' and the 'tokens' inverted index
+        self._building = set()
+        self._failed = {}  # table_ref -> monotonic time of the last failed build
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.lookups = 0
+        self.matched_lookups = 0
+
+    def get(self, table_ref):
+        state = self._tables.get(table_ref)
+        if state is None and self.store is not None:
+            try:
+                state = self.store.load(table_ref)
+            except sqlite3.Error as e:
+                logger.warning(f"Value index - could not read {table_ref}: {e}")
+            if state is not None:
+                with_token_index(state)
+                with self._lock:
+                    self._tables[table_ref] = state
+        return state
+
+    def values(self, table_ref, column):
+        """Indexed values of one column, or None when the column is not indexed."""
+        state = self.get(table_ref)
+        return state['columns'].get(column) if state else None
+
+    def refresh(self, client, entry):
+        """Rebuild a table's index now. Errors and over-budget scans are logged and leave the old index."""
+        table_ref = entry['table_ref']
+        previous = self.get(table_ref)
+        high_cardinality = set(previous['high_cardinality']) if previous else set()
+        candidates = [
+            column['name'] for column in entry['columns']
+            if column['type'] == "STRING" and column['mode'] != "REPEATED" and column['name'] not in high_cardinality
+        ][:VALUE_INDEX_MAX_COLUMNS]
+
+        columns = {}
+        try:
+            if candidates:
+                counts = self._query_row(client, "SELECT " + ", ".join(
+                    f"APPROX_COUNT_DISTINCT(`{name}`) AS `{name}`" for name in candidates
+                ) + f" FROM `{table_ref}`")
+                low = [name for name in candidates if (counts[name] or 0) <= VALUE_INDEX_MAX_DISTINCT]
+                high_cardinality |= set(candidates) - set(low)
+                if low:
+                    row = self._query_row(client, "SELECT " + ", ".join(
+                        f"ARRAY_AGG(DISTINCT `{name}` IGNORE NULLS LIMIT {VALUE_INDEX_MAX_DISTINCT}) AS `{name}`"
+                        for name in low
+                    ) + f" FROM `{table_ref}`")
+                    columns = {
+                        name: [value for value in (row[name] or []) if len(value) <= VALUE_INDEX_MAX_VALUE_LENGTH]
+                        for name in low
+                    }
+        except (QueryBudgetExceeded, GoogleAPIError) as e:
+            logger.warning(f"Value index - not built for {table_ref}: {e}")
+            with self._lock:
+                self._failed[table_ref] = time.monotonic()
+            return previous
+
+        state = {
+            'modified': entry['modified'],
+            'built_at': time.time(),
+            'high_cardinality': sorted(high_cardinality),
+            'columns': columns,
+        }
+        if self.store is not None:
+            try:
+                self.store.save(table_ref, state)
+            except sqlite3.Error as e:
+                logger.warning(f"Value index - could not store {table_ref}: {e}")
+        with_token_index(state)
+        with self._lock:
+            self._tables[table_ref] = state
+            self._failed.pop(table_ref, None)
+            self.builds += 1
+        logger.info(f"Value index - {table_ref}: {sum(map(len, columns.values()))} values in {len(columns)} columns")
+        return state
+
+    def _query_row(self, client, sql):
+        preflight(client, sql)
+        return next(iter(client.query(sql, job_config=execution_config()).result()))
+
+    def ensure(self, client, entry):
+        """
+        Return the table's index (possibly from before the last modification),
+        starting a background rebuild when it is missing or out of date.
+        """
+        table_ref = entry['table_ref']
+        state = self.get(table_ref)
+        if state is not None and state['modified'] == entry['modified']:
+            return state
+        with self._lock:
+            failed_at = self._failed.get(table_ref)
+            if table_ref in self._building or (failed_at and time.monotonic() - failed_at < VALUE_INDEX_RETRY_SECONDS):
+                return state
+            self._building.add(table_ref)
+
+        def build():
+            try:
+                self.refresh(client, entry)
+            finally:
+                with self._lock:
+                    self._building.discard(table_ref)
+
+        threading.Thread(target=build, name=f"value-index-{table_ref}", daemon=True).start()
+        return state
+
+    def lookup(self, client, entry, question, limit=VALUE_MATCHES_LIMIT):
+        """
+        Column/value pairs whose tokens appear (allowing one typo) in the question.
+
+        Returns:
+            List of {column, value, score} sorted by score, at most limit long
+        """
+        state = self.ensure(client, entry)
+        with self._lock:
+            self.lookups += 1
+        if not state or not state['tokens']:
+            return []
+
+        vocabulary = state['tokens']
+        scores = defaultdict(int)
+        for token in set(tokenize(question)):
+            matches = [token] if token in vocabulary else [
+                other for other in state['initials'].get(token[:1], ()) if _similar(token, other)
+            ]
+            for match in matches:
+                for pair in vocabulary[match]:
+                    scores[pair] += 1
+
+        results = []
+        for (column, value), matched in scores.items():
+            score = matched / max(1, len(set(tokenize(value, keep_stopwords=True))))
+            if score >= VALUE_MATCH_MIN_SCORE:
+                results.append({'column': column, 'value': value, 'score': round(min(score, 1.0), 2)})
+        results.sort(key=lambda match: (-match['score'], -len(match['value'])))
+        if results:
+            with self._lock:
+                self.matched_lookups += 1
+        return results[:limit]
+
+    def stats(self):
+        return {
+            'tables': len(self._tables),
+            'values': sum(sum(map(len, state['columns'].values())) for state in self._tables.values()),
+            'builds': self.builds,
+            'building': len(self._building),
+            'failed': len(self._failed),
+            'lookups': self.lookups,
+            'matched_lookups': self.matched_lookups,
+        }
+
+value_index = ValueIndex()
@@ -45,6 +45,27 @@ interface QueryResult {
   llm_recommendation?: string;
   query_description?: string;
   table_reference?: string;
+  pagination?: ResultPagination;
+  chart?: ChartSpec | null;
+}
+
+// Chart-ready points prepared by /api/bigquery (top-N categories or an LTTB-downsampled series)
+interface ChartSpec {
+  type: string;
+  x: { column: string; kind: 'category' | 'datetime' | 'number' };
+  y: { column: string | null };
+  points: [string | number, number][];
+  source_rows: number;
+  reduction: 'top_n' | 'lttb' | null;
+  other_categories?: number;
+}
+
+// Server-side paging state returned by /api/bigquery and /api/bigquery/page
+interface ResultPagination {
+  total_rows: number | null;
+  offset: number;
+  has_more: boolean;
+  cursor: string | null;
 }
 
 interface DataGPTProps {
@@ -84,6 +105,8 @@ const DataGPT: React.FC<DataGPTProps> = ({ onBack }) => {
   const [showTablePreview, setShowTablePreview] = useState(false);
   // New state for chat history
   const [chatHistory, setChatHistory] = useState<ChatHistoryItem[]>([]);
+  // Identifies this conversation so follow-ups ("only 2024", "top 5") are answered from the previous result
+  const sessionId = useRef<string>(`session_${Date.now()}_${Math.random().toString(36).slice(2)}`);
 
   // Refs for scrolling
   const chatHistoryRef = useRef<HTMLDivElement>(null);
@@ -105,6 +128,20 @@ const DataGPT: React.FC<DataGPTProps> = ({ onBack }) => {
     setIsFullScreen(!isFullScreen);
   };
 
+  // POST to a query endpoint; when the dry-run estimate is above the bytes budget (409),
+  // ask the user and resend with confirm_cost so the query runs anyway
+  const postWithCostConfirmation = async (url: string, body: Record<string, unknown>) => {
+    try {
+      return await axios.post(url, body);
+    } catch (err) {
+      if (axios.isAxiosError(err) && err.response?.status === 409 && err.response.data?.requires_confirmation
+          && window.confirm(err.response.data.message)) {
+        return axios.post(url, { ...body, confirm_cost: true });
+      }
+      throw err;
+    }
+  };
+
   const handleSubmit = async () => {
     // Clear previous errors and results
     setError(null);
@@ -127,12 +164,13 @@ const DataGPT: React.FC<DataGPTProps> = ({ onBack }) => {
       const [project_id, dataset_name] = selectedDataset.split('.');
 
       // Gemini endpoint request
-      const geminiResponse = await axios.post('http://127.0.0.1:8080/gemini', {
+      const geminiResponse = await postWithCostConfirmation('http://127.0.0.1:8080/gemini', {
         query,
         table_name: `${project_id}.${dataset_name}.${selectedTable}`,
         project_id,
         dataset_id: dataset_name,
-        table_id: selectedTable
+        table_id: selectedTable,
+        session_id: sessionId.current
       });
 
       // Check for error in Gemini response
@@ -144,13 +182,17 @@ const DataGPT: React.FC<DataGPTProps> = ({ onBack }) => {
 
       const generatedSqlQuery = geminiResponse.data.sql_query;
       const queryDescription = geminiResponse.data.query_description;
+      // Handle to the query job /gemini already ran, so /api/bigquery can reuse its results
+      const resultHandle = geminiResponse.data.result_handle;
 
       // BigQuery endpoint request
-      const bigqueryResponse = await axios.post('http://127.0.0.1:8080/api/bigquery', {
+      const bigqueryResponse = await postWithCostConfirmation('http://127.0.0.1:8080/api/bigquery', {
         sql_query: generatedSqlQuery,
         original_query: query,
         query_description: queryDescription,
-        table_reference: `${project_id}.${dataset_name}.${selectedTable}`
+        result_handle: resultHandle,
+        table_reference: `${project_id}.${dataset_name}.${selectedTable}`,
+        session_id: sessionId.current
       });
 
       // Check for error in BigQuery response
@@ -194,14 +236,43 @@ const DataGPT: React.FC<DataGPTProps> = ({ onBack }) => {
     }
   };
 
+  // Fetch the next page of a result with the cursor from the backend (reads the cached result, no new query)
+  const handleLoadMoreRows = async (itemId: string) => {
+    const item = chatHistory.find(entry => entry.id === itemId);
+    const cursor = item?.result.pagination?.cursor;
+    if (!cursor) return;
+
+    try {
+      const pageResponse = await axios.post('http://127.0.0.1:8080/api/bigquery/page', { cursor });
+      setChatHistory(prev => prev.map(entry => entry.id === itemId ? {
+        ...entry,
+        result: {
+          ...entry.result,
+          data: [...entry.result.data, ...pageResponse.data.data],
+          pagination: pageResponse.data.pagination
+        }
+      } : entry));
+    } catch (err) {
+      setError('Failed to load more rows');
+      console.error(err);
+    }
+  };
+
   const renderChartForItem = (item: ChatHistoryItem) => {
-    const chartData = item.result.data.map((row) => {
-      const keys = Object.keys(row);
-      return {
-        name: row[keys[0]],
-        y: Number(row[keys[1]]),
-      };
-    });
+    const chart = item.result.chart;
+    const chartData = chart
+      ? chart.points.map(([name, y]) => ({ name, y }))
+      : item.result.data.map((row) => {
+        const keys = Object.keys(row);
+        return {
+          name: row[keys[0]],
+          y: Number(row[keys[1]]),
+        };
+      });
+    const xColumn = chart ? chart.x.column : item.result.columns[0];
+    const yColumn = chart ? chart.y.column ?? 'Count' : item.result.columns[1];
+    // Dates arrive as epoch milliseconds and are plotted on a datetime axis
+    const datetimeAxis = chart?.x.kind === 'datetime' && (item.chartType || 'column') !== 'pie';
 
     const chartOptions = {
       chart: {
@@ -213,29 +284,32 @@ const DataGPT: React.FC<DataGPTProps> = ({ onBack }) => {
       },
       colors: COLOR_PALETTES[selectedColorPalette],
       xAxis: {
+        type: datetimeAxis ? 'datetime' : undefined,
         categories:
-          (item.chartType || 'column') !== 'pie'
+          (item.chartType || 'column') !== 'pie' && !datetimeAxis
             ? chartData.map((item) => item.name)
             : undefined,
         title: {
-          text: item.result.columns[0],
+          text: xColumn,
         },
       },
       yAxis:
         (item.chartType || 'column') !== 'pie'
           ? {
             title: {
-              text: item.result.columns[1],
+              text: yColumn,
             },
           }
           : undefined,
       series: [
         {
-          name: item.result.columns[1],
+          name: yColumn,
           data:
             (item.chartType || 'column') === 'pie'
               ? chartData.map((item) => ({ name: item.name, y: item.y }))
-              : chartData.map((item) => item.y),
+              : datetimeAxis
+                ? chartData.map((item) => [item.name, item.y])
+                : chartData.map((item) => item.y),
         },
       ],
       plotOptions: {
@@ -402,6 +476,14 @@ const DataGPT: React.FC<DataGPTProps> = ({ onBack }) => {
                   </tbody>
                 </table>
               </div>
+              {item.result.pagination?.has_more && (
+                <button
+                  onClick={() => handleLoadMoreRows(item.id)}
+                  className="ml-8 mt-2 text-sm text-blue-700 hover:underline"
+                >
+                  Load more rows ({item.result.data.length} of {item.result.pagination.total_rows})
+                </button>
+              )}
             </div>
 
             {/* Descriptive Sections */}
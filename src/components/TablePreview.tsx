@@ -11,6 +11,8 @@ interface TablePreviewProps {
   projectId: string;
   datasetId: string;
   tableId: string;
+  // Optional column projection; wide tables then only ship these columns
+  columns?: string[];
   onClose: () => void;
 }
 
@@ -18,6 +20,7 @@ const TablePreview: React.FC<TablePreviewProps> = ({
   projectId,
   datasetId,
   tableId,
+  columns,
   onClose,
 }) => {
   const [previewData, setPreviewData] = useState<{
@@ -34,6 +37,7 @@ const TablePreview: React.FC<TablePreviewProps> = ({
           project_id: projectId,
           dataset_id: datasetId,
           table_id: tableId,
+          columns: columns?.join(','),
         },
       });
 
@@ -49,7 +53,7 @@ const TablePreview: React.FC<TablePreviewProps> = ({
     } finally {
       setIsLoading(false);
     }
-  }, [projectId, datasetId, tableId]);
+  }, [projectId, datasetId, tableId, columns]);
 
   React.useEffect(() => {
     fetchTablePreview();